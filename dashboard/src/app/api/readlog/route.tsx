@@ -3,6 +3,9 @@ import { load_logfile } from "@/lib/report";
 
 export async function POST(request: NextRequest) {
   const body = await request.json();
-  const content = await load_logfile(body.filename, body.filepath, body.repologpath);
-  return Response.json({ filecontent: content })
+  const page = await load_logfile(
+    body.filename, body.filepath, body.repologpath,
+    { offset: body.offset, before: body.before, max_bytes: body.max_bytes }
+  );
+  return Response.json(page)
 }
@@ -4,7 +4,7 @@ import Button from '@mui/material/Button';
 import Card from "@mui/material/Card";
 import CardContent from "@mui/material/CardContent";
 import Typography from "@mui/material/Typography";
-import type { tBorgLog, tBorgRepo } from "@/lib/report";
+import type { tBorgLog, tBorgRepo, tLogPage } from "@/lib/report";
 import Paper from '@mui/material/Paper';
 import { useRouter } from 'next/navigation'
 import { get_status_color } from "@/components/reporter"
@@ -21,8 +21,13 @@ import DialogContentText from '@mui/material/DialogContentText';
 import DialogTitle from '@mui/material/DialogTitle';
 import { Backdrop, CircularProgress } from '@mui/material';
 
-export async function readlog(repo: tBorgRepo, logfile: tBorgLog) {
-  const json_body = { 'filepath': logfile.fullpath, 'filename': logfile.name, 'repologpath': repo.logspath }
+const FOLLOW_INTERVAL_MS = 2000;
+
+// Read a page of the log, by default its end, or from/before a byte offset
+export async function readlog(
+  repo: tBorgRepo, logfile: tBorgLog, page: { offset?: number, before?: number } = {}
+): Promise<tLogPage> {
+  const json_body = { 'filepath': logfile.fullpath, 'filename': logfile.name, 'repologpath': repo.logspath, ...page }
   const response = await fetch("/api/readlog", { method: "post", body: JSON.stringify(json_body) });
   return await response.json()
 }
@@ -54,28 +59,61 @@ export function LogDetailsContent({ repo, logfile, closeLogAction, setLoadingAct
     setLoadingAction: React.Dispatch<React.SetStateAction<boolean>>
   }
 ) {
-  const [content, setContent] = React.useState<string | undefined>(undefined);
+  // Content shown, from the start to the end byte offsets of the log, only the end of large logs is loaded first
+  const [view, setView] = React.useState<tLogPage | undefined>(undefined);
+  const [following, setFollowing] = React.useState(false);
 
   const handleClose = () => {
-    setContent(undefined);
+    setView(undefined);
+    setFollowing(false);
     closeLogAction();
   };
 
+  const loadEarlier = () => {
+    if (!logfile || !view) return;
+    setLoadingAction(true);
+    readlog(repo, logfile, { before: view.start }).then((page) => {
+      setLoadingAction(false);
+      // Pages are only joined if contiguous
+      setView((view) => view && page.end === view.start
+        ? { ...view, filecontent: page.filecontent + view.filecontent, start: page.start } : view);
+    }).catch((error) => {
+      setLoadingAction(false);
+      console.log(error);
+    });
+  };
+
   React.useEffect(() => {
     if (logfile) {
       setLoadingAction(true);
-      readlog(repo, logfile).then((data) => {
+      readlog(repo, logfile).then((page) => {
         setLoadingAction(false);
-        setContent(data.filecontent);
+        setView(page);
       }).catch((error) => {
+        setLoadingAction(false);
         console.log(error);
       });
     }
   }, [logfile, repo, setLoadingAction]);
 
+  // Append the lines written since the last read, for backups still running
+  const end = view?.end;
+  React.useEffect(() => {
+    if (!following || !logfile || end === undefined) return;
+    const timer = setInterval(() => {
+      readlog(repo, logfile, { offset: end }).then((page) => {
+        setView((view) => view && page.start === view.end && page.end > page.start
+          ? { ...view, filecontent: view.filecontent + page.filecontent, end: page.end, size: page.size } : view);
+      }).catch((error) => {
+        console.log(error);
+      });
+    }, FOLLOW_INTERVAL_MS);
+    return () => clearInterval(timer);
+  }, [following, logfile, repo, end]);
+
   return (
     <Dialog
-      open={content ? true : false}
+      open={view ? true : false}
       onClose={handleClose}
       scroll='paper'
       fullWidth
@@ -88,15 +126,19 @@ export function LogDetailsContent({ repo, logfile, closeLogAction, setLoadingAct
         <Typography variant="caption">{logfile?.fullpath}</Typography>
       </DialogTitle>
       <DialogContent dividers={true}>
+        {view && view.start > 0 && (
+          <Button size="small" onClick={loadEarlier}>Load earlier lines</Button>
+        )}
         <DialogContentText
           id="scroll-dialog-description"
           tabIndex={-1}
           sx={{ whiteSpace: "pre-wrap" }}
         >
-          {content}
+          {view?.filecontent}
         </DialogContentText>
       </DialogContent>
       <DialogActions>
+        <Button onClick={() => setFollowing(!following)}>{following ? "Stop following" : "Follow"}</Button>
         <Button onClick={handleClose}>Close</Button>
       </DialogActions>
     </Dialog>
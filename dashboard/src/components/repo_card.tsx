@@ -28,6 +28,11 @@ export default function RepoCard({ repo }: { repo: tBorgRepo }) {
           <Typography variant="h5" component="div" sx={{ mt: 1, mb: 1 }} align="center">
             {repo.name}
           </Typography>
+          {repo.scan_status === "timeout" && (
+            <Typography variant="caption" component="div" align="center" color="warning.main">
+              {`Last scan timed out, data from ${repo.last_scan ? datetime_iso_to_short(repo.last_scan) : "a previous scan"}`}
+            </Typography>
+          )}
           <Divider variant="middle" />
 
           <TableContainer component={Paper}>
@@ -4,7 +4,7 @@ import Button from "@mui/material/Button";
 import Card from "@mui/material/Card";
 import CardContent from "@mui/material/CardContent";
 import Typography from "@mui/material/Typography";
-import type { tBorgArchive, tBorgSize, tBorgRepo } from "@/lib/report";
+import type { tBorgArchive, tBorgSize, tBorgRepo, tRepoAggregates } from "@/lib/report";
 import Paper from "@mui/material/Paper";
 import Table from "@mui/material/Table";
 import TableBody from "@mui/material/TableBody";
@@ -56,8 +56,23 @@ export default function RepoDetails({
   );
 }
 
+// Sizes by day, or by week if the history is longer than the daily buckets, from the repo aggregates
+function aggregates_dataset(aggregates: tRepoAggregates) {
+  const daily_archives = aggregates.daily.archives.reduce((total, count) => total + count, 0);
+  const buckets = daily_archives == aggregates.totals.archives ? aggregates.daily : aggregates.weekly;
+  return buckets.start.map((start, i) => (
+    {
+      date: new Date(start),
+      osize: buckets.osize[i],
+      dsize: buckets.dsize[i],
+      csize: buckets.csize[i],
+    }
+  ));
+}
+
 export function RepoGraph({ repo }: { repo: tBorgRepo }) {
-  const dataset = Object.values(repo.archives).map((adata) => (
+  // Reports from previous reporter versions have no aggregates
+  const dataset = repo.aggregates ? aggregates_dataset(repo.aggregates) : Object.values(repo.archives).map((adata) => (
     {
       date: adata.datetime ? new Date(adata.datetime) : null,
       osize: adata.sizes.osize,
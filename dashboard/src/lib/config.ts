@@ -16,6 +16,7 @@ export type tReporterConfig = {
   dedupe_path: string,
   logs_basedir: string,
   repos_basedir: string,
+  control_socket?: string,
   discord?: {
     webhook: string,
     webhook_user?: string,
@@ -1,11 +1,13 @@
 import { promisify } from "util";
-import { exec } from "child_process";
+import { exec, execFile } from "child_process";
 import { promises as fs } from "fs";
 import { join } from 'node:path';
 import { tmpdir } from 'node:os';
 import { get_config } from "@/lib/config";
 const exec_async = promisify(exec);
+const execfile_async = promisify(execFile);
 
+const SSH_PREFIX = "ssh://";
 const SSHFS_PREFIX = "sshfs://";
 const SSHFS_MOUNTS_PREFIX = "sshfsmount-";
 const SSHFS_MOUNTS_DURATION_MS = 600000;
@@ -23,6 +25,45 @@ export async function getlocapath(logname: string, logfilepath: string, repologp
   return logfilepath;
 }
 
+export function is_remote_logpath(repologpath: string): boolean {
+  return repologpath.startsWith(SSH_PREFIX);
+}
+
+// Read up to length bytes of a log file of a ssh:// log path from the offset, with the file size, in one command
+export async function read_remote_logrange(
+  logfilepath: string, repologpath: string, offset: number, length: number
+): Promise<{ size: number, data: Buffer }> {
+  const url = new URL(repologpath);
+  const destination = url.username ? `${url.username}@${url.hostname}` : url.hostname;
+  const port = url.port ? ["-p", url.port] : [];
+  // The command is run by the remote shell, quote the path for it and only pass integers
+  const quoted = `'${logfilepath.replaceAll("'", "'\\''")}'`;
+  const start = Math.max(0, Math.trunc(offset) || 0) + 1;
+  length = Math.max(0, Math.trunc(length) || 0);
+  const { stdout } = await execfile_async(
+    "ssh",
+    [...port, destination, `stat -c %s -- ${quoted} && tail -c +${start} -- ${quoted} | head -c ${length}`],
+    { maxBuffer: length + 64, encoding: "buffer" }
+  );
+  const eol = stdout.indexOf("\n");
+  return { size: parseInt(stdout.subarray(0, eol).toString()), data: stdout.subarray(eol + 1) };
+}
+
+// Read up to length bytes of a local (or mounted) log file from the offset, with the file size
+export async function read_local_logrange(
+  logfilepath: string, offset: number, length: number
+): Promise<{ size: number, data: Buffer }> {
+  const file = await fs.open(logfilepath, "r");
+  try {
+    const size = (await file.stat()).size;
+    const buffer = Buffer.alloc(Math.max(0, Math.min(length, size - offset)));
+    const { bytesRead } = await file.read(buffer, 0, buffer.length, offset);
+    return { size: size, data: buffer.subarray(0, bytesRead) };
+  } finally {
+    await file.close();
+  }
+}
+
 async function sshfs_mount(repologpath: string) {
   // Only actually mounts if it isn't already
   if (!(repologpath in SSHFS_MOUNTS)) {
@@ -1,7 +1,9 @@
 // This module is server side only and cannot be used client side as it's reading files from filesystem
 import { promises as fs } from "fs";
+import { dirname, join } from "node:path";
 import { get_config } from "@/lib/config";
-import { getlocapath } from "@/lib/logfs";
+import { getlocapath, is_remote_logpath, read_local_logrange, read_remote_logrange } from "@/lib/logfs";
+import { decode_compact, is_compact } from "@/lib/reportformat";
 
 export type tBorgSize = {
   osize: number;
@@ -22,10 +24,46 @@ export type tBorgArchive = {
   duration: number | null;
   log: tBorgLog;
   name: string;
+  id?: string | null;
   comment?: string;
   sizes: tBorgSize;
   nfiles: number;
 };
+// Archives and runs grouped by day or week, a value per bucket in each column
+export type tAggregateBuckets = {
+  start: string[];
+  archives: number[];
+  // Original and compressed sizes of the last archive of the bucket, original size difference with the previous bucket
+  osize: (number | null)[];
+  osize_delta: (number | null)[];
+  csize: (number | null)[];
+  // Deduplicated size added by the archives of the bucket
+  dsize: number[];
+  runs: number[];
+  success_rate: (number | null)[];
+  duration_p50: (number | null)[];
+  duration_p90: (number | null)[];
+};
+export type tRepoAggregates = {
+  totals: {
+    archives: number;
+    first: string | null;
+    last: string | null;
+    osize: number;
+    csize: number;
+    dsize: number;
+    dedup_ratio: number | null;
+    duration_mean: number | null;
+    duration_p50: number | null;
+    duration_p90: number | null;
+    duration_p99: number | null;
+    runs: number;
+    success_rate: number | null;
+  };
+  // Daily buckets of the last 90 days, weekly buckets of the whole history
+  daily: tAggregateBuckets;
+  weekly: tAggregateBuckets;
+};
 export type tBorgRepo = {
   archives: { [k: string]: tBorgArchive };
   last_run: tBorgLog | null;
@@ -38,10 +76,39 @@ export type tBorgRepo = {
   sizes: tBorgSize;
   chunks: number;
   status: boolean | null;
+  // Result of the last scan: scanned, unchanged or timeout (previous data kept)
+  scan_status?: string | null;
+  last_scan?: string | null;
+  // Computed at scan time
+  aggregates?: tRepoAggregates;
+};
+export type tTimingSpan = {
+  count: number;
+  seconds: number;
+  bytes: number;
+};
+export type tScanLock = {
+  // Time waited for a concurrent scan, and requests waiting for it, done by this scan
+  wait_seconds: number;
+  coalesced_requests: number;
+  // Whether this scan follows a concurrent one, and total requests done by concurrent scans
+  follow_up: boolean;
+  total_coalesced: number;
 };
 export type tBorgReport = {
   timestamp: string;
   repos: { [k: string]: tBorgRepo } | null | undefined;
+  // Exported while a scan is running, some repos still have their previous data
+  partial?: boolean;
+  // Coordination with the other scans of the report
+  scan_lock?: tScanLock | null;
+  // Sharded reports: repo archives and logfiles file, relative to the report
+  shards?: { [k: string]: string };
+  // Scan phases timings, in total and by repo
+  timings?: {
+    spans: { [k: string]: tTimingSpan };
+    repos: { [k: string]: { [k: string]: tTimingSpan } };
+  };
 } | null | undefined;
 
 // Report caching to avoid reloading
@@ -52,8 +119,13 @@ export async function load_report_data(force: boolean = false) {
   if (!report_cache || force) {
     try {
       const repath = await get_config();
-      const file = await fs.readFile(repath.reporter.report_path, "utf8");
-      report_cache = JSON.parse(file);
+      const report_path = repath.reporter.report_path;
+      if (is_compact(report_path)) {
+        report_cache = decode_compact(await fs.readFile(report_path)) as tBorgReport;
+      } else {
+        report_cache = JSON.parse(await fs.readFile(report_path, "utf8"));
+      }
+      await load_report_shards(report_cache, report_path);
     } catch (error) {
       console.log("Error loading file:" + error);
     }
@@ -61,14 +133,71 @@ export async function load_report_data(force: boolean = false) {
   return report_cache;
 }
 
-export async function load_logfile(logname: string, logfilepath: string, repologpath: string) {
+// Add the archives and logfiles of each repo of a sharded report
+async function load_report_shards(report: tBorgReport, report_path: string) {
+  if (report?.shards && report.repos) {
+    for (const [repo_name, shard] of Object.entries(report.shards)) {
+      const repo = report.repos[repo_name];
+      if (repo) Object.assign(repo, JSON.parse(await fs.readFile(join(dirname(report_path), shard), "utf8")));
+    }
+    delete report.shards;
+  }
+}
+
+export type tLogPage = {
+  filecontent: string;
+  // Byte offsets of the content in the file, the next page starts at end
+  start: number;
+  end: number;
+  size: number;
+};
+
+const LOG_PAGE_SIZE = 256 * 1024;
+
+// Offsets come from requests, only use positive integers
+function as_offset(value: unknown): number {
+  return Math.max(0, Math.trunc(Number(value)) || 0);
+}
+
+async function read_logrange(logname: string, logfilepath: string, repologpath: string, offset: number, length: number) {
+  if (is_remote_logpath(repologpath)) return await read_remote_logrange(logfilepath, repologpath, offset, length);
+  return await read_local_logrange(await getlocapath(logname, logfilepath, repologpath), offset, length);
+}
+
+// Read a page of a log file, without loading it entirely: from an offset up to the last complete line, before an
+// offset from the first complete line, or by default the end of the file
+export async function load_logfile(
+  logname: string, logfilepath: string, repologpath: string,
+  page: { offset?: number, before?: number, max_bytes?: number } = {}
+): Promise<tLogPage> {
+  const max_bytes = Math.min(as_offset(page.max_bytes) || LOG_PAGE_SIZE, LOG_PAGE_SIZE);
   try {
-    const fullpath = await getlocapath(logname, logfilepath, repologpath);
-    return await fs.readFile(fullpath, "utf8");
+    let start: number;
+    let data: Buffer;
+    let size: number;
+    if (page.offset != null) {
+      start = as_offset(page.offset);
+      ({ size, data } = await read_logrange(logname, logfilepath, repologpath, start, max_bytes));
+      // Only complete lines, the last one may still be written, unless a single line fills the page
+      const eol = data.lastIndexOf("\n");
+      if (eol >= 0 || data.length < max_bytes) data = data.subarray(0, eol + 1);
+    } else {
+      const end = page.before != null
+        ? as_offset(page.before)
+        : (await read_logrange(logname, logfilepath, repologpath, 0, 0)).size;
+      start = Math.max(0, end - max_bytes);
+      ({ size, data } = await read_logrange(logname, logfilepath, repologpath, start, end - start));
+      // Skip the partial first line
+      if (start > 0) {
+        const eol = data.indexOf("\n");
+        start += eol + 1;
+        data = data.subarray(eol + 1);
+      }
+    }
+    return { filecontent: data.toString("utf8"), start: start, end: start + data.length, size: size };
   } catch (error) {
     const errorstr = `Error reading logfile at ${logfilepath}:\n ${error}`;
     console.log(errorstr);
-    return errorstr;
+    return { filecontent: errorstr, start: 0, end: 0, size: 0 };
   }
-
 }
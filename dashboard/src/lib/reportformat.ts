@@ -0,0 +1,69 @@
+// Decoder of the compact report format written by the reporter (see reporter reportformat.py)
+import { inflateSync } from "zlib";
+
+const COMPACT_EXTENSION = ".bdr";
+const COMPACT_MAGIC = "BDR1";
+const ARCHIVE_FIELDS = ["name", "id", "duration", "comment", "nfiles"];
+const ARCHIVE_DATETIME_FIELDS = ["datetime", "datetime_end"];
+const SIZE_FIELDS = ["osize", "csize", "dsize"];
+
+type tColumns = { [k: string]: any[] };
+type tRecord = { [k: string]: any };
+
+export function is_compact(filename: string): boolean {
+  return filename.endsWith(COMPACT_EXTENSION);
+}
+
+// Epoch microseconds to the naive iso format used in json reports
+function decode_datetime(value: number | string | null): string | null {
+  if (typeof value != "number") return value;
+  const micros = ((value % 1000000) + 1000000) % 1000000;
+  const iso = new Date((value - micros) / 1000).toISOString().slice(0, 19);
+  return micros ? `${iso}.${String(micros).padStart(6, "0")}` : iso;
+}
+
+function decode_logs(columns: tColumns, paths: string[]): tRecord[] {
+  return columns.name.map((name: string, i: number) => ({
+    name: name,
+    fullpath: `${paths[columns.dir[i]]}${name}`,
+    datetime: decode_datetime(columns.datetime[i]),
+    status: columns.status[i],
+    archive: columns.archive[i],
+  }));
+}
+
+function decode_repo(encoded: tRecord): tRecord {
+  const { archives: archive_columns, logfiles: log_columns, paths = [], ...repo } = encoded;
+  if (archive_columns) {
+    const logs = decode_logs(archive_columns.logs, paths);
+    let log_index = 0;
+    repo.archives = {};
+    archive_columns.name.forEach((name: string, i: number) => {
+      const archive: tRecord = {};
+      ARCHIVE_FIELDS.forEach((field) => archive[field] = archive_columns[field][i]);
+      ARCHIVE_DATETIME_FIELDS.forEach((field) => archive[field] = decode_datetime(archive_columns[field][i]));
+      archive.sizes = null;
+      if (archive_columns.sized[i]) {
+        archive.sizes = {};
+        SIZE_FIELDS.forEach((field) => archive.sizes[field] = archive_columns[field][i]);
+      }
+      archive.log = archive_columns.log[i] ? logs[log_index++] : null;
+      repo.archives[name] = archive;
+    });
+  }
+  if (log_columns) {
+    repo.logfiles = Object.fromEntries(decode_logs(log_columns, paths).map((log) => [log.name, log]));
+  }
+  return repo;
+}
+
+export function decode_compact(data: Buffer): tRecord {
+  if (data.subarray(0, COMPACT_MAGIC.length).toString() != COMPACT_MAGIC) {
+    throw new Error("Not a compact borgdash report");
+  }
+  const report = JSON.parse(inflateSync(data.subarray(COMPACT_MAGIC.length)).toString("utf8"));
+  report.repos = Object.fromEntries(
+    Object.entries(report.repos ?? {}).map(([name, repo]) => [name, decode_repo(repo as tRecord)])
+  );
+  return report;
+}
@@ -1,4 +1,6 @@
 import { ChildProcess, spawn } from "child_process";
+import { existsSync } from "fs";
+import { connect } from "node:net";
 import { get_config } from "@/lib/config";
 
 export type tRescanStatus = { status: "success" | "error" | "running" | null, stdout: string | null, stderr: string | null };
@@ -7,13 +9,48 @@ export type tRescanStatus = { status: "success" | "error" | "running" | null, st
 let rescanProcess: ChildProcess | null = null;
 let rescanStdout: string = "";
 let rescanStderr: string = "";
+// Status of the rescan requested to the reporter daemon, if running
+let daemonStatus: tRescanStatus | null = null;
+const DEFAULT_CONTROL_SOCKET = "/tmp/borgdash_reporter.sock";
+
+// Send a request to the reporter daemon control socket, resolves with its json response
+function daemon_request(socket_path: string, request: object): Promise<{ status: string, error?: string }> {
+  return new Promise((resolve, reject) => {
+    const client = connect(socket_path, () => client.write(JSON.stringify(request) + "\n"));
+    let data = "";
+    let responded = false;
+    client.on("data", chunk => {
+      data = data.concat(chunk.toString());
+      const eol = data.indexOf("\n");
+      if (eol >= 0 && !responded) {
+        responded = true;
+        client.end();
+        try {
+          resolve(JSON.parse(data.slice(0, eol)));
+        } catch (error) {
+          reject(error);
+        }
+      }
+    });
+    client.on("error", reject);
+    // The daemon exited before responding
+    client.on("close", () => {
+      if (!responded) reject(new Error("Reporter daemon closed the connection without responding"));
+    });
+  });
+}
+
+// Errors of a daemon that is not running, its socket file left behind
+const DAEMON_DOWN_ERRORS = ["ENOENT", "ECONNREFUSED"];
 
 export function rescan_is_running() {
+  if (daemonStatus) return daemonStatus.status == "running";
   // If there is a process, and no exit code, it is running
   return (rescanProcess && rescanProcess.exitCode == null && !rescanProcess.killed) ? true : false;
 }
 
 export function rescan_get_status() {
+  if (daemonStatus) return daemonStatus;
   const scan_status: tRescanStatus = { status: null, stdout: null, stderr: null };
   if (rescanProcess) {
     if (rescanProcess.exitCode == null && !rescanProcess.killed) scan_status.status = "running";
@@ -27,13 +64,41 @@ export function rescan_get_status() {
 }
 
 export async function rescan_stop() {
+  if (daemonStatus) {
+    console.log("Rescan requested to the reporter daemon cannot be stopped");
+    return;
+  }
   console.log("process killed");
   rescanProcess?.kill();
 }
 
 export async function rescan_start() {
   const config = await get_config();
-  rescanProcess = spawn(config.dashboard.reporter_path, [], { timeout: config.dashboard.rescan_timeout_ms });
+
+  // If the reporter daemon is running, request the scan from it instead of starting a reporter
+  const socket_path = config.reporter.control_socket ?? DEFAULT_CONTROL_SOCKET;
+  if (existsSync(socket_path)) {
+    daemonStatus = { status: "running", stdout: null, stderr: null };
+    daemon_request(socket_path, { command: "rescan", wait: true })
+      .then(response => {
+        daemonStatus = { status: response.status == "success" ? "success" : "error", stdout: null, stderr: response.error ?? null };
+      })
+      .catch(error => {
+        if (DAEMON_DOWN_ERRORS.includes(error?.code)) {
+          console.log(`Reporter daemon not running (${error.code}), starting the reporter`);
+          rescan_spawn(config.dashboard.reporter_path, config.dashboard.rescan_timeout_ms);
+          return;
+        }
+        daemonStatus = { status: "error", stdout: null, stderr: `${error}` };
+      });
+    return;
+  }
+  rescan_spawn(config.dashboard.reporter_path, config.dashboard.rescan_timeout_ms);
+}
+
+function rescan_spawn(reporter_path: string, timeout_ms: number) {
+  daemonStatus = null;
+  rescanProcess = spawn(reporter_path, [], { timeout: timeout_ms });
   rescanStdout = "";
   rescanStderr = "";
 
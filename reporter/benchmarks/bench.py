@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Reporter benchmarks.
+
+Scans repositories served by fake_borg.py with generated log directories, and times the main reporter stages.
+Results are written as json, and can be compared with the results of a previous run:
+
+  python benchmarks/bench.py --output after.json --compare before.json
+"""
+
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+# Benchmark the working tree rather than an installed version
+sys.path.insert(0, str(BENCH_DIR.parent / "src"))
+sys.path.insert(0, str(BENCH_DIR))
+
+from borgdash_reporter.config import Config  # noqa: E402
+from borgdash_reporter.repo import BorgLog, BorgLogIndex, BorgRepo  # noqa: E402
+from borgdash_reporter.reporter import BorgReporter  # noqa: E402
+from gen_logs import generate_logs  # noqa: E402
+
+
+def _parse_args() -> Namespace:
+  parser = ArgumentParser(description="Borgdash reporter benchmarks")
+  parser.add_argument("--repos", type=int, default=4, help="Number of repositories")
+  parser.add_argument("--archives", type=int, default=500, help="Number of archives (and logs) per repository")
+  parser.add_argument("--max-list-lines", type=int, default=5000, help="Maximum number of files listed in a log")
+  parser.add_argument("--latency", type=float, default=0.0, help="Fake borg latency per call, in seconds")
+  parser.add_argument("--workers", type=int, default=1, help="Reporter scan_workers setting")
+  parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each benchmark")
+  parser.add_argument("--startup-only", action="store_true", help="Only run the reporter startup benchmarks")
+  parser.add_argument("--workdir", help="Directory for generated data, a temporary one by default")
+  parser.add_argument("--output", help="Results json file")
+  parser.add_argument("--compare", help="Previous results json file to compare with")
+  return parser.parse_args()
+
+
+def setup(workdir: Path, args: Namespace) -> Config:
+  """Create the fake borg, logs and reporter configuration."""
+  borg = workdir / "borg"
+  borg.write_text(f"#!/bin/sh\nexec {sys.executable} {BENCH_DIR / 'fake_borg.py'} \"$@\"\n")
+  borg.chmod(0o755)
+
+  repos = {}
+  for i in range(args.repos):
+    repo = f"repo{i}"
+    generate_logs(workdir / "logs" / repo, str(workdir / "repos" / repo), args.archives, args.max_list_lines, seed=i)
+    repos[repo] = {"repo_path": repo, "log_path": repo}
+
+  reporter_config = {
+    "report_path": str(workdir / "report.json"),
+    "borg_path": str(borg),
+    "dedupe_path": str(workdir / "dedupe.json"),
+    "logs_basedir": str(workdir / "logs"),
+    "repos_basedir": str(workdir / "repos"),
+    "scan_workers": args.workers,
+    "ssh_multiplexing": False,
+  }
+  (workdir / "config_default.yaml").write_text(json.dumps({"reporter": reporter_config}))
+  (workdir / "config.yaml").write_text(json.dumps({"repos": repos}))
+  os.environ["FAKE_BORG_ARCHIVES"] = str(args.archives)
+  os.environ["FAKE_BORG_LATENCY"] = str(args.latency)
+  return Config(str(workdir / "config.yaml"), str(workdir / "config_default.yaml"))
+
+
+def run(name: str, repeat: int, bench: Callable[[], Dict[str, Any]], setup: Callable[[], None] = lambda: None):
+  """Time a benchmark repeat times, setup isn't timed. The benchmark can return extra metrics."""
+  runs: List[float] = []
+  extra: Dict[str, Any] = {}
+  for _ in range(repeat):
+    setup()
+    start = time.perf_counter()
+    extra = bench() or {}
+    runs.append(time.perf_counter() - start)
+  result = {"min": min(runs), "median": statistics.median(runs), "runs": runs, **extra}
+  print(f"{name:<24} median {result['median']:8.3f}s  min {result['min']:8.3f}s  {extra or ''}", file=sys.stderr)
+  return result
+
+
+def clean_reports(cfg: Config) -> None:
+  for path in [cfg.report_path, cfg.log_index_path, cfg.dedupe_path]:
+    Path(path).unlink(missing_ok=True)
+
+
+def bench_all(cfg: Config, args: Namespace) -> Dict[str, Any]:
+  results = {}
+  results["scan_cold"] = run("scan_cold", args.repeat, lambda: BorgReporter(cfg).scan_repos(), lambda: clean_reports(cfg))
+  results["scan_warm"] = run("scan_warm", args.repeat, lambda: BorgReporter(cfg).scan_repos())
+
+  # Log scan of a single repo, with and without the log index of a previous scan
+  reporter = BorgReporter(cfg)
+  repo_name, repo_config = next(iter(cfg.repos_config.items()))
+  repo = BorgRepo(repo_name, **reporter.repo_config_dict(repo_config))
+  repo.from_dict(reporter._read_report(cfg.report_path)["repos"][repo_name])
+  log_index = BorgLogIndex.from_dict(reporter._read_json(cfg.log_index_path)[repo_name])
+
+  def reset_index(index: BorgLogIndex) -> None:
+    repo.log_index = index
+
+  results["scan_logs_cold"] = run(
+    "scan_logs_cold", args.repeat, lambda: repo._scan_logs() or {}, lambda: reset_index(BorgLogIndex())
+  )
+  results["scan_logs_warm"] = run("scan_logs_warm", args.repeat, lambda: repo._scan_logs() or {}, lambda: reset_index(log_index))
+
+  # Raw log parsing throughput
+  logfiles = [Path(entry.path) for entry in os.scandir(repo.logspath.path())]
+  total_size = sum(logfile.stat().st_size for logfile in logfiles)
+  def parse_logs():
+    for logfile in logfiles:
+      BorgLog(logfile)
+  result = run("log_parse", args.repeat, parse_logs)
+  result["logs_per_s"] = len(logfiles) / result["median"]
+  result["logs_mb_per_s"] = total_size / 1e6 / result["median"]
+  results["log_parse"] = result
+
+  # Report export and load, in both formats
+  reporter = BorgReporter(cfg)
+  reporter.from_dict(reporter._read_report(cfg.report_path))
+  for extension in [".json", ".bdr"]:
+    filename = str(Path(cfg.report_path).with_name(f"export{extension}"))
+    result = run(f"export{extension}", args.repeat, lambda: reporter.export(filename) or {})
+    result["size"] = os.path.getsize(filename)
+    results[f"export{extension}"] = result
+    results[f"load_repos{extension}"] = run(
+      f"load_repos{extension}", args.repeat, lambda: BorgReporter(cfg).load_repos(filename) or {}
+    )
+  return results
+
+
+def import_time(module: str) -> int:
+  """Cumulative import time of a module in microseconds, in a new interpreter, from python -X importtime."""
+  pythonpath = [str(BENCH_DIR.parent / "src"), os.environ.get("PYTHONPATH")]
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, pythonpath)))
+  output = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env, capture_output=True, text=True, check=True
+  ).stderr
+  # Last line is the module itself: "import time: self [us] | cumulative | imported package"
+  return int(output.strip().splitlines()[-1].split("|")[1])
+
+
+def bench_startup(cfg: Config, args: Namespace) -> Dict[str, Any]:
+  """Reporter startup: import of the reporter modules, and config loading with and without the config cache."""
+  results = {}
+  imports: List[int] = []
+  result = run("startup_import", args.repeat, lambda: imports.append(import_time("borgdash_reporter.cli")) or {})
+  result["import_us"] = statistics.median(imports)
+  results["startup_import"] = result
+
+  config_files = (cfg._config_file, str(Path(cfg._config_file).with_name("config_default.yaml")))
+  cache_path = str(Path(cfg._config_file).with_name("config.cache.json"))
+  results["config_load"] = run("config_load", args.repeat, lambda: Config(*config_files) and {})
+  Config(*config_files, cache_path)
+  results["config_load_cached"] = run(
+    "config_load_cached", args.repeat, lambda: Config(*config_files, cache_path) and {}
+  )
+  return results
+
+
+def compare(results: Dict[str, Any], previous: Dict[str, Any]) -> None:
+  print(f"{'benchmark':<24} {'before':>10} {'after':>10} {'ratio':>8}")
+  for name, result in results.items():
+    if name in previous:
+      before, after = previous[name]["median"], result["median"]
+      print(f"{name:<24} {before:>9.3f}s {after:>9.3f}s {after / before if before else 0:>7.2f}x")
+
+
+def git_revision() -> str:
+  try:
+    return subprocess.run(
+      ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return ""
+
+
+def main() -> None:
+  args = _parse_args()
+  logging.basicConfig(level=logging.ERROR)
+  with TemporaryDirectory(prefix="borgdash-bench-") as tempdir:
+    workdir = Path(args.workdir or tempdir)
+    if args.workdir:
+      shutil.rmtree(workdir, ignore_errors=True)
+      workdir.mkdir(parents=True)
+    cfg = setup(workdir, args)
+    results = bench_startup(cfg, args)
+    if not args.startup_only:
+      results.update(bench_all(cfg, args))
+
+  output = {
+    "meta": {
+      "revision": git_revision(),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+      "params": {key: value for key, value in vars(args).items() if key not in ["output", "compare", "workdir"]},
+    },
+    "results": results,
+  }
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(output, f, indent=2)
+  else:
+    print(json.dumps(output, indent=2))
+  if args.compare:
+    with open(args.compare) as f:
+      compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Stand-in borg executable for benchmarks.
+
+Answers the borg commands used by the reporter with output shaped like borg 1.x json output, for a generated
+repository. Configured with environment variables:
+  FAKE_BORG_ARCHIVES: number of archives in each repository (default 100)
+  FAKE_BORG_LATENCY: seconds to wait before answering, to simulate ssh and repo locking (default 0)
+  FAKE_BORG_FILES: number of files listed in each archive (default 100)
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+START = datetime(2020, 1, 1, 2, 0, 0)
+
+
+def archive_names(repo: str, count: int) -> List[str]:
+  prefix = os.path.basename(repo.rstrip("/")) or "repo"
+  return [f"{prefix}-{(START + timedelta(days=i)).strftime('%Y-%m-%dT%H:%M:%S')}" for i in range(count)]
+
+
+def archive_info(name: str, index: int) -> Dict[str, Any]:
+  start = START + timedelta(days=index, seconds=index % 60)
+  duration = 60.0 + (index * 37) % 3600 + 0.123456
+  return {
+    "name": name,
+    "id": hashlib.sha256(name.encode()).hexdigest(),
+    "start": start.isoformat(timespec="microseconds"),
+    "end": (start + timedelta(seconds=duration)).isoformat(timespec="microseconds"),
+    "duration": duration,
+    "comment": "",
+    "hostname": "benchhost",
+    "username": "root",
+    "command_line": ["borg", "create", "--stats", f"::{name}", "/data"],
+    "limits": {"max_archive_size": 0.0001},
+    "stats": {
+      "original_size": 10_000_000_000 + index * 1_000_000,
+      "compressed_size": 6_000_000_000 + index * 600_000,
+      "deduplicated_size": 10_000_000 + (index * 7919) % 100_000_000,
+      "nfiles": 100_000 + index,
+    },
+  }
+
+
+def repository(repo: str) -> Dict[str, Any]:
+  return {
+    "id": hashlib.sha256(repo.encode()).hexdigest(),
+    "last_modified": START.isoformat(timespec="microseconds"),
+    "location": repo,
+  }
+
+
+def cache(count: int) -> Dict[str, Any]:
+  return {
+    "path": "/root/.cache/borg/bench",
+    "stats": {
+      "total_chunks": 5_000_000 + count * 1000,
+      "total_csize": 6_000_000_000 * count,
+      "total_size": 10_000_000_000 * count,
+      "total_unique_chunks": 1_000_000 + count * 100,
+      "unique_csize": 5_000_000_000 + count * 10_000_000,
+      "unique_size": 8_000_000_000 + count * 15_000_000,
+    },
+  }
+
+
+def option(args: List[str], name: str) -> Any:
+  return args[args.index(name) + 1] if name in args else None
+
+
+def main(args: List[str]) -> int:
+  count = int(os.environ.get("FAKE_BORG_ARCHIVES", "100"))
+  time.sleep(float(os.environ.get("FAKE_BORG_LATENCY", "0")))
+  command, target = args[0], args[-1]
+  repo, _, archive = target.partition("::")
+  names = archive_names(repo, count)
+  encryption = {"mode": "repokey"}
+
+  if command == "info":
+    if archive:
+      if archive not in names:
+        print(f"Archive {archive} does not exist", file=sys.stderr)
+        return 1
+      archives = [archive_info(archive, names.index(archive))]
+    elif any(opt in args for opt in ["--first", "--last", "--glob-archives", "-a"]):
+      selected = list(enumerate(names))
+      if option(args, "--first"):
+        selected = selected[:int(option(args, "--first"))]
+      if option(args, "--last"):
+        selected = selected[-int(option(args, "--last")):]
+      archives = [archive_info(name, i) for i, name in selected]
+    else:
+      archives = None
+    output: Dict[str, Any] = {"cache": cache(count), "encryption": encryption, "repository": repository(repo)}
+    if archives is not None:
+      output["archives"] = archives
+    print(json.dumps(output, indent=4))
+
+  elif command == "list":
+    if "--json-lines" in args:
+      for i in range(int(os.environ.get("FAKE_BORG_FILES", "100"))):
+        print(json.dumps({
+          "type": "-", "mode": "-rw-r--r--", "user": "root", "group": "root", "uid": 0, "gid": 0,
+          "path": f"data/dir{i % 10}/file{i}.txt", "healthy": True, "source": "", "linktarget": "", "flags": None,
+          "mtime": (START + timedelta(seconds=i)).isoformat(timespec="microseconds"), "size": i * 100,
+        }))
+    else:
+      archives = []
+      for i, name in enumerate(names):
+        info = archive_info(name, i)
+        archives.append({
+          "archive": name, "barchive": name, "id": info["id"], "name": name, "start": info["start"],
+          "time": info["start"],
+        })
+      print(json.dumps({"archives": archives, "encryption": encryption, "repository": repository(repo)}, indent=4))
+
+  else:
+    print(f"Unsupported fake borg command {command}", file=sys.stderr)
+    return 2
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Generate a directory of borg create logs for benchmarks, matching the archives of fake_borg.py repositories.
+
+Logs look like the output of `borg create --list --stats --show-rc`, with a random number of listed files so
+that sizes vary from a few KB to several MB.
+"""
+
+import os
+import random
+import sys
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_borg import START, archive_info, archive_names  # noqa: E402
+
+SEPARATOR = "-" * 78
+
+
+def write_log(path: Path, repo: str, name: str, index: int, list_lines: int, failed: bool) -> None:
+  info = archive_info(name, index)
+  start = datetime.fromisoformat(info["start"])
+  end = datetime.fromisoformat(info["end"])
+  with open(path, "w") as f:
+    f.write(f"{start:%Y-%m-%d %H:%M:%S} INFO Creating archive at \"{repo}::{name}\"\n")
+    for i in range(list_lines):
+      f.write(f"A /data/dir{i % 97}/subdir{i % 13}/file-{i}.dat\n")
+    if failed:
+      f.write(f"{end:%Y-%m-%d %H:%M:%S} ERROR Connection closed by remote host\n")
+      f.write(f"{end:%Y-%m-%d %H:%M:%S} ERROR terminating with error status, rc 2\n")
+      return
+    stats = info["stats"]
+    f.write(
+      f"{SEPARATOR}\n"
+      f"Repository: {repo}\n"
+      f"Archive name: {name}\n"
+      f"Archive fingerprint: {info['id']}\n"
+      f"Time (start): {start:%a, %Y-%m-%d %H:%M:%S}\n"
+      f"Time (end):   {end:%a, %Y-%m-%d %H:%M:%S}\n"
+      f"Duration: {info['duration']:.2f} seconds\n"
+      f"Number of files: {stats['nfiles']}\n"
+      f"Utilization of max. archive size: 0%\n"
+      f"{SEPARATOR}\n"
+      f"                       Original size      Compressed size    Deduplicated size\n"
+      f"This archive:          {stats['original_size']:>14} B {stats['compressed_size']:>16} B "
+      f"{stats['deduplicated_size']:>16} B\n"
+      f"{SEPARATOR}\n"
+      f"{end:%Y-%m-%d %H:%M:%S} INFO terminating with success status, rc 0\n"
+    )
+
+
+def generate_logs(
+  logdir: Path, repo: str, count: int, max_list_lines: int = 20000, failure_ratio: float = 0.05, seed: int = 0
+) -> int:
+  """Generate a log per archive of the fake repo, returns the total size written."""
+  rand = random.Random(seed)
+  logdir.mkdir(parents=True, exist_ok=True)
+  for index, name in enumerate(archive_names(repo, count)):
+    # Mostly small logs, with a few big --list ones
+    list_lines = int(max_list_lines * rand.random() ** 4)
+    path = logdir / f"{(START + timedelta(days=index)):%Y%m%d-%H%M%S}.log"
+    write_log(path, repo, name, index, list_lines, rand.random() < failure_ratio)
+  return sum(entry.stat().st_size for entry in os.scandir(logdir))
+
+
+if __name__ == "__main__":
+  parser = ArgumentParser(description="Generate borg logs for the fake borg repositories")
+  parser.add_argument("logdir", help="Directory to create the logs in")
+  parser.add_argument("repo", help="Repository path, as given to fake_borg.py")
+  parser.add_argument("--count", type=int, default=1000, help="Number of logs/archives")
+  parser.add_argument("--max-list-lines", type=int, default=20000, help="Maximum number of files listed in a log")
+  args = parser.parse_args()
+  size = generate_logs(Path(args.logdir), args.repo, args.count, args.max_list_lines)
+  print(f"Generated {args.count} logs, {size / 1e6:.1f} MB")
@@ -0,0 +1,143 @@
+"""
+Aggregates of the archives and runs of a repo, computed at scan time rather than by each dashboard page
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Daily buckets are kept for the last days only, weekly buckets for the whole history
+DAILY_BUCKETS = 90
+# Duration percentiles of each bucket
+BUCKET_PERCENTILES = (50, 90)
+TOTAL_PERCENTILES = (50, 90, 99)
+
+# Archive table row: start time, original size, compressed size, deduplicated size, duration
+ArchiveRow = Tuple[datetime, int, int, int, Optional[int]]
+# Run row: time, whether successful
+RunRow = Tuple[datetime, bool]
+
+
+def _naive(date_time: datetime) -> datetime:
+  """Local time without timezone, to compare times with and without one."""
+  return date_time.astimezone().replace(tzinfo=None) if date_time.tzinfo else date_time
+
+
+def _weeks(days: List[int]) -> List[int]:
+  """Day ordinals of the monday of the week of day ordinals. The day ordinal 1 is a monday."""
+  return [day - (day - 1) % 7 for day in days]
+
+
+def _bounds(keys: List[int]) -> Dict[int, Tuple[int, int]]:
+  """Start and end index of each key in the sorted keys."""
+  bounds = {}
+  start = 0
+  for key in dict.fromkeys(keys):
+    end = bisect_right(keys, key, start)
+    bounds[key] = (start, end)
+    start = end
+  return bounds
+
+
+def _columns(rows: Sequence[Tuple[Any, ...]], count: int) -> List[List[Any]]:
+  """Columns of the rows sorted by their first column."""
+  return [list(column) for column in zip(*sorted(rows, key=itemgetter(0)))] or [[] for _ in range(count)]
+
+
+def _percentile(sorted_values: Sequence[float], percent: int) -> Optional[float]:
+  """Nearest rank percentile of sorted values, None if no values."""
+  if not sorted_values:
+    return None
+  return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+
+def _success_rate(runs_ok: Sequence[bool]) -> Optional[float]:
+  return round(sum(runs_ok) / len(runs_ok), 4) if runs_ok else None
+
+
+def _buckets(
+  table: Dict[str, List[Any]], archive_keys: List[int], run_keys: List[int], since: Optional[int] = None
+) -> Dict[str, List[Any]]:
+  """Archives and runs grouped by time bucket, as columns with a value per bucket, from the since bucket if any.
+
+  Buckets keys are the day ordinals of their start, for the sorted archive and run tables rows. osize and csize are the
+  original and compressed sizes of the last archive of the bucket, and osize_delta the original size difference with
+  the last archive of the previous bucket. dsize is the deduplicated size added by the archives of the bucket.
+  """
+  columns: Dict[str, List[Any]] = {
+    name: [] for name in ["start", "archives", "osize", "osize_delta", "csize", "dsize", "runs", "success_rate"]
+  }
+  for percent in BUCKET_PERCENTILES:
+    columns[f"duration_p{percent}"] = []
+
+  archive_bounds = _bounds(archive_keys)
+  run_bounds = _bounds(run_keys)
+  keys = sorted(archive_bounds.keys() | run_bounds.keys())
+  previous_osize = previous_csize = None
+  if since is not None:
+    keys = keys[bisect_left(keys, since):]
+    first = bisect_left(archive_keys, since)
+    if first:
+      previous_osize, previous_csize = table["osize"][first - 1], table["csize"][first - 1]
+
+  for key in keys:
+    start, end = archive_bounds.get(key, (0, 0))
+    run_start, run_end = run_bounds.get(key, (0, 0))
+    osize = table["osize"][end - 1] if end > start else previous_osize
+    csize = table["csize"][end - 1] if end > start else previous_csize
+    durations = sorted(duration for duration in table["duration"][start:end] if duration is not None)
+    runs_ok = table["run_ok"][run_start:run_end]
+    columns["start"].append(date.fromordinal(key).isoformat())
+    columns["archives"].append(end - start)
+    columns["osize"].append(osize)
+    columns["osize_delta"].append(osize - previous_osize if osize is not None and previous_osize is not None else None)
+    columns["csize"].append(csize)
+    columns["dsize"].append(sum(table["dsize"][start:end]))
+    columns["runs"].append(run_end - run_start)
+    columns["success_rate"].append(_success_rate(runs_ok))
+    for percent in BUCKET_PERCENTILES:
+      columns[f"duration_p{percent}"].append(_percentile(durations, percent))
+    previous_osize, previous_csize = osize, csize
+  return columns
+
+
+def compute_aggregates(archives: List[ArchiveRow], runs: List[RunRow]) -> Dict[str, Any]:
+  """Totals, and daily and weekly buckets, of the archive and run tables."""
+  # Times with a timezone can't be compared with the ones without
+  if any(row[0].tzinfo for row in archives):
+    archives = [(_naive(row[0]), *row[1:]) for row in archives]  # type: ignore[misc]
+  if any(run_time.tzinfo for run_time, _ in runs):
+    runs = [(_naive(run_time), ok) for run_time, ok in runs]
+  # Tables as columns, sorted by time. Archives and runs are usually listed by time already, making sorting linear
+  archive_times, osizes, csizes, dsizes, archive_durations = _columns(archives, 5)
+  run_times, runs_ok = _columns(runs, 2)
+  table: Dict[str, List[Any]] = {
+    "osize": osizes, "csize": csizes, "dsize": dsizes, "duration": archive_durations, "run_ok": runs_ok
+  }
+  archive_days = [archive_time.toordinal() for archive_time in archive_times]
+  run_days = [run_time.toordinal() for run_time in run_times]
+
+  durations = sorted(duration for duration in table["duration"] if duration is not None)
+  osize = sum(table["osize"])
+  csize = sum(table["csize"])
+  dsize = sum(table["dsize"])
+  last_day = max(archive_days[-1:] + run_days[-1:], default=None)
+  return {
+    "totals": {
+      "archives": len(archive_times),
+      "first": archive_times[0].isoformat() if archive_times else None,
+      "last": archive_times[-1].isoformat() if archive_times else None,
+      "osize": osize,
+      "csize": csize,
+      "dsize": dsize,
+      "dedup_ratio": round(osize / dsize, 2) if dsize else None,
+      "duration_mean": round(sum(durations) / len(durations), 1) if durations else None,
+      **{f"duration_p{percent}": _percentile(durations, percent) for percent in TOTAL_PERCENTILES},
+      "runs": len(runs_ok),
+      "success_rate": _success_rate(table["run_ok"]),
+    },
+    "daily": _buckets(table, archive_days, run_days, last_day - DAILY_BUCKETS + 1 if last_day else None),
+    "weekly": _buckets(table, _weeks(archive_days), _weeks(run_days)),
+  }
@@ -2,26 +2,51 @@
 borg client wrapper
 """
 
+import asyncio
 import subprocess
 import os
 import json
 import logging
+import shlex
+import signal
+import threading
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+from typing import Any, Coroutine, Dict, Iterator, List, Optional, TypeVar, Union
+from .exceptions import RepoError, ScanTimeoutError
+from .timing import deadline_passed, span, time_left
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+def _kill_process_group(proc: Union[subprocess.Popen, asyncio.subprocess.Process]) -> None:
+  """Kill a process started in its own session, and its children such as the ssh of remote repos."""
+  try:
+    os.killpg(proc.pid, signal.SIGKILL)
+  except ProcessLookupError:
+    pass
+
 
 class BorgClient:
   """ Wrapp comand line calls to the borg cli.
 
   Use env var for password, not for repo (BORG_REPO)
   """
+  # Repo files written at each repo transaction
+  REPO_STATE_FILES = ["config", "index.*", "hints.*", "integrity.*"]
 
-  def __init__(self, binpath: str, repo: Optional[str] = None, pwd: Optional[str] = None) -> None:
+  def __init__(
+    self, binpath: str, repo: Optional[str] = None, pwd: Optional[str] = None, timeout: Optional[float] = None
+  ) -> None:
     self._borgpath = Path(binpath)
     if not self._borgpath.is_file():
       raise FileNotFoundError(f"Cannot find borg backup executable in {binpath}")
+    self._timeout = timeout
+    # Deadline (monotonic time) of the current scan, calls are interrupted once passed
+    self.deadline: Optional[float] = None
     self._current_repo = repo
     self._current_env_list = None
     if pwd:
@@ -30,17 +55,39 @@ class BorgClient:
   def _run_sync(self, args, pwd=None) -> Optional[bytes]:
     arg_list = [self._borgpath] + args
     env_list = self._current_env_list
-    res = None
 
     # If a pwd is specified, overwrite the one possibly already set
     if pwd:
       env_list = self._set_pwd(env_list, pwd)
-    try:
-      log.debug(f"Executing borg client: {arg_list}")
-      res = subprocess.run(arg_list, stdout=subprocess.PIPE, check=True, env=env_list)
-    except subprocess.CalledProcessError as e:
-      log.exception("Failed to execute borg client: %s", e)
-    return res.stdout if res else None
+    log.debug(f"Executing borg client: {arg_list}")
+    with span(f"borg.{args[0]}") as borg_span:
+      # Own process group so that ssh spawned by borg for remote repos is killed with it on timeout
+      proc = subprocess.Popen(arg_list, stdout=subprocess.PIPE, env=env_list, start_new_session=True)
+      try:
+        stdout, _ = proc.communicate(timeout=time_left(self.deadline, self._timeout))
+      except subprocess.TimeoutExpired as e:
+        _kill_process_group(proc)
+        proc.communicate()
+        if deadline_passed(self.deadline):
+          raise ScanTimeoutError(f"Borg call exceeded the scan deadline: {e}") from e
+        log.error("Borg client timed out: %s", e)
+        return None
+      except BaseException:
+        # Interrupted, don't leave borg running with the repo locked
+        _kill_process_group(proc)
+        proc.wait()
+        raise
+      borg_span.bytes = len(stdout)
+    if proc.returncode != 0:
+      log.error(f"Failed to execute borg client: {arg_list} returned {proc.returncode}")
+      return None
+    return stdout
+
+  def set_env(self, name: str, value: str) -> None:
+    """Set an environment variable for the borg calls."""
+    if not self._current_env_list:
+      self._current_env_list = os.environ.copy()
+    self._current_env_list[name] = value
 
   def _set_pwd(self, env_list: Optional[Dict[str, Any]], pwd: str) -> Dict[str, Any]:
     if not env_list:
@@ -59,17 +106,7 @@ class BorgClient:
       parsed = json.loads(json_output)
       # If we got an archive info
       if "archives" in parsed:
-          info["size"] = parsed["archives"][0]["stats"]["original_size"]
-          info["csize"] = parsed["archives"][0]["stats"]["compressed_size"]
-          info["dsize"] = parsed["archives"][0]["stats"]["deduplicated_size"]
-
-          info["archive"] = {}
-          info["archive"]["nfiles"] = parsed["archives"][0]["stats"]["nfiles"]
-          info["archive"]["start"] = parsed["archives"][0]["start"]
-          info["archive"]["end"] = parsed["archives"][0]["end"]
-          info["archive"]["duration"] = int(parsed["archives"][0]["duration"])
-          info["archive"]["comment"] = parsed["archives"][0]["comment"]
-          info["archive"]["name"] = parsed["archives"][0]["name"]
+          info = self._parse_archive_info(parsed["archives"][0])
       else:
           info["size"] = parsed["cache"]["stats"]["total_size"]
           info["csize"] = parsed["cache"]["stats"]["total_csize"]
@@ -82,13 +119,41 @@ class BorgClient:
       log.error("Invalid borg info output: %s", e)
     return info
 
+  def _parse_archive_info(self, archive: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract a subset of data from an archive entry of the info output."""
+    return {
+      "size": archive["stats"]["original_size"],
+      "csize": archive["stats"]["compressed_size"],
+      "dsize": archive["stats"]["deduplicated_size"],
+      "archive": {
+        "nfiles": archive["stats"]["nfiles"],
+        "start": archive["start"],
+        "end": archive["end"],
+        "duration": int(archive["duration"]),
+        "comment": archive["comment"],
+        "name": archive["name"],
+      },
+    }
+
+  def _parse_archives_info_result(self, json_output: Optional[bytes]) -> Dict[str, Dict[str, Any]]:
+    """Extract a subset of data for each archive of a multiple archives info output."""
+    info = {}
+    if json_output:
+      try:
+        parsed = json.loads(json_output)
+        for archive in parsed["archives"]:
+          info[archive["name"]] = self._parse_archive_info(archive)
+      except (json.JSONDecodeError, KeyError) as e:
+        log.error("Invalid borg info output: %s", e)
+    return info
+
   def _parse_list_result(self, json_output: Optional[bytes]) -> Dict[str, Dict[str,Any]]:
     """Extract a subset of data from the list output to use in borgweb."""
     info  = {}
     if json_output:
       try:
         parsed = json.loads(json_output)
-        info = {arch["archive"]: {"name": arch["archive"]} for arch in parsed["archives"]}
+        info = {arch["archive"]: {"name": arch["archive"], "id": arch.get("id")} for arch in parsed["archives"]}
       except (json.JSONDecodeError, KeyError) as e:
         log.error("Invalid borg list output: %s", e)
     return info
@@ -98,19 +163,260 @@ class BorgClient:
     if pwd:
       self._current_env_list = self._set_pwd(self._current_env_list, pwd)
 
-  def info(self, repo=None, archive=None, pwd=None):
+  def _info_args(self, repo=None, archive=None) -> List[str]:
     repo = repo or self._current_repo
     # Get info on an qrchive if one is specified
     infopath = f"{repo}::{archive}" if archive else repo
-
-    # Run borg client
     log.debug(f"Fetching info on {infopath}")
-    res = self._run_sync(["info", "--json", infopath], pwd)
-    return self._parse_info_result(res)
+    return ["info", "--json", infopath]
+
+  def _info_archives_args(
+    self, repo=None, first: Optional[int] = None, last: Optional[int] = None, glob: Optional[str] = None
+  ) -> List[str]:
+    repo = repo or self._current_repo
+    args = ["info", "--json"]
+    if first:
+      args += ["--first", str(first)]
+    if last:
+      args += ["--last", str(last)]
+    if glob:
+      args += ["--glob-archives", glob]
+    log.debug(f"Fetching info on archives of {repo} (first={first}, last={last}, glob={glob})")
+    return args + [repo]
 
-  def list(self, repo=None, archive=None, pwd=None):
+  def _list_args(self, repo=None, last: Optional[int] = None) -> List[str]:
     repo = repo or self._current_repo
-    # Run borg client
     log.debug(f"Fetching list on {repo}")
-    res = self._run_sync(["list", "--json", repo], pwd)
+    return ["list", "--json"] + (["--last", str(last)] if last else []) + [repo]
+
+  def _list_files_args(self, archive: str, repo=None) -> List[str]:
+    repo = repo or self._current_repo
+    log.debug(f"Fetching files of {repo}::{archive}")
+    return ["list", "--json-lines", f"{repo}::{archive}"]
+
+  def list_files(self, archive: str, repo=None, pwd=None) -> Iterator[Dict[str, Any]]:
+    """Files of an archive, streamed from the borg output line by line rather than buffered.
+
+    Raises RepoError if borg fails or times out, the files already returned are then incomplete. The span time
+    includes the processing of the files by the caller.
+    """
+    arg_list = [str(self._borgpath)] + self._list_files_args(archive, repo)
+    env_list = self._set_pwd(dict(self._current_env_list or {}) or None, pwd) if pwd else self._current_env_list
+    timeout = time_left(self.deadline, self._timeout)
+    log.debug(f"Executing borg client: {arg_list}")
+    with span("borg.list_files") as borg_span:
+      # Own process group so that ssh spawned by borg for remote repos is killed with it
+      proc = subprocess.Popen(arg_list, stdout=subprocess.PIPE, env=env_list, start_new_session=True)
+      timed_out = threading.Event()
+
+      def kill() -> None:
+        if proc.poll() is None:
+          timed_out.set()
+          _kill_process_group(proc)
+
+      timer = threading.Timer(timeout, kill) if timeout else None
+      try:
+        if timer:
+          timer.start()
+        for line in proc.stdout:  # type: ignore[union-attr]
+          borg_span.bytes += len(line)
+          try:
+            yield json.loads(line)
+          except json.JSONDecodeError as e:
+            log.warning(f"Invalid borg list line: {e}")
+      finally:
+        if timer:
+          timer.cancel()
+        # Stopped early by the caller, don't leave borg running with the repo locked
+        if proc.poll() is None:
+          _kill_process_group(proc)
+        proc.stdout.close()  # type: ignore[union-attr]
+        proc.wait()
+    if timed_out.is_set():
+      if deadline_passed(self.deadline):
+        raise ScanTimeoutError(f"Borg call exceeded the scan deadline: {arg_list}")
+      raise RepoError(f"Borg client timed out after {self._timeout}s: {arg_list}")
+    if proc.returncode != 0:
+      raise RepoError(f"Failed to execute borg client: {arg_list} returned {proc.returncode}")
+
+  def info(self, repo=None, archive=None, pwd=None):
+    res = self._run_sync(self._info_args(repo, archive), pwd)
+    return self._parse_info_result(res)
+
+  def info_archives(
+    self, repo=None, pwd=None, first: Optional[int] = None, last: Optional[int] = None, glob: Optional[str] = None
+  ) -> Dict[str, Dict[str, Any]]:
+    """Info on multiple archives in a single call, by name. Selects the first/last archives or matching a glob."""
+    res = self._run_sync(self._info_archives_args(repo, first, last, glob), pwd)
+    return self._parse_archives_info_result(res)
+
+  def list(self, repo=None, archive=None, pwd=None, last: Optional[int] = None):
+    res = self._run_sync(self._list_args(repo, last), pwd)
     return self._parse_list_result(res)
+
+  @staticmethod
+  def _valid_repo_state(lines: List[str]) -> bool:
+    """Whether a repo state has the config and index files, that all repos have."""
+    names = [line.split(" ", 1)[0] for line in lines]
+    return "config" in names and any(name.startswith("index.") for name in names)
+
+  def repo_state(self, repo=None) -> Optional[str]:
+    """Names, sizes and modification times of the repo transaction files, without running borg.
+
+    Read from the file system for local repos, and with the borg ssh command for ssh:// repos. None if unavailable,
+    or if the repo config and index files are not found.
+    """
+    repo = repo or self._current_repo
+    if repo.startswith("ssh://"):
+      url = urlsplit(repo)
+      # Paths starting with /./ or /~/ are relative to the home directory
+      path = url.path[3:] if url.path.startswith(("/./", "/~/")) else url.path
+      destination = f"{url.username}@{url.hostname}" if url.username else str(url.hostname)
+      script = f"cd -- {shlex.quote(path or '.')} && stat -c '%n %s %Y' -- {' '.join(self.REPO_STATE_FILES)}"
+      rsh = (self._current_env_list or os.environ).get("BORG_RSH", "ssh")
+      args = shlex.split(rsh) + (["-p", str(url.port)] if url.port else []) + [destination, script]
+      try:
+        log.debug(f"Fetching repo state: {args}")
+        with span("borg.repo_state") as state_span:
+          # No stdin, for keys forced to run borg serve. stat fails if a file pattern has no match (hints and integrity
+          # files of old repos), the output is checked instead
+          result = subprocess.run(
+            args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            timeout=time_left(self.deadline, self._timeout)
+          )
+          state_span.bytes = len(result.stdout)
+        lines = result.stdout.decode(errors="replace").splitlines()
+      except (OSError, subprocess.TimeoutExpired) as e:
+        if deadline_passed(self.deadline):
+          raise ScanTimeoutError(f"Repo state exceeded the scan deadline: {e}") from e
+        log.warning(f"Cannot fetch state of repo {repo}: {e}")
+        return None
+      if result.returncode != 0 and not self._valid_repo_state(lines):
+        log.warning(
+          f"Cannot fetch state of repo {repo}: returned {result.returncode}: "
+          f"{result.stderr.decode(errors='replace').strip()}"
+        )
+        return None
+    elif os.path.isdir(repo):
+      prefixes = tuple(name.rstrip("*") for name in self.REPO_STATE_FILES)
+      try:
+        with os.scandir(repo) as entries:
+          lines = [
+            f"{entry.name} {entry.stat().st_size} {entry.stat().st_mtime_ns}"
+            for entry in entries if entry.name.startswith(prefixes)
+          ]
+      except OSError as e:
+        log.warning(f"Cannot read state of repo {repo}: {e}")
+        return None
+    else:
+      return None
+    if not self._valid_repo_state(lines):
+      log.warning(f"Repo config and index files not found in state of repo {repo}")
+      return None
+    return "\n".join(sorted(lines))
+
+
+
+class AsyncBorgClient(BorgClient):
+  """Borg client with coroutine info and list calls, to run concurrent borg calls from an event loop.
+
+  Calls are limited by the semaphore if any, shared by the clients of the loop, and the borg process group is killed
+  when the call times out or is cancelled. The other calls are synchronous.
+  """
+
+  def __init__(
+    self,
+    binpath: str,
+    repo: Optional[str] = None,
+    pwd: Optional[str] = None,
+    timeout: Optional[float] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+  ) -> None:
+    super().__init__(binpath, repo, pwd, timeout)
+    self.semaphore = semaphore
+
+  async def _run_async(self, args, pwd=None) -> Optional[bytes]:
+    arg_list = [str(self._borgpath)] + args
+    env_list = self._current_env_list
+
+    # If a pwd is specified, overwrite the one possibly already set, without changing the client env
+    if pwd:
+      env_list = self._set_pwd(dict(env_list) if env_list else None, pwd)
+    async with self.semaphore or nullcontext():
+      timeout = time_left(self.deadline, self._timeout)
+      log.debug(f"Executing borg client: {arg_list}")
+      with span(f"borg.{args[0]}") as borg_span:
+        # Own process group so that ssh spawned by borg for remote repos is killed with it
+        proc = await asyncio.create_subprocess_exec(
+          *arg_list, stdout=subprocess.PIPE, env=env_list, start_new_session=True
+        )
+        try:
+          stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+          if deadline_passed(self.deadline):
+            raise ScanTimeoutError(f"Borg call exceeded the scan deadline: {arg_list}")
+          log.error(f"Borg client timed out after {timeout}s: {arg_list}")
+          return None
+        finally:
+          # Timed out or cancelled, don't leave borg running with the repo locked
+          if proc.returncode is None:
+            _kill_process_group(proc)
+            await proc.wait()
+        borg_span.bytes = len(stdout)
+
+    if proc.returncode != 0:
+      log.error(f"Failed to execute borg client: {arg_list} returned {proc.returncode}")
+      return None
+    return stdout
+
+  async def info(self, repo=None, archive=None, pwd=None):  # type: ignore[override]
+    res = await self._run_async(self._info_args(repo, archive), pwd)
+    return self._parse_info_result(res)
+
+  async def info_archives(  # type: ignore[override]
+    self, repo=None, pwd=None, first: Optional[int] = None, last: Optional[int] = None, glob: Optional[str] = None
+  ) -> Dict[str, Dict[str, Any]]:
+    """Info on multiple archives in a single call, by name. Selects the first/last archives or matching a glob."""
+    res = await self._run_async(self._info_archives_args(repo, first, last, glob), pwd)
+    return self._parse_archives_info_result(res)
+
+  async def list(self, repo=None, archive=None, pwd=None, last: Optional[int] = None):  # type: ignore[override]
+    res = await self._run_async(self._list_args(repo, last), pwd)
+    return self._parse_list_result(res)
+
+
+class BorgLoop:
+  """Event loop running in a background thread, on which the repos scanned in parallel threads run their borg calls,
+  up to max_calls at once."""
+
+  def __init__(self, max_calls: int) -> None:
+    self.semaphore = asyncio.BoundedSemaphore(max_calls)
+    self._loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(target=self._loop.run_forever, name="borg", daemon=True)
+    self._thread.start()
+
+  def run(self, coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the loop and wait for its result. The coroutine gets the context of the calling thread, such
+    as the repo its timing spans are accounted to."""
+    future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+    try:
+      return future.result()
+    except BaseException:
+      # Interrupted, cancel the call to kill borg
+      future.cancel()
+      raise
+
+  async def _cancel_all(self) -> None:
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+  def close(self) -> None:
+    """Cancel the calls still running, killing their borg process, and stop the loop."""
+    if self._loop.is_closed():
+      return
+    asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._thread.join()
+    self._loop.close()
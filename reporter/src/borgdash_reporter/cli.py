@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import sys
@@ -16,6 +17,25 @@ log = logging.getLogger(__name__)
 def _parse_args() -> Namespace:
   parser = ArgumentParser(description="Borgdash reporter")
   parser.add_argument("--debug", "-d", default=False, action="store_true", help="Enable debug logging")
+  parser.add_argument(
+    "--force", "-f", default=False, action="store_true", help="Scan all repos, even if unchanged since last scan"
+  )
+  parser.add_argument(
+    "--daemon", default=False, action="store_true",
+    help="Keep running, scanning at the configured schedule and on requests received on the control socket",
+  )
+  parser.add_argument(
+    "--profile", default=False, action="store_true",
+    help="Profile the scan with cProfile and print the top functions. Only the main thread is profiled, set "
+    "scan_workers to 1 to include the repo scans",
+  )
+  parser.add_argument("--profile-output", metavar="FILE", help="Save the profile stats to FILE instead of printing them")
+  parser.add_argument(
+    "--search", metavar="TEXT", help="Print the paths containing TEXT in the archives file indexes, and exit"
+  )
+  parser.add_argument(
+    "--exact", default=False, action="store_true", help="With --search, print the archives containing the path TEXT"
+  )
   parser.add_argument("config_path", nargs='?', help="Config file path. If not specified, will try from env var")
   args = parser.parse_args()
   args.log_level = logging.DEBUG if args.debug else logging.INFO
@@ -28,6 +48,21 @@ def setup_logging(level: int = logging.INFO, filename: Optional[str] = None) ->
       format="[%(asctime)s %(filename)s:%(lineno)s][%(levelname)s]: %(message)s", level=level, filename=filename
   )
 
+def profile(func, output: Optional[str] = None) -> None:
+  """Run a function with cProfile, printing the stats sorted by cumulative time, or saving them to a file."""
+  import cProfile
+  import pstats
+
+  profiler = cProfile.Profile()
+  try:
+    profiler.runcall(func)
+  finally:
+    if output:
+      profiler.dump_stats(output)
+      log.info(f"Profile saved to {output}, view with: python -m pstats {output}")
+    else:
+      pstats.Stats(profiler, stream=sys.stderr).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+
 def main() -> None:
   """Main entry point."""
 
@@ -38,11 +73,24 @@ def main() -> None:
   try:
     cfgfile = args.config_path or os.environ.get('BORGDASH_CONFIG')
     defaultcfgfile = os.environ.get('BORGDASH_DEFAULT_CONFIG')
-    cfg = Config(cfgfile, defaultcfgfile)
+    cfg = Config(cfgfile, defaultcfgfile, os.environ.get('BORGDASH_CONFIG_CACHE'))
     # cfg.dump()
 
+    if args.daemon:
+      # Only imported when used, like the profiler and notifiers, to start the reporter faster
+      from .daemon import ReporterDaemon
+
+      ReporterDaemon(cfg).run()
+      sys.exit(0)
+
     reporter = BorgReporter(cfg)
-    reporter.scan_repos()
+    if args.search is not None:
+      print(json.dumps(reporter.search_files(args.search, exact=args.exact), indent=2))
+      sys.exit(0)
+    if args.profile or args.profile_output:
+      profile(lambda: reporter.scan_repos(force=args.force), args.profile_output)
+    else:
+      reporter.scan_repos(force=args.force)
     # reporter.load_repos()
 
     sys.exit(0)
@@ -1,9 +1,18 @@
+import contextlib
+import json
+import logging
+import os
 import yaml
 import sys
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from .exceptions import ConfigError
 from pathlib import Path
 
+log = logging.getLogger(__name__)
+
+# The C yaml parser is much faster to load the configuration, when libyaml is available
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 def dict_deep_update(d, u):
     for k, v in u.items():
         if isinstance(v, dict):
@@ -20,6 +29,12 @@ class Config(object):
   DEFAULT_DEDUPE_PATH = "/tmp/borgdash_dedupe.json"
   DEFAULT_LOGS_BASEDIR = "/logs"
   DEFAULT_REPOS_BASEDIR = "/repos"
+  DEFAULT_CONTROL_SOCKET = "/tmp/borgdash_reporter.sock"
+  DEFAULT_SCAN_WORKERS = 1
+  DEFAULT_SCAN_WORKERS_PER_HOST = 2
+  DEFAULT_NOTIFY_TIMEOUT = 60
+  CONCURRENT_SCANS_FOLLOW_UP = "follow_up"
+  CONCURRENT_SCANS_ATTACH = "attach"
   DEFAULT_ALARM_MESSAGE = "**{} Backups failed**:\n\n{}"
   DEFAULT_ALARM_MESSAGE_DEV = "- {}: Failed with status {} on {}\n"
 
@@ -27,9 +42,29 @@ class Config(object):
   CONFIG_KEY_REPORT_PATH = "report_path"
   CONFIG_KEY_BORG_PATH = "borg_path"
   CONFIG_KEY_DEDUPE_PATH = "dedupe_path"
+  CONFIG_KEY_LOG_INDEX_PATH = "log_index_path"
+  CONFIG_KEY_REPORT_SHARDED = "report_sharded"
+  CONFIG_KEY_HISTORY_PATH = "history_path"
+  CONFIG_KEY_METRICS_PATH = "metrics_path"
+  CONFIG_KEY_FILE_INDEX_DIR = "file_index_dir"
+  CONFIG_KEY_FILE_INDEX_LAST_ARCHIVES = "file_index_last_archives"
+  CONFIG_KEY_SCHEDULE = "schedule"
+  CONFIG_KEY_CRONTAB_PATH = "crontab_path"
+  CONFIG_KEY_CONTROL_SOCKET = "control_socket"
   CONFIG_KEY_LOGS_BASEDIR = "logs_basedir"
   CONFIG_KEY_REPOS_BASEDIR = "repos_basedir"
+  CONFIG_KEY_BORG_TIMEOUT = "borg_timeout"
+  CONFIG_KEY_REPO_SCAN_TIMEOUT = "repo_scan_timeout"
+  CONFIG_KEY_SCAN_TIMEOUT = "scan_timeout"
+  CONFIG_KEY_CONCURRENT_SCANS = "concurrent_scans"
+  CONFIG_KEY_SSH_MULTIPLEXING = "ssh_multiplexing"
+  CONFIG_KEY_ARCHIVE_STATS_FROM_LOGS = "archive_stats_from_logs"
+  CONFIG_KEY_SCAN_WORKERS = "scan_workers"
+  CONFIG_KEY_SCAN_WORKERS_PER_HOST = "scan_workers_per_host"
+  CONFIG_KEY_BORG_MAX_CALLS = "borg_max_calls"
   CONFIG_KEY_DISCORD = "discord"
+  CONFIG_KEY_WEBHOOK_ALARM = "webhook_alarm"
+  CONFIG_KEY_NOTIFY_TIMEOUT = "notify_timeout"
   CONFIG_KEY_WEBHOOK = "webhook"
   CONFIG_KEY_WEBHOOK_USER = "webhook_user"
   CONFIG_KEY_MESSAGE = "message"
@@ -41,7 +76,11 @@ class Config(object):
   CONFIG_KEY_REPO_PWD = "repo_pwd"
   CONFIG_KEY_SCRIPT = "script"
 
-  def __init__(self, config_file: Optional[str], defaultcfgfile: Optional[str] = None) -> None:
+  def __init__(
+    self, config_file: Optional[str], defaultcfgfile: Optional[str] = None, cache_path: Optional[str] = None
+  ) -> None:
+    """Default config merged with the config file. If a cache path is specified, the merged config is saved there
+    and loaded instead of the yaml files, as long as they're not modified."""
     self._config_file = config_file
 
     # Look for default config: Use env var, or default path or custom config folder
@@ -51,6 +90,12 @@ class Config(object):
     if not defaultcfg.exists():
       raise ConfigError("Couldn't find default config file and not specified in env BORGDASH_DEFAULT_CONFIG`")
 
+    sources = [str(defaultcfg)] + ([self._config_file] if self._config_file else [])
+    cached = self._load_cache(cache_path, sources) if cache_path else None
+    if cached is not None:
+      self._config = cached
+      return
+
     # Load the default config
     self._config = self.load(str(defaultcfg))
     # Set default config for missing values
@@ -62,11 +107,54 @@ class Config(object):
       custom_config = self.load(self._config_file)
       dict_deep_update(self._config, custom_config)
 
+    if cache_path:
+      self._save_cache(cache_path, sources)
+
+  @staticmethod
+  def _sources_stamp(sources: List[str]) -> List[List[Any]]:
+    """Path, modification time and size of the config files, to detect their modification."""
+    stamp: List[List[Any]] = []
+    for source in sources:
+      stat = os.stat(source)
+      stamp.append([source, stat.st_mtime_ns, stat.st_size])
+    return stamp
+
+  def _load_cache(self, cache_path: str, sources: List[str]) -> Optional[Dict[str, Any]]:
+    """Merged config from the cache, None if missing or if the config files were modified since it was saved."""
+    try:
+      with open(cache_path, "r") as f:
+        cache = json.load(f)
+      if cache.get("sources") == self._sources_stamp(sources):
+        return cache["config"]
+    except FileNotFoundError:
+      pass
+    except (OSError, ValueError, KeyError) as e:
+      log.warning(f"Ignoring config cache {cache_path}: {e}")
+    return None
+
+  def _save_cache(self, cache_path: str, sources: List[str]) -> None:
+    """Save the merged config to the cache, replacing it atomically. Configs with values that json doesn't keep as
+    is, like dates or non string keys, aren't cached."""
+    temp_path = f"{cache_path}.temp"
+    try:
+      data = json.dumps({"sources": self._sources_stamp(sources), "config": self._config})
+      if json.loads(data)["config"] != self._config:
+        log.warning(f"Config not cached in {cache_path}, it contains values not kept by json")
+        return
+      # Readable by the owner only, it contains the secrets of the config files like the repo passwords
+      with contextlib.suppress(FileNotFoundError):
+        os.unlink(temp_path)
+      with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+        f.write(data)
+      os.replace(temp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+      log.warning(f"Cannot save config cache {cache_path}: {e}")
+
   def load(self, filepath: str) -> Dict[str, Any]:
     """Load the yaml configuration"""
     try:
       with open(filepath, "r") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=YamlLoader)
 
     except Exception as e:
           raise ConfigError(e) from e
@@ -79,6 +167,31 @@ class Config(object):
   def borg_path(self) -> str:
     return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_BORG_PATH, self.DEFAULT_BORG_PATH)
 
+  @property
+  def borg_timeout(self) -> Optional[float]:
+    """Timeout in seconds of borg calls, None to wait indefinitely."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_BORG_TIMEOUT) or None
+
+  @property
+  def repo_scan_timeout(self) -> Optional[float]:
+    """Maximum duration in seconds of a repo scan, None for no limit."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_REPO_SCAN_TIMEOUT) or None
+
+  @property
+  def scan_timeout(self) -> Optional[float]:
+    """Maximum duration in seconds of the scan of all repos, None for no limit."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_SCAN_TIMEOUT) or None
+
+  @property
+  def scan_attach(self) -> bool:
+    """Whether scans requested while another one runs are done by it, instead of by a single follow-up scan."""
+    concurrent_scans = self._config[self.CONFIG_KEY_REPORTER].get(
+      self.CONFIG_KEY_CONCURRENT_SCANS, self.CONCURRENT_SCANS_FOLLOW_UP
+    )
+    if concurrent_scans not in (self.CONCURRENT_SCANS_FOLLOW_UP, self.CONCURRENT_SCANS_ATTACH):
+      raise ConfigError(f"Invalid {self.CONFIG_KEY_CONCURRENT_SCANS} value: {concurrent_scans}")
+    return concurrent_scans == self.CONCURRENT_SCANS_ATTACH
+
   @property
   def logs_basedir(self) -> str:
     return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_LOGS_BASEDIR, self.DEFAULT_LOGS_BASEDIR)
@@ -91,6 +204,81 @@ class Config(object):
   def dedupe_path(self) -> str:
     return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_DEDUPE_PATH, self.DEFAULT_DEDUPE_PATH)
 
+  @property
+  def report_sharded(self) -> bool:
+    """Whether the report is split in a repos summary file and a details file per repo."""
+    return bool(self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_REPORT_SHARDED, False))
+
+  @property
+  def history_path(self) -> Optional[str]:
+    """Scan history database path, or None if history is disabled."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_HISTORY_PATH)
+
+  @property
+  def file_index_dir(self) -> Optional[str]:
+    """Directory of the archives file indexes of the repos, or None if disabled."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_FILE_INDEX_DIR)
+
+  @property
+  def file_index_last_archives(self) -> Optional[int]:
+    """Number of last archives of each repo indexed, None for all."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_FILE_INDEX_LAST_ARCHIVES) or None
+
+  @property
+  def metrics_path(self) -> Optional[str]:
+    """Prometheus textfile collector file with the scan timings, or None if disabled."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_METRICS_PATH)
+
+  @property
+  def schedule(self) -> Optional[str]:
+    """Crontab formatted schedule of the daemon scans, or None if not specified."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_SCHEDULE) or None
+
+  @property
+  def crontab_path(self) -> Optional[str]:
+    """Crontab file edited by the dashboard, used for the daemon schedule if none is specified."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_CRONTAB_PATH)
+
+  @property
+  def control_socket(self) -> str:
+    """Unix socket of the daemon control API."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_CONTROL_SOCKET, self.DEFAULT_CONTROL_SOCKET)
+
+  @property
+  def log_index_path(self) -> str:
+    """Index of parsed log files, next to the report unless specified."""
+    return self._config[self.CONFIG_KEY_REPORTER].get(
+      self.CONFIG_KEY_LOG_INDEX_PATH, str(Path(self.report_path).with_suffix(".logindex.json"))
+    )
+
+  @property
+  def ssh_multiplexing(self) -> bool:
+    """Whether to share one ssh connection per host for all borg and sshfs calls of a scan."""
+    return bool(self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_SSH_MULTIPLEXING, True))
+
+  @property
+  def archive_stats_from_logs(self) -> bool:
+    """Whether to read new archives details from the borg create --stats output of their log, instead of borg info."""
+    return bool(self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_ARCHIVE_STATS_FROM_LOGS, True))
+
+  @property
+  def scan_workers(self) -> int:
+    """Maximum number of repos scanned concurrently."""
+    return max(1, int(self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_SCAN_WORKERS, self.DEFAULT_SCAN_WORKERS)))
+
+  @property
+  def scan_workers_per_host(self) -> int:
+    """Maximum number of repos scanned concurrently on the same host."""
+    return max(1, int(self._config[self.CONFIG_KEY_REPORTER].get(
+      self.CONFIG_KEY_SCAN_WORKERS_PER_HOST, self.DEFAULT_SCAN_WORKERS_PER_HOST
+    )))
+
+  @property
+  def borg_max_calls(self) -> int:
+    """Maximum number of borg calls running concurrently, by default 2 per scan worker (repo info and list)."""
+    max_calls = self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_BORG_MAX_CALLS)
+    return max(1, int(max_calls)) if max_calls else 2 * self.scan_workers
+
   @property
   def discord_config(self) -> Optional[Tuple[str, Optional[str], str, str]]:
     """Discord configuration if enabled (webhook, user, message, device message), or None"""
@@ -102,6 +290,22 @@ class Config(object):
       discord_cfg.get(self.CONFIG_KEY_MESSAGE_DEVICE, self.DEFAULT_ALARM_MESSAGE_DEV),
     ) if discord_cfg and discord_cfg.get(self.CONFIG_KEY_WEBHOOK) else None
 
+  @property
+  def webhook_config(self) -> Optional[Tuple[str, Optional[str], str, str]]:
+    """Generic json webhook configuration if enabled (webhook, user, message, device message), or None"""
+    webhook_cfg = self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_WEBHOOK_ALARM)
+    return (
+      webhook_cfg[self.CONFIG_KEY_WEBHOOK],
+      webhook_cfg.get(self.CONFIG_KEY_WEBHOOK_USER),
+      webhook_cfg.get(self.CONFIG_KEY_MESSAGE, self.DEFAULT_ALARM_MESSAGE),
+      webhook_cfg.get(self.CONFIG_KEY_MESSAGE_DEVICE, self.DEFAULT_ALARM_MESSAGE_DEV),
+    ) if webhook_cfg and webhook_cfg.get(self.CONFIG_KEY_WEBHOOK) else None
+
+  @property
+  def notify_timeout(self) -> float:
+    """Maximum wait for the alarms delivery at the end of a report, in seconds."""
+    return float(self._config[self.CONFIG_KEY_REPORTER].get(self.CONFIG_KEY_NOTIFY_TIMEOUT, self.DEFAULT_NOTIFY_TIMEOUT))
+
   @property
   def repos_config(self) -> Dict[str, Any]:
     return self._config.get(self.CONFIG_KEY_REPOS, {})
@@ -110,4 +314,6 @@ class Config(object):
     print("Reporter config:", file=sys.stderr)
     print(f"  report={self.report_path}\n  borg={self.borg_path}\n  logs={self.logs_basedir}", file=sys.stderr)
     print(f"  repos={self.repos_basedir}\n  discord={self.discord_config}", file=sys.stderr)
+    print(f"  workers={self.scan_workers}\n  workers_per_host={self.scan_workers_per_host}", file=sys.stderr)
+    print(f"  borg_max_calls={self.borg_max_calls}", file=sys.stderr)
     print(f"Repos config: {self.repos_config}", file=sys.stderr)
@@ -0,0 +1,345 @@
+"""
+Long running reporter, scanning on schedule and on request through a unix socket control API
+"""
+
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sqlite3
+import stat
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set
+from .config import Config
+from .exceptions import ReporterError
+from .reporter import BorgReporter
+
+log = logging.getLogger(__name__)
+
+
+class CronSchedule:
+  """Crontab schedule: minute, hour, day of month, month and day of week fields.
+
+  Fields are *, numbers, ranges or lists of them, with optional steps. As in cron, when both the days of month and
+  of week are restricted, days matching either of them are scheduled.
+  """
+  FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+  # Enough to find a 29th of February on a given week day
+  MAX_DAYS = 366 * 28
+
+  def __init__(self, expression: str) -> None:
+    self.expression = expression
+    fields = expression.split()
+    if len(fields) != len(self.FIELDS):
+      raise ValueError(f"Invalid crontab schedule '{expression}', expecting {len(self.FIELDS)} fields")
+    self.minutes, self.hours, self.days, self.months, weekdays = (
+      self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELDS)
+    )
+    # Sunday is 0 or 7
+    self.weekdays = {weekday % 7 for weekday in weekdays}
+    self._any_day = fields[2].startswith("*")
+    self._any_weekday = fields[4].startswith("*")
+
+  @staticmethod
+  def _parse_field(field: str, low: int, high: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in field.split(","):
+      values_range, _, step = part.partition("/")
+      if values_range == "*":
+        start, end = low, high
+      elif "-" in values_range:
+        start, end = (int(value) for value in values_range.split("-", 1))
+      else:
+        start = int(values_range)
+        end = high if step else start
+      if start < low or end > high or start > end or (step and int(step) < 1):
+        raise ValueError(f"Invalid crontab field '{field}', expecting values from {low} to {high}")
+      values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+  def _day_matches(self, day: date) -> bool:
+    if day.month not in self.months:
+      return False
+    in_days = day.day in self.days
+    in_weekdays = day.isoweekday() % 7 in self.weekdays
+    if self._any_day or self._any_weekday:
+      return (self._any_day or in_days) and (self._any_weekday or in_weekdays)
+    return in_days or in_weekdays
+
+  def next_run(self, after: datetime) -> Optional[datetime]:
+    """First scheduled minute after the given time, None if never scheduled."""
+    start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.date()
+    for _ in range(self.MAX_DAYS):
+      if self._day_matches(day):
+        for hour in sorted(self.hours):
+          for minute in sorted(self.minutes):
+            run = datetime(day.year, day.month, day.day, hour, minute)
+            if run >= start:
+              return run
+      day += timedelta(days=1)
+    return None
+
+  def __str__(self) -> str:
+    return self.expression
+
+
+class ScanRequest:
+  """Scan of the given repos, or all if None, which the requester can wait for."""
+
+  def __init__(self, repos: Optional[Iterable[str]] = None, force: bool = False) -> None:
+    self.repos = list(repos) if repos is not None else None
+    self.force = force
+    self.done = threading.Event()
+    self.error: Optional[str] = None
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+  """Control API connection: json requests, one per line, each answered by a json response line."""
+
+  def handle(self) -> None:
+    for line in self.rfile:
+      try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+          raise ValueError("expecting a json object")
+        response = self.server.reporter_daemon.handle_request(request)  # type: ignore[attr-defined]
+      except (ValueError, TypeError) as e:
+        response = {"status": "error", "error": f"Invalid request: {e}"}
+      self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, path: str, reporter_daemon: "ReporterDaemon") -> None:
+    self.reporter_daemon = reporter_daemon
+    super().__init__(path, ControlHandler)
+
+
+class ReporterDaemon:
+  """Reporter kept running, with its repos, log indexes and ssh connections, to scan on schedule and on request.
+
+  Scans are run one at a time, the requests received during a scan are merged in the next one.
+
+  Control API requests:
+    {"command": "rescan", "repos": [names] (optional, all repos if missing), "wait": bool, "force": bool (optional)}
+    {"command": "status"}
+    {"command": "readlog", "repo": name, "log": log name, and one of:
+      "offset": byte offset, "max_bytes": page size (optional), "partial": bool (optional, default true)
+      "lines": [start, end], line numbers from 0, end excluded or null for the end of the file
+      "tail": number of last lines}
+    To follow a running backup log, request pages from the end of the previous one, with partial false to only get
+    complete lines.
+    {"command": "search", "query": text, "repos": [names] (optional), "exact": bool (optional), "limit": n (optional)}
+    Paths of the archives file indexes containing the text, or archives containing the path if exact.
+  """
+  # Maximum wait between schedule checks, for changes of the crontab file
+  MAX_WAIT = 60
+
+  def __init__(self, config: Config) -> None:
+    self._cfg = config
+    self._reporter = BorgReporter(config, warm=True)
+    self._requests: "queue.Queue[Optional[ScanRequest]]" = queue.Queue()
+    self._stopped = threading.Event()
+    self._scanning: Optional[Dict[str, Any]] = None
+    self._last_scan: Optional[Dict[str, Any]] = None
+    self._expression: Optional[str] = None
+    self._schedule: Optional[CronSchedule] = None
+    self._next_run: Optional[datetime] = None
+
+  def _schedule_expression(self) -> Optional[str]:
+    """Schedule from the config, or from the crontab file edited by the dashboard if enabled."""
+    if self._cfg.schedule or not self._cfg.crontab_path:
+      return self._cfg.schedule
+    try:
+      with open(self._cfg.crontab_path, "r") as f:
+        cronline = f.readline().strip()
+    except OSError:
+      return None
+    # Disabled crontab lines are commented
+    return None if not cronline or cronline.startswith("#") else " ".join(cronline.split()[:5])
+
+  def _update_schedule(self) -> None:
+    expression = self._schedule_expression()
+    if expression == self._expression:
+      return
+    self._expression = expression
+    try:
+      self._schedule = CronSchedule(expression) if expression else None
+    except ValueError as e:
+      log.error(f"Invalid schedule, periodic scans disabled: {e}")
+      self._schedule = None
+    self._next_run = self._schedule.next_run(datetime.now()) if self._schedule else None
+    log.info(f"Scan schedule: {self._schedule}, next scan at {self._next_run}")
+
+  def request_scan(self, repos: Optional[Iterable[str]] = None, force: bool = False) -> ScanRequest:
+    """Queue a scan of the given repos, or all if None. Forced scans also scan unchanged repos."""
+    request = ScanRequest(repos, force)
+    self._requests.put(request)
+    return request
+
+  def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer a control API request."""
+    command = request.get("command")
+    if command == "status":
+      return self.status()
+    if command == "rescan":
+      repos = request.get("repos")
+      if repos is not None:
+        if not isinstance(repos, list):
+          return {"status": "error", "error": "Invalid repos, expecting a list of repo names"}
+        unknown = [repo for repo in repos if repo not in self._cfg.repos_config]
+        if unknown:
+          return {"status": "error", "error": f"Unknown repos: {unknown}"}
+      scan = self.request_scan(repos, bool(request.get("force")))
+      if not request.get("wait"):
+        return {"status": "queued"}
+      scan.done.wait()
+      return {"status": "error", "error": scan.error} if scan.error else {"status": "success"}
+    if command == "readlog":
+      return self.read_log(request)
+    if command == "search":
+      return self.search_files(request)
+    return {"status": "error", "error": f"Unknown command: {command}"}
+
+  def read_log(self, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Read a part of a repo log, by byte offset, line numbers or last lines."""
+    repo = self._reporter.get_repo(str(request.get("repo")))
+    if not repo:
+      return {"status": "error", "error": f"Unknown repo: {request.get('repo')}"}
+    try:
+      with repo.log_reader(str(request.get("log"))) as reader:
+        if "tail" in request:
+          page = reader.tail(int(request["tail"]))
+        elif "lines" in request:
+          start, end = request["lines"]
+          page = reader.read_lines(int(start), None if end is None else int(end))
+        else:
+          page = reader.read_page(
+            int(request.get("offset", 0)), int(request.get("max_bytes") or 0) or None, request.get("partial", True)
+          )
+    except (ReporterError, OSError) as e:
+      return {"status": "error", "error": str(e)}
+    return {"status": "success", "page": page.to_dict()}
+
+  def search_files(self, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Search the archives file indexes."""
+    repos = request.get("repos")
+    if repos is not None and not isinstance(repos, list):
+      return {"status": "error", "error": "Invalid repos, expecting a list of repo names"}
+    try:
+      results = self._reporter.search_files(
+        str(request.get("query", "")), repos, bool(request.get("exact")), int(request.get("limit") or 100)
+      )
+    except (ReporterError, sqlite3.Error) as e:
+      return {"status": "error", "error": str(e)}
+    return {"status": "success", "results": results}
+
+  def status(self) -> Dict[str, Any]:
+    return {
+      "status": "running" if self._scanning else "idle",
+      "scanning": self._scanning,
+      "last_scan": self._last_scan,
+      "schedule": str(self._schedule) if self._schedule else None,
+      "next_run": self._next_run.isoformat() if self._next_run else None,
+      "pending": self._requests.qsize(),
+    }
+
+  def _scan(self, requests: List[ScanRequest]) -> None:
+    """Scan the repos of the requests, all of them if any request is for all repos."""
+    repos = None if any(request.repos is None for request in requests) else sorted(
+      {repo for request in requests for repo in request.repos or []}
+    )
+    force = any(request.force for request in requests)
+    self._scanning = {"start": datetime.now().isoformat(), "repos": repos, "force": force}
+    error = None
+    try:
+      self._reporter.scan_repos(repos, force)
+    except Exception as e:
+      log.exception(f"Scan failed: {e}")
+      error = str(e) or e.__class__.__name__
+    self._last_scan = {**self._scanning, "end": datetime.now().isoformat(), "error": error}
+    self._scanning = None
+    for request in requests:
+      request.error = error
+      request.done.set()
+
+  def _next_requests(self) -> List[ScanRequest]:
+    """Wait for scan requests until the next scheduled scan, returns no requests if time to scan or stopped."""
+    timeout: float = self.MAX_WAIT
+    if self._next_run:
+      timeout = min(timeout, max(0, (self._next_run - datetime.now()).total_seconds()))
+    try:
+      request = self._requests.get(timeout=timeout)
+    except queue.Empty:
+      return []
+    requests = [request]
+    # Merge the requests received meanwhile
+    while not self._requests.empty():
+      requests.append(self._requests.get_nowait())
+    if None in requests:
+      self._stopped.set()
+    return [request for request in requests if request]
+
+  def _run_scans(self) -> None:
+    while not self._stopped.is_set():
+      self._update_schedule()
+      if self._schedule and self._next_run and datetime.now() >= self._next_run:
+        self._next_run = self._schedule.next_run(datetime.now())
+        log.info(f"Starting scheduled scan, next one at {self._next_run}")
+        self._scan([ScanRequest()])
+        continue
+      requests = self._next_requests()
+      if requests:
+        log.info(f"Starting requested scan of {len(requests)} requests")
+        self._scan(requests)
+
+  def _bind(self) -> ControlServer:
+    """Control API server, replacing the socket of a daemon no longer running."""
+    path = self._cfg.control_socket
+    if os.path.exists(path):
+      if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise ReporterError(f"Control socket path {path} exists and is not a socket")
+      with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+          client.connect(path)
+          raise ReporterError(f"Another reporter daemon is listening on {path}")
+        except ConnectionRefusedError:
+          os.unlink(path)
+    server = ControlServer(path, self)
+    os.chmod(path, 0o660)
+    return server
+
+  def stop(self) -> None:
+    """Stop after the current scan."""
+    self._stopped.set()
+    self._requests.put(None)
+
+  def run(self) -> None:
+    """Serve the control API and run the scheduled and requested scans until stopped."""
+    server = self._bind()
+    threading.Thread(target=server.serve_forever, name="control", daemon=True).start()
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+      # Stop from another thread, the main thread may hold the requests queue lock
+      signal.signal(signum, lambda *args: threading.Thread(target=self.stop).start())
+    log.info(f"Reporter daemon started, control socket {self._cfg.control_socket}")
+    try:
+      self._run_scans()
+    finally:
+      server.shutdown()
+      server.server_close()
+      os.unlink(self._cfg.control_socket)
+      self._reporter.close()
+      self._reporter.wait_notifications()
+      # Don't leave requesters waiting for scans that won't run
+      while not self._requests.empty():
+        request = self._requests.get_nowait()
+        if request:
+          request.error = "Reporter daemon stopped"
+          request.done.set()
+      log.info("Reporter daemon stopped")
@@ -8,3 +8,7 @@ class ConfigError(ReporterError):
 
 class RepoError(ReporterError):
   pass
+
+
+class ScanTimeoutError(RepoError):
+  pass
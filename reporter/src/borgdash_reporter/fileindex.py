@@ -0,0 +1,172 @@
+"""
+Index of the files of a repo archives, to find which archives contain a file
+"""
+
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+log = logging.getLogger(__name__)
+
+
+class BorgFileIndex:
+  """Files of the archives of a repo, as listed by borg, with a full text index of their paths.
+
+  Each path is stored once, with the type, size and modification time of the file in each archive containing it.
+  Archives are added and removed in their own transaction, an interrupted indexing keeps the archives already added.
+  Paths are stored as listed by borg, without leading /.
+  """
+  # Files inserted at once while streaming an archive list
+  BATCH_SIZE = 10000
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archives (
+      id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, archive_id TEXT, start TEXT, nfiles INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE);
+    CREATE TABLE IF NOT EXISTS files (
+      path INTEGER NOT NULL, archive INTEGER NOT NULL, type TEXT, size INTEGER, mtime TEXT,
+      PRIMARY KEY (path, archive)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS files_archive ON files (archive);
+    CREATE TEMP TABLE staged_files (path TEXT, type TEXT, size INTEGER, mtime TEXT);
+    CREATE TEMP TABLE removed_paths (path INTEGER PRIMARY KEY);
+  """
+  # Paths full text index, kept up to date by triggers
+  FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS paths_fts USING fts5(path, content='paths', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS paths_insert AFTER INSERT ON paths BEGIN
+      INSERT INTO paths_fts (rowid, path) VALUES (new.id, new.path);
+    END;
+    CREATE TRIGGER IF NOT EXISTS paths_delete AFTER DELETE ON paths BEGIN
+      INSERT INTO paths_fts (paths_fts, rowid, path) VALUES ('delete', old.id, old.path);
+    END;
+  """
+
+  def __init__(self, path: str) -> None:
+    self._path = path
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    self._db = sqlite3.connect(path)
+    # Searches can run while archives are indexed
+    self._db.execute("PRAGMA journal_mode = WAL")
+    self._db.executescript(self.SCHEMA)
+    try:
+      self._db.executescript(self.FTS_SCHEMA)
+      self._fts = True
+    except sqlite3.OperationalError as e:
+      log.warning(f"Full text search unavailable, searching file index {path} without it: {e}")
+      self._fts = False
+
+  @staticmethod
+  def repo_index_path(index_dir: str, repo_name: str) -> str:
+    """File index of a repo in the index directory."""
+    return str(Path(index_dir) / f"{quote(repo_name, safe='')}.sqlite")
+
+  def close(self) -> None:
+    self._db.close()
+
+  def __enter__(self) -> "BorgFileIndex":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+  def archives(self) -> Dict[str, Optional[str]]:
+    """Indexed archives names, and their id."""
+    return dict(self._db.execute("SELECT name, archive_id FROM archives").fetchall())
+
+  def add_archive(
+    self, name: str, archive_id: Optional[str], start: Optional[str], files: Iterable[Dict[str, Any]]
+  ) -> int:
+    """Index the files of an archive, as listed by borg list --json-lines, returns the number of files.
+
+    Nothing is indexed if reading the files raises an exception.
+    """
+    nfiles = 0
+    with self._db:
+      # Indexed again, without the files and paths of its previous indexing
+      self._remove_archive(name)
+      archive = self._db.execute(
+        "INSERT INTO archives (name, archive_id, start) VALUES (?, ?, ?)", (name, archive_id, start)
+      ).lastrowid
+      batch = []
+      for file in files:
+        batch.append((file.get("path"), file.get("type"), file.get("size"), file.get("mtime")))
+        if len(batch) >= self.BATCH_SIZE:
+          nfiles += self._insert_files(archive, batch)
+          batch = []
+      nfiles += self._insert_files(archive, batch)
+      self._db.execute("UPDATE archives SET nfiles = ? WHERE id = ?", (nfiles, archive))
+    return nfiles
+
+  def _insert_files(self, archive: Optional[int], batch: List[Any]) -> int:
+    """Add files to an archive, and their paths not already known."""
+    if not batch:
+      return 0
+    self._db.executemany("INSERT INTO staged_files VALUES (?, ?, ?, ?)", batch)
+    self._db.execute("INSERT OR IGNORE INTO paths (path) SELECT path FROM staged_files WHERE path IS NOT NULL")
+    self._db.execute(
+      "INSERT OR REPLACE INTO files SELECT paths.id, ?, staged_files.type, staged_files.size, staged_files.mtime "
+      "FROM staged_files JOIN paths ON paths.path = staged_files.path",
+      (archive,),
+    )
+    self._db.execute("DELETE FROM staged_files")
+    return len(batch)
+
+  def remove_archives(self, names: Iterable[str]) -> None:
+    """Remove archives from the index, and the paths only in these archives."""
+    for name in names:
+      with self._db:
+        self._remove_archive(name)
+
+  def _remove_archive(self, name: str) -> None:
+    """Remove an archive, its files and the paths only in it, in the current transaction."""
+    row = self._db.execute("SELECT id FROM archives WHERE name = ?", (name,)).fetchone()
+    if not row:
+      return
+    self._db.execute("INSERT OR IGNORE INTO removed_paths SELECT path FROM files WHERE archive = ?", row)
+    self._db.execute("DELETE FROM files WHERE archive = ?", row)
+    self._db.execute("DELETE FROM archives WHERE id = ?", row)
+    self._db.execute(
+      "DELETE FROM paths WHERE id IN (SELECT path FROM removed_paths) "
+      "AND NOT EXISTS (SELECT 1 FROM files WHERE files.path = paths.id)"
+    )
+    self._db.execute("DELETE FROM removed_paths")
+
+  def find(self, path: str) -> List[Dict[str, Any]]:
+    """Archives containing a path, oldest first, with the file details in each."""
+    rows = self._db.execute(
+      "SELECT archives.name, archives.start, files.type, files.size, files.mtime FROM paths "
+      "JOIN files ON files.path = paths.id JOIN archives ON archives.id = files.archive "
+      "WHERE paths.path = ? ORDER BY archives.start",
+      (path.lstrip("/"),),
+    ).fetchall()
+    return [dict(zip(["archive", "start", "type", "size", "mtime"], row)) for row in rows]
+
+  def search(self, text: str, limit: int = 100) -> List[Dict[str, Any]]:
+    """Paths containing the words of the text in this order, the last one possibly partial, with the number of
+    archives containing them and the last one."""
+    if self._fts:
+      # Phrase query, with a prefix last word
+      match = "paths_fts MATCH ?"
+      param = '"' + text.replace('"', '""') + '"*'
+      source = "paths_fts JOIN paths ON paths.id = paths_fts.rowid"
+    else:
+      match = "paths.path LIKE ? ESCAPE '\\'"
+      param = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+      source = "paths"
+    # The archive name is the one of the row with the latest start
+    rows = self._db.execute(
+      f"SELECT paths.path, COUNT(*), archives.name, MAX(archives.start) FROM {source} "
+      f"JOIN files ON files.path = paths.id JOIN archives ON archives.id = files.archive "
+      f"WHERE {match} GROUP BY paths.id ORDER BY paths.path LIMIT ?",
+      (param, limit),
+    ).fetchall()
+    return [dict(zip(["path", "archives", "last_archive", "last_start"], row)) for row in rows]
+
+  def stats(self) -> Dict[str, int]:
+    """Number of archives, paths and files indexed."""
+    return {
+      table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ["archives", "paths", "files"]
+    }
@@ -0,0 +1,135 @@
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Tuple
+from .repo import BorgRepo
+
+log = logging.getLogger(__name__)
+
+
+def _epoch(date_time: Optional[datetime]) -> Optional[int]:
+  return int(date_time.timestamp()) if date_time else None
+
+
+class BorgHistory:
+  """Scan history database, with repo metrics at each scan, and archives and runs once seen.
+
+  Data is indexed by repo and time to query trends without loading reports.
+  """
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS repo_stats (
+      repo TEXT NOT NULL, timestamp INTEGER NOT NULL,
+      osize INTEGER, csize INTEGER, dsize INTEGER, chunks INTEGER, archives INTEGER, status INTEGER,
+      PRIMARY KEY (repo, timestamp)
+    );
+    CREATE TABLE IF NOT EXISTS archives (
+      repo TEXT NOT NULL, name TEXT NOT NULL, id TEXT, start INTEGER, end INTEGER, duration INTEGER,
+      nfiles INTEGER, osize INTEGER, csize INTEGER, dsize INTEGER,
+      PRIMARY KEY (repo, name)
+    );
+    CREATE INDEX IF NOT EXISTS archives_start ON archives (repo, start);
+    CREATE TABLE IF NOT EXISTS runs (
+      repo TEXT NOT NULL, log TEXT NOT NULL, datetime INTEGER, status TEXT, archive TEXT,
+      PRIMARY KEY (repo, log)
+    );
+    CREATE INDEX IF NOT EXISTS runs_datetime ON runs (repo, datetime);
+    CREATE TABLE IF NOT EXISTS repo_fingerprints (repo TEXT PRIMARY KEY, fingerprint TEXT);
+  """
+
+  def __init__(self, path: str) -> None:
+    self._path = path
+    self._db = sqlite3.connect(path)
+    self._db.executescript(self.SCHEMA)
+
+  def close(self) -> None:
+    self._db.close()
+
+  def __enter__(self) -> "BorgHistory":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+  def record_scan(self, repos: Iterable[BorgRepo], timestamp: Optional[datetime] = None) -> None:
+    """Add the repos metrics of a scan, and their archives and runs not already recorded.
+
+    Archives and runs are only read for repos that changed since recorded, and only the most recent ones are written.
+    """
+    scan_time = _epoch(timestamp or datetime.now())
+    with self._db:
+      fingerprints = dict(self._db.execute("SELECT repo, fingerprint FROM repo_fingerprints").fetchall())
+      for repo in repos:
+        status = repo.status()
+        self._db.execute(
+          "INSERT OR REPLACE INTO repo_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+          (
+            repo.name, scan_time, repo.sizes.original_size, repo.sizes.compressed_size,
+            repo.sizes.deduplicated_size, int(repo.chunks), len(repo.archives),
+            None if status is None else int(status),
+          ),
+        )
+        if repo.fingerprint and repo.fingerprint == fingerprints.get(repo.name):
+          continue
+        self._record_archives(repo)
+        self._record_runs(repo)
+        self._db.execute("INSERT OR REPLACE INTO repo_fingerprints VALUES (?, ?)", (repo.name, repo.fingerprint))
+    log.info(f"Scan history saved to {self._path}")
+
+  def _record_archives(self, repo: BorgRepo) -> None:
+    """Add the archives started since the last recorded one, archives are immutable."""
+    last_start = self._db.execute("SELECT max(start) FROM archives WHERE repo = ?", (repo.name,)).fetchone()[0]
+    self._db.executemany(
+      "INSERT OR IGNORE INTO archives VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+      [
+        (
+          repo.name, arch.name, arch.id, start, _epoch(arch.date_time_end), arch.duration, arch.nfiles,
+          arch.sizes.original_size if arch.sizes else None, arch.sizes.compressed_size if arch.sizes else None,
+          arch.sizes.deduplicated_size if arch.sizes else None,
+        )
+        for arch in repo.iter_archives()
+        if (start := _epoch(arch.date_time)) is not None and (last_start is None or start >= last_start)
+      ],
+    )
+
+  def _record_runs(self, repo: BorgRepo) -> None:
+    """Add or update the runs since the last recorded one, and the runs without time such as running backups."""
+    last_run = self._db.execute("SELECT max(datetime) FROM runs WHERE repo = ?", (repo.name,)).fetchone()[0]
+    self._db.executemany(
+      "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)",
+      [
+        (repo.name, borglog.name, run_time, borglog.status, borglog.archive_name)
+        for borglog in repo.iter_logs()
+        if (run_time := _epoch(borglog.date_time)) is None or last_run is None or run_time >= last_run
+      ],
+    )
+
+  def repo_growth(
+    self, repo: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+  ) -> List[Tuple[int, int, int, int]]:
+    """Repo sizes (timestamp, original, compressed, deduplicated) at each scan in the time range."""
+    return self._db.execute(
+      "SELECT timestamp, osize, csize, dsize FROM repo_stats WHERE repo = ? AND timestamp BETWEEN ? AND ? "
+      "ORDER BY timestamp",
+      (repo, *self._range(start, end)),
+    ).fetchall()
+
+  def archive_durations(
+    self, repo: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+  ) -> List[Tuple[str, int, int]]:
+    """Archives (name, start, duration) created in the time range."""
+    return self._db.execute(
+      "SELECT name, start, duration FROM archives WHERE repo = ? AND start BETWEEN ? AND ? ORDER BY start",
+      (repo, *self._range(start, end)),
+    ).fetchall()
+
+  def failure_rate(self, repo: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[float]:
+    """Ratio of failed runs in the time range, None if no runs."""
+    total, failed = self._db.execute(
+      "SELECT COUNT(*), SUM(status NOT IN ('success', 'info')) FROM runs WHERE repo = ? AND datetime BETWEEN ? AND ?",
+      (repo, *self._range(start, end)),
+    ).fetchone()
+    return failed / total if total else None
+
+  @staticmethod
+  def _range(start: Optional[datetime], end: Optional[datetime]) -> Tuple[Any, Any]:
+    return (_epoch(start) or 0, _epoch(end) or 2**62)
@@ -0,0 +1,48 @@
+from typing import Any, Callable, Dict, Iterator, MutableMapping, TypeVar
+
+T = TypeVar("T")
+
+
+class LazyDict(MutableMapping[str, T]):
+  """Dict of objects loaded from report data, only decoded when accessed.
+
+  Accessed items are decoded once and kept, stream() decodes items one at a time without keeping them, and
+  encoded() returns items not decoded as is, so that loading and exporting back data never used is cheap.
+  """
+
+  def __init__(self, raw: Dict[str, Any], decode: Callable[[Dict[str, Any]], T]) -> None:
+    self._raw = dict(raw)
+    self._decoded: Dict[str, T] = {}
+    self._decode = decode
+
+  def __getitem__(self, key: str) -> T:
+    if key not in self._decoded:
+      self._decoded[key] = self._decode(self._raw[key])
+    return self._decoded[key]
+
+  def __setitem__(self, key: str, value: T) -> None:
+    # Raw data keeps the items order
+    self._raw.setdefault(key, None)
+    self._decoded[key] = value
+
+  def __delitem__(self, key: str) -> None:
+    del self._raw[key]
+    self._decoded.pop(key, None)
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self._raw)
+
+  def __len__(self) -> int:
+    return len(self._raw)
+
+  def __contains__(self, key: object) -> bool:
+    return key in self._raw
+
+  def stream(self) -> Iterator[T]:
+    """Iterate over the items, without keeping those not already decoded."""
+    for key, raw in self._raw.items():
+      yield self._decoded[key] if key in self._decoded else self._decode(raw)
+
+  def encoded(self, encode: Callable[[T], Dict[str, Any]]) -> Dict[str, Any]:
+    """Items encoded back to report data, items never decoded are not decoded."""
+    return {key: encode(self._decoded[key]) if key in self._decoded else raw for key, raw in self._raw.items()}
@@ -1,18 +1,61 @@
+import io
 import logging
+import os
+import re
+import shlex
 import subprocess
 from pathlib import Path
-from typing import Iterator, Optional
+from urllib.parse import urlsplit
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from tempfile import TemporaryDirectory
+from .exceptions import ScanTimeoutError
+from .timing import span, time_left
 
 log = logging.getLogger(__name__)
 
+# Host of scp style paths, with no / before the :
+SCP_PATH = re.compile(r"^(?:[^@/:]+@)?(?P<host>\[[^\]/]+\]|[^@/:\[\]]+):")
+
+
+class LogStat(NamedTuple):
+  """Subset of os.stat_result available for remote files."""
+  st_size: int
+  st_mtime_ns: int
+  st_ino: int = 0
+
+
+class RemoteLogEntry:
+  """Remote log file, with the os.DirEntry interface used to scan logs."""
+
+  def __init__(self, dirpath: str, name: str, size: int, mtime: int) -> None:
+    self.name = name
+    self.path = f"{dirpath.rstrip('/')}/{name}"
+    self._stat = LogStat(size, mtime * 1000000000)
+
+  def is_file(self) -> bool:
+    return True
+
+  def stat(self) -> LogStat:
+    return self._stat
+
+
+LogEntry = Union[os.DirEntry, RemoteLogEntry]
+FileStat = Union[os.stat_result, LogStat]
+
 
 class BaseFs:
   """Manage log filesystem, either local or through sshfs"""
+  # Whether inode numbers identify files across mounts
+  STABLE_INODES = True
+  # Bytes fetched at the end of the logs to parse, None if the logs are read directly
+  TAIL_SIZE: Optional[int] = None
 
-  def __init__(self, logpath: str):
+  def __init__(self, logpath: str, ssh_options: Optional[List[str]] = None):
     self.logpath = logpath
     self.mountpath = Path()
+    self.ssh_options = ssh_options or []
+    # Deadline (monotonic time) of the current scan, remote commands are interrupted once passed
+    self.deadline: Optional[float] = None
 
   @staticmethod
   def matchesPath(filepath: str) -> bool:
@@ -31,6 +74,15 @@ class BaseFs:
       log.error(f"Unable to read logs: {e}")
       return iter([])
 
+  def get_logs_entries(self) -> List[LogEntry]:
+    """Log files, read in a single directory listing which also provides cached file types and stats."""
+    try:
+      with os.scandir(self.mountpath) as entries:
+        return [entry for entry in entries if entry.is_file()]
+    except OSError as e:
+      log.error(f"Unable to read logs: {e}")
+      return []
+
   def __str__(self) -> str:
     return self.logpath
 
@@ -40,12 +92,38 @@ class BaseFs:
   def delete(self, filepath: Path) -> None:
     filepath.unlink(missing_ok=True)
 
+  def delete_logs(self, filepaths: List[Path]) -> None:
+    """Delete multiple log files."""
+    for filepath in filepaths:
+      try:
+        self.delete(filepath)
+      except OSError as e:
+        log.warning(f"Couldn't delete file {filepath}: {e}")
+
+  def fetch_logs(self, filepaths: List[Path], tail_size: Optional[int] = None) -> None:
+    """Prepare the given log files to be opened, for file systems needing to retrieve them, with the given tail size
+    instead of TAIL_SIZE if specified."""
+    ...
+
+  def open_log(self, filepath: Path) -> BinaryIO:
+    """Open a log file to parse it."""
+    return open(filepath, 'rb')
+
+  def read_log(self, filepath: Path, offset: int, size: int) -> Tuple[int, bytes]:
+    """Read up to size bytes of a log file from the offset, returns the file size and the bytes read."""
+    with open(filepath, 'rb') as f:
+      file_size = f.seek(0, os.SEEK_END)
+      f.seek(min(offset, file_size))
+      return file_size, f.read(size)
+
 
 class LocalFs(BaseFs):
   """Local file system, no mount/unmount/mapping necessary."""
-  def __init__(self, logpath: str):
+  def __init__(self, logpath: str, ssh_options: Optional[List[str]] = None):
     self.logpath = logpath
     self.mountpath = Path(logpath)
+    self.ssh_options = []
+    self.deadline = None
 
   @staticmethod
   def matchesPath(filepath: str) -> bool:
@@ -55,11 +133,13 @@ class LocalFs(BaseFs):
 class SshFs(BaseFs):
   """sshfs based filesystem, needs to be mounted and unmounted."""
   SSHFS_PREFIX = 'sshfs://'
+  # sshfs generates inode numbers at each mount unless -o use_ino is given
+  STABLE_INODES = False
   MOUNT_COMMAND = ["sshfs", "-o", "allow_other"]
   UNMOUNT_COMMAND = ["umount"]
 
-  def __init__(self, logpath: str):
-    super().__init__(logpath)
+  def __init__(self, logpath: str, ssh_options: Optional[List[str]] = None):
+    super().__init__(logpath, ssh_options)
     self.tempdir = None
     self.remotepath = self.logpath.replace(self.SSHFS_PREFIX,'')
 
@@ -72,28 +152,175 @@ class SshFs(BaseFs):
     if not self.tempdir:
       self.tempdir = TemporaryDirectory(ignore_cleanup_errors=True)
       self.mountpath = Path(self.tempdir.name)
-      self._run_cmd(self.MOUNT_COMMAND + [self.remotepath, str(self.mountpath)])
+      with span("logfs.mount"):
+        self._run_cmd(self.MOUNT_COMMAND + self.ssh_options + [self.remotepath, str(self.mountpath)], self.deadline)
       log.info(f"Mounted {self.logpath} to {self.mountpath}")
 
   def umount(self) -> None:
     if self.tempdir:
-      self._run_cmd(self.UNMOUNT_COMMAND + [self.mountpath])
+      with span("logfs.umount"):
+        self._run_cmd(self.UNMOUNT_COMMAND + [self.mountpath])
       self.tempdir.cleanup()
       self.tempdir = None
       self.mountpath = Path()
       log.info(f"Unmounted {self.logpath} from {self.mountpath}")
 
-  def _run_cmd(self, args, pwd=None) -> Optional[bytes]:
+  def _run_cmd(self, args, deadline: Optional[float] = None) -> Optional[bytes]:
     res = None
     try:
       log.debug(f"Executing command: {args}")
-      res = subprocess.run(args, stdout=subprocess.PIPE, check=True)
+      res = subprocess.run(args, stdout=subprocess.PIPE, check=True, timeout=time_left(deadline))
     except subprocess.CalledProcessError as e:
       log.error(f"Failed to run command {args}: {e}")
+    except subprocess.TimeoutExpired as e:
+      raise ScanTimeoutError(f"Command exceeded the scan deadline: {e}") from e
     return res.stdout if res else None
 
+def reversed_lines(f: BinaryIO, block_size: int = 4096, max_bytes: Optional[int] = None) -> Iterator[str]:
+  """Yield the lines of a binary file from the last one, reading blocks from the end only as lines are consumed.
+
+  Reading stops after max_bytes if specified, the partial first line read is then not returned.
+  """
+  pos = f.seek(0, os.SEEK_END)
+  start = pos
+  remainder = b""
+  while pos > 0:
+    if max_bytes is not None and start - pos >= max_bytes:
+      return
+    size = min(block_size, pos)
+    pos -= size
+    f.seek(pos, os.SEEK_SET)
+    lines = (f.read(size) + remainder).split(b"\n")
+    # First line may be incomplete, keep it for the next block
+    remainder = lines.pop(0)
+    for line in reversed(lines):
+      yield line.decode(errors="replace")
+  yield remainder.decode(errors="replace")
+
+
+class SshLogFs(BaseFs):
+  """Remote logs read with ssh commands, without mount.
+
+  A single command lists the logs with their stats, another one retrieves the end of the logs to parse, which is
+  enough to get the status of most logs.
+  """
+  SSH_PREFIX = 'ssh://'
+  SSH_COMMAND = ["ssh"]
+  TAIL_SIZE = 32 * 1024
+  HEADER = "BORGDASH"
+  # Log files stats: "size mtime ./name"
+  LIST_SCRIPT = "cd -- {dir} && find . -maxdepth 1 -type f -exec stat -c '%s %Y %n' -- {{}} +"
+  # For each file name read from stdin: "HEADER size name\n" followed by the last size bytes and "\n"
+  TAILS_SCRIPT = (
+    "cd -- {dir} || exit 1; "
+    "while IFS= read -r f; do "
+    "[ -f \"$f\" ] || continue; "
+    "n=$(stat -c %s -- \"$f\"); [ \"$n\" -gt {tail} ] && n={tail}; "
+    "printf '{header} %s %s\\n' \"$n\" \"$f\"; "
+    "tail -c \"$n\" -- \"$f\" | head -c \"$n\"; printf '\\n'; "
+    "done"
+  )
+  DELETE_SCRIPT = "cd -- {dir} || exit 1; while IFS= read -r f; do rm -f -- \"$f\"; done"
+  # For the file name read from stdin: "size\n" followed by up to {size} bytes from {offset}
+  READ_SCRIPT = (
+    "cd -- {dir} || exit 1; IFS= read -r f; [ -f \"$f\" ] || exit 1; "
+    "stat -c %s -- \"$f\"; tail -c +{start} -- \"$f\" | head -c {size}"
+  )
+  STABLE_INODES = False
+
+  def __init__(self, logpath: str, ssh_options: Optional[List[str]] = None):
+    super().__init__(logpath, ssh_options)
+    url = urlsplit(logpath)
+    self.destination = f"{url.username}@{url.hostname}" if url.username else str(url.hostname)
+    self.port = url.port
+    self.remotepath = url.path or "."
+    self.mountpath = Path(self.remotepath)
+    self._tails: Dict[str, bytes] = {}
+
+  @staticmethod
+  def matchesPath(filepath: str) -> bool:
+    return filepath.startswith(SshLogFs.SSH_PREFIX)
+
+  def _run_remote(self, script: str, input: Optional[bytes] = None, **params: Any) -> Optional[bytes]:
+    args = self.SSH_COMMAND + self.ssh_options + (["-p", str(self.port)] if self.port else [])
+    values = {"dir": shlex.quote(self.remotepath), "tail": self.TAIL_SIZE, "header": self.HEADER, **params}
+    script = script.format(**values)
+    args += [self.destination, script]
+    try:
+      log.debug(f"Executing remote command: {args}")
+      with span("logfs.ssh") as ssh_span:
+        output = subprocess.run(
+          args, input=input, stdout=subprocess.PIPE, check=True, timeout=time_left(self.deadline)
+        ).stdout
+        ssh_span.bytes = len(output)
+        return output
+    except (OSError, subprocess.CalledProcessError) as e:
+      log.error(f"Failed to run remote command {args}: {e}")
+    except subprocess.TimeoutExpired as e:
+      raise ScanTimeoutError(f"Remote command exceeded the scan deadline: {e}") from e
+    return None
+
+  @staticmethod
+  def _names_input(filepaths: Iterable[Path]) -> bytes:
+    return "".join(f"{filepath.name}\n" for filepath in filepaths).encode()
+
+  def get_logs_entries(self) -> List[LogEntry]:
+    entries: List[LogEntry] = []
+    for line in (self._run_remote(self.LIST_SCRIPT) or b"").decode(errors="replace").splitlines():
+      try:
+        size, mtime, name = line.split(" ", 2)
+        entries.append(RemoteLogEntry(self.remotepath, name.removeprefix("./"), int(size), int(mtime)))
+      except ValueError:
+        log.error(f"Invalid remote log entry: {line}")
+    return entries
+
+  def fetch_logs(self, filepaths: List[Path], tail_size: Optional[int] = None) -> None:
+    """Retrieve the end of all the given log files in a single remote command."""
+    self._tails = {}
+    if not filepaths:
+      return
+    output = self._run_remote(self.TAILS_SCRIPT, self._names_input(filepaths), tail=tail_size or self.TAIL_SIZE) or b""
+    pos = 0
+    while pos < len(output):
+      eol = output.find(b"\n", pos)
+      header = output[pos:eol].decode(errors="replace").split(" ", 2) if eol >= 0 else []
+      if len(header) != 3 or header[0] != self.HEADER or not header[1].isdigit():
+        log.error(f"Invalid remote logs output at {pos}, ignoring the remaining logs")
+        break
+      size = int(header[1])
+      self._tails[header[2]] = output[eol + 1:eol + 1 + size]
+      # Each file content is followed by a new line, if not the file changed while read
+      pos = eol + 1 + size
+      if output[pos:pos + 1] != b"\n":
+        log.error(f"Remote log {header[2]} changed while read, ignoring the remaining logs")
+        break
+      pos += 1
+    log.info(f"Fetched {len(self._tails)} remote logs from {self.logpath} ({len(output)} bytes)")
+
+  def open_log(self, filepath: Path) -> BinaryIO:
+    if filepath.name not in self._tails:
+      raise FileNotFoundError(f"Remote log {filepath} not fetched")
+    return io.BytesIO(self._tails[filepath.name])
+
+  def read_log(self, filepath: Path, offset: int, size: int) -> Tuple[int, bytes]:
+    """Read a part of a remote log file, with its size, in a single remote command."""
+    output = self._run_remote(self.READ_SCRIPT, self._names_input([filepath]), start=offset + 1, size=size)
+    file_size, _, data = (output or b"").partition(b"\n")
+    if not file_size.isdigit():
+      raise FileNotFoundError(f"Unable to read remote log {filepath}")
+    return int(file_size), data
+
+  def delete(self, filepath: Path) -> None:
+    self.delete_logs([filepath])
+
+  def delete_logs(self, filepaths: List[Path]) -> None:
+    """Delete all the given log files in a single remote command."""
+    if filepaths:
+      self._run_remote(self.DELETE_SCRIPT, self._names_input(filepaths))
+
+
 # List supported file system drivers
-SUPPORTED_FS = [ SshFs, LocalFs]
+SUPPORTED_FS = [ SshFs, SshLogFs, LocalFs]
 
 
 def resolve_path(base_path: str, partial_path: str) -> str:
@@ -106,10 +333,24 @@ def resolve_path(base_path: str, partial_path: str) -> str:
     return f"{base_path}{partial_path}"
 
 
-def logfs_from_path(logpath: Optional[str]) -> Optional[BaseFs]:
+def host_from_path(path: Optional[str]) -> Optional[str]:
+  """Host name of a remote ssh, scp style or sshfs path, or None if no path or a local path."""
+  if not path:
+    return None
+  if path.startswith('ssh://'):
+    return urlsplit(path).hostname
+  if SshFs.matchesPath(path):
+    # sshfs remote format: [user@]host:[path]
+    return path.replace(SshFs.SSHFS_PREFIX, '').split(':', 1)[0].split('@')[-1] or None
+  # borg scp style remote repos: [user@]host:path
+  scp_path = SCP_PATH.match(path)
+  return scp_path.group("host").strip("[]") if scp_path else None
+
+
+def logfs_from_path(logpath: Optional[str], ssh_options: Optional[List[str]] = None) -> Optional[BaseFs]:
   """Final a fs matching the given path."""
   if logpath:
     for fs in SUPPORTED_FS:
       if fs.matchesPath(logpath):
-        return fs(logpath)
+        return fs(logpath, ssh_options)
   return None
@@ -0,0 +1,212 @@
+"""
+Paged reading of log files, without loading them entirely
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from .logfs import BaseFs, LocalFs
+
+log = logging.getLogger(__name__)
+
+
+class LogPage(NamedTuple):
+  """Lines read from a log file, without their line ends."""
+  lines: List[str]
+  # Byte offsets of the first line and after the last one, where the next page starts
+  start: int
+  end: int
+  # Number of the first line, from 0, None if unknown
+  first_line: Optional[int]
+  # Size of the file when read, and whether the page ends at the end of the file
+  size: int
+  eof: bool
+
+  def to_dict(self) -> Dict[str, Any]:
+    return self._asdict()
+
+
+class LineIndex:
+  """Byte offsets of every INTERVAL lines of a file, built incrementally as the file is read and grows."""
+  INTERVAL = 1000
+
+  def __init__(self) -> None:
+    # offsets[i] is the offset of line i * INTERVAL
+    self.offsets = [0]
+    # Complete lines found before the indexed offset
+    self.lines = 0
+    self.indexed = 0
+    self.lock = threading.Lock()
+
+  def add(self, data: bytes) -> None:
+    """Index the data read at the indexed offset."""
+    pos = data.find(b"\n")
+    while pos >= 0:
+      self.lines += 1
+      if self.lines % self.INTERVAL == 0:
+        self.offsets.append(self.indexed + pos + 1)
+      pos = data.find(b"\n", pos + 1)
+    self.indexed += len(data)
+
+  def checkpoint(self, line: int) -> Tuple[int, int]:
+    """Closest indexed line before the given line, and its offset."""
+    index = min(line // self.INTERVAL, len(self.offsets) - 1)
+    return index * self.INTERVAL, self.offsets[index]
+
+
+class LogReader:
+  """Read parts of a log file through its file system: pages from a byte offset, line ranges, last lines, and new
+  lines as a running backup writes them.
+
+  Line ranges use a line offsets index cached for each file, and extended as the file grows.
+  """
+  PAGE_SIZE = 256 * 1024
+  BLOCK_SIZE = 256 * 1024
+  FOLLOW_INTERVAL = 1.0
+  MAX_INDEXES = 64
+
+  _indexes: "OrderedDict[str, LineIndex]" = OrderedDict()
+  _indexes_lock = threading.Lock()
+
+  def __init__(self, filepath: Union[Path, str], logfs: Optional[BaseFs] = None) -> None:
+    self.filepath = Path(filepath)
+    self.logfs = logfs or LocalFs(str(self.filepath.parent))
+
+  def _read(self, offset: int, size: int) -> Tuple[int, bytes]:
+    return self.logfs.read_log(self.filepath, offset, size)
+
+  @staticmethod
+  def _decode(data: bytes) -> List[str]:
+    """Lines of the data, a last line end doesn't start a new line."""
+    return data.removesuffix(b"\n").decode(errors="replace").split("\n") if data else []
+
+  def _read_chunk(self, offset: int, max_bytes: int, partial: bool = True) -> Tuple[int, bytes]:
+    """File size and data from the offset, ending with a line end, or at the end of the file if partial."""
+    size, data = self._read(offset, max_bytes)
+    while True:
+      eol = data.rfind(b"\n")
+      at_eof = offset + len(data) >= size
+      if at_eof and partial:
+        return size, data
+      if eol >= 0:
+        return size, data[:eol + 1]
+      if at_eof:
+        return size, b""
+      # No line end in the chunk, read until the end of the line
+      size, more = self._read(offset + len(data), self.BLOCK_SIZE)
+      if not more:
+        return size, data
+      data += more
+
+  def read_page(self, offset: int = 0, max_bytes: Optional[int] = None, partial: bool = True) -> LogPage:
+    """Lines from the offset, which should be a line start like the end of a previous page.
+
+    The page ends at the last line end within max_bytes, or at the end of the file, where a last line being written
+    is only included if partial. A single line longer than max_bytes is returned entirely.
+    """
+    size, data = self._read_chunk(offset, max_bytes or self.PAGE_SIZE, partial)
+    end = offset + len(data)
+    return LogPage(self._decode(data), offset, end, None, size, end >= size)
+
+  def _line_index(self, size: int) -> LineIndex:
+    """Cached line index of the file, reset if the file was truncated or replaced by a smaller one."""
+    key = f"{self.logfs.logpath}:{self.filepath}"
+    with self._indexes_lock:
+      index = self._indexes.pop(key, None)
+      if not index or index.indexed > size:
+        index = LineIndex()
+      self._indexes[key] = index
+      while len(self._indexes) > self.MAX_INDEXES:
+        self._indexes.popitem(last=False)
+    return index
+
+  def read_lines(self, start: int, end: Optional[int] = None) -> LogPage:
+    """Lines from start to end (excluded), or to the end of the file, numbered from 0."""
+    size, _ = self._read(0, 0)
+    index = self._line_index(size)
+    with index.lock:
+      # Index up to the start line, reading only the part of the file not indexed yet
+      while index.lines < start and index.indexed < size:
+        size, data = self._read(index.indexed, self.BLOCK_SIZE)
+        if not data:
+          break
+        index.add(data)
+      line, offset = index.checkpoint(start)
+    lines: List[bytes] = []
+    first = None
+    while end is None or line < end:
+      size, data = self._read_chunk(offset, self.BLOCK_SIZE)
+      if not data:
+        break
+      pos = 0
+      while pos < len(data) and (end is None or line < end):
+        eol = data.find(b"\n", pos)
+        next_pos = eol + 1 if eol >= 0 else len(data)
+        if line >= start:
+          first = offset + pos if first is None else first
+          lines.append(data[pos:next_pos].removesuffix(b"\n"))
+        line += 1
+        pos = next_pos
+      offset += pos
+    decoded = [line.decode(errors="replace") for line in lines]
+    return LogPage(decoded, offset if first is None else first, offset, start, size, offset >= size)
+
+  def tail(self, count: int) -> LogPage:
+    """Last count lines, reading blocks from the end of the file."""
+    size, _ = self._read(0, 0)
+    pos = size
+    data = b""
+    # Read until the line end before the first of the lines
+    while pos > 0 and data.removesuffix(b"\n").count(b"\n") < count:
+      block = min(self.BLOCK_SIZE, pos)
+      pos -= block
+      data = self._read(pos, block)[1] + data
+    lines = data.removesuffix(b"\n").split(b"\n")[-count:] if data and count else []
+    start = size - len(b"\n".join(lines)) - (1 if lines and data.endswith(b"\n") else 0)
+    # The first line number is known if the whole file is indexed
+    index = self._line_index(size)
+    first_line = None
+    if index.indexed == size:
+      first_line = index.lines + (0 if not data or data.endswith(b"\n") else 1) - len(lines)
+    return LogPage([line.decode(errors="replace") for line in lines], start, size, first_line, size, True)
+
+  def _line_start(self, offset: int) -> int:
+    """Offset of the start of the line containing the offset."""
+    pos = offset
+    while pos > 0:
+      block = min(self.BLOCK_SIZE, pos)
+      eol = self._read(pos - block, block)[1].rfind(b"\n")
+      if eol >= 0:
+        return pos - block + eol + 1
+      pos -= block
+    return 0
+
+  def follow(
+    self, offset: Optional[int] = None, interval: Optional[float] = None, stop: Optional[threading.Event] = None
+  ) -> Iterator[LogPage]:
+    """Pages of the complete lines written from the offset, or from the last line being written, until stopped.
+
+    Reading starts again from the beginning if the file is truncated.
+    """
+    interval = interval or self.FOLLOW_INTERVAL
+    stop = stop or threading.Event()
+    if offset is None:
+      offset = self._line_start(self._read(0, 0)[0])
+    while not stop.is_set():
+      try:
+        page = self.read_page(offset, partial=False)
+      except FileNotFoundError as e:
+        log.warning(f"Stopped following log {self.filepath}: {e}")
+        return
+      if page.size < offset:
+        log.info(f"Log {self.filepath} truncated, reading from the start")
+        offset = 0
+        continue
+      if page.lines:
+        offset = page.end
+        yield page
+      # Wait for new lines at the end of the file, or for the end of the line being written
+      if not page.lines or page.eof:
+        stop.wait(interval)
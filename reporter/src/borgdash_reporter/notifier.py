@@ -1,9 +1,12 @@
 import logging
 import json
+import queue
+import threading
+import time
 from abc import ABC,abstractmethod
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
 from .config import Config
-from discord import SyncWebhook
 from .repo import BorgRepo
 
 log = logging.getLogger(__name__)
@@ -11,74 +14,39 @@ log = logging.getLogger(__name__)
 class BorgNotifier(ABC):
   DEFAULT_MESSAGE = "**{} Backups failed**:\n\n{}\nSee [web dashboard](http://127.0.0.1:3000)"
   DEFAULT_MESSAGE_BACKUP = "- **{}**: Failed with status `{}` on {}\n"
+  # Maximum message length accepted by the notification service, if any
+  MAX_MESSAGE_SIZE: Optional[int] = None
 
   def __init__(self, config: Config) -> None:
     self._cfg = config
     self._enabled = False
-    self._alarms: List[BorgRepo] = []
     self._message = self.DEFAULT_MESSAGE
     self._message_bkup = self.DEFAULT_MESSAGE_BACKUP
 
-  def _build_message(self):
-    deduped = self._dedupe()
-    if not deduped:
-      return None
+  def __str__(self) -> str:
+    return self.__class__.__name__
 
-    content = ""
-    log.info(f"Notifying {len(deduped)} failed backups")
-    for repo in deduped:
+  def _build_messages(self, repos: List[BorgRepo]) -> List[str]:
+    """Messages for the failed backups of the repos, with as many backups per message as the size limit allows."""
+    messages = []
+    batch: List[str] = []
+    for repo in repos:
       status, datetime = (repo.last_run.status, repo.last_run.date_time) if repo.last_run else ("","")
-      content += self._message_bkup.format(repo.name, status, datetime)
-    return self._message.format(len(deduped), content)
+      line = self._message_bkup.format(repo.name, status, datetime)
+      if batch and self.MAX_MESSAGE_SIZE and (
+        len(self._message.format(len(batch) + 1, "".join(batch + [line]))) > self.MAX_MESSAGE_SIZE
+      ):
+        messages.append(self._message.format(len(batch), "".join(batch)))
+        batch = []
+      batch.append(line)
+    if batch:
+      messages.append(self._message.format(len(batch), "".join(batch)))
+    return [message[:self.MAX_MESSAGE_SIZE] for message in messages] if self.MAX_MESSAGE_SIZE else messages
 
   @abstractmethod
   def _send_message(self, message: str):
       raise NotImplementedError("_send_message method not implemebnted")
 
-  def _dedupe(self):
-    """Dedupe to remove alarms already notified (are in the dedupes)."""
-    old_alarms = self._load_dedupes()
-    dedupes = []
-    for repo in self._alarms:
-      if (
-        repo.last_run and repo.last_run.date_time and
-        old_alarms.get(repo.name) != int(repo.last_run.date_time.timestamp())
-      ):
-        dedupes.append(repo)
-    log.info(f"Loaded {len(old_alarms)} alarm, {len(self._alarms) - len(dedupes)} repo deduped and not alarmed on.")
-    return dedupes
-
-  def _load_dedupes(self) -> Dict[str, Any]:
-    """Load and return alarms in the dedupe file."""
-    try:
-      with open(self._cfg.dedupe_path, "r") as f:
-        return json.load(f)
-    except Exception as e:
-      log.warning(f"Cannot load dedupe file: {e}")
-    return {}
-
-  def _save_dedupes(self) -> None:
-    """Save current alarms in the dedupe file."""
-    try:
-      with open(self._cfg.dedupe_path, "w") as f:
-        alarms = {
-          repo.name: int(repo.last_run.date_time.timestamp())
-          for repo in self._alarms if repo.last_run and repo.last_run.date_time
-        }
-        json.dump(alarms, f)
-        log.info(f"Saved {len(alarms)} alarms to {self._cfg.dedupe_path}")
-    except Exception as e:
-      log.warning(f"Cannot save dedupe file: {e}")
-
-  def addWarning(self, repo: BorgRepo):
-      self._alarms.append(repo)
-
-  def notify(self):
-    content = self._build_message()
-    if content and self._enabled:
-      self._send_message(content)
-    self._save_dedupes()
-
 
 class LogNotifier(BorgNotifier):
   def __init__(self, config: Config) -> None:
@@ -90,11 +58,16 @@ class LogNotifier(BorgNotifier):
 
 
 class DiscordNotifier(BorgNotifier):
+  """Discord webhook alarms, discord.py is only imported when configured as its import tree is slow to load."""
+  MAX_MESSAGE_SIZE = 2000
+
   def __init__(self, config: Config) -> None:
     super().__init__(config)
 
     if self._cfg.discord_config:
       self._webhook_url, self._user, message, message_bkup = self._cfg.discord_config
+      from discord import SyncWebhook
+
       self._enabled = True
       self._webhook = SyncWebhook.from_url(self._webhook_url)
       if message:
@@ -106,15 +79,202 @@ class DiscordNotifier(BorgNotifier):
     self._webhook.send(message, username=self._user or "")
 
 
+class WebhookNotifier(BorgNotifier):
+  """Any webhook accepting a json post of the message content and user name, like the discord webhooks."""
+  MAX_MESSAGE_SIZE = 2000
+  TIMEOUT = 30
+
+  def __init__(self, config: Config) -> None:
+    super().__init__(config)
+
+    if self._cfg.webhook_config:
+      self._webhook_url, self._user, message, message_bkup = self._cfg.webhook_config
+      self._enabled = True
+      if message:
+          self._message = message
+      if message_bkup:
+          self._message_bkup = message_bkup
+
+  def _send_message(self, message: str):
+    import urllib.request
+
+    request = urllib.request.Request(
+      self._webhook_url,
+      data=json.dumps({"content": message, "username": self._user or ""}).encode(),
+      headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=self.TIMEOUT):
+      pass
+
+
+class AlarmsDelivery(NamedTuple):
+  """Failed backups to notify by notifier, and the alarms of the scan by repo, to record in the dedupe file once
+  delivered."""
+  repos: Dict[str, List[BorgRepo]]
+  alarms: Dict[str, int]
+
+
+class AlarmDispatcher:
+  """Failed backups alarms of a scan, deduped and sent in the background to all the enabled notifiers at once.
+
+  Failed deliveries are retried with an exponential backoff. Alarms are only recorded in the dedupe file once
+  delivered, by notifier: undelivered ones are sent again after the next scan, only to the notifiers that failed.
+  """
+  RETRIES = 3
+  RETRY_DELAY = 2.0
+
+  def __init__(self, config: Config, notifiers: List[BorgNotifier]) -> None:
+    self._cfg = config
+    self._notifiers = notifiers
+    self._alarms: List[BorgRepo] = []
+    self._deliveries: "queue.Queue[AlarmsDelivery]" = queue.Queue()
+    self._worker: Optional[threading.Thread] = None
+    self._lock = threading.Lock()
+    # Alarms delivered, as in the dedupe file, and being delivered, by notifier
+    self._notified: Optional[Dict[str, Dict[str, int]]] = None
+    self._sending: Dict[str, Dict[str, int]] = {str(notifier): {} for notifier in notifiers}
+
+  @staticmethod
+  def _alarm_times(repos: List[BorgRepo]) -> Dict[str, int]:
+    return {
+      repo.name: int(repo.last_run.date_time.timestamp())
+      for repo in repos if repo.last_run and repo.last_run.date_time
+    }
+
+  def _dedupe(self, alarms: Dict[str, int]) -> Dict[str, List[BorgRepo]]:
+    """Alarms to send by notifier, without the ones already notified (are in the dedupes) or being notified."""
+    with self._lock:
+      if self._notified is None:
+        self._notified = self._load_dedupes()
+      dedupes = {}
+      for notifier in map(str, self._notifiers):
+        notified = [self._notified.get(notifier, {}), self._sending[notifier]]
+        dedupes[notifier] = [
+          repo for repo in self._alarms
+          if repo.name in alarms and all(alarms[repo.name] != known.get(repo.name) for known in notified)
+        ]
+        log.info(
+          f"Loaded {len(notified[0])} {notifier} alarm, {len(self._alarms) - len(dedupes[notifier])} repo deduped "
+          "and not alarmed on."
+        )
+    return dedupes
+
+  def _load_dedupes(self) -> Dict[str, Dict[str, int]]:
+    """Load and return alarms in the dedupe file, by notifier."""
+    try:
+      with open(self._cfg.dedupe_path, "r") as f:
+        dedupes = json.load(f)
+    except Exception as e:
+      log.warning(f"Cannot load dedupe file: {e}")
+      return {}
+    # Files from previous versions have the alarms of all the notifiers
+    if any(not isinstance(alarms, dict) for alarms in dedupes.values()):
+      return {str(notifier): dict(dedupes) for notifier in self._notifiers}
+    return dedupes
+
+  def _save_dedupes(self, alarms: Dict[str, Dict[str, int]]) -> None:
+    """Save the delivered alarms in the dedupe file."""
+    try:
+      with open(self._cfg.dedupe_path, "w") as f:
+        json.dump(alarms, f)
+        log.info(f"Saved {sum(map(len, alarms.values()))} alarms to {self._cfg.dedupe_path}")
+    except Exception as e:
+      log.warning(f"Cannot save dedupe file: {e}")
+
+  def addWarning(self, repo: BorgRepo):
+      self._alarms.append(repo)
+
+  def notify(self):
+    """Queue the delivery of the alarms added since the last call, and return without waiting for it."""
+    alarms = self._alarm_times(self._alarms)
+    repos = self._dedupe(alarms)
+    self._alarms = []
+    for notifier, notifier_repos in repos.items():
+      if notifier_repos:
+        log.info(f"Notifying {len(notifier_repos)} failed backups to {notifier}")
+    with self._lock:
+      for notifier, notifier_repos in repos.items():
+        self._sending[notifier].update({repo.name: alarms[repo.name] for repo in notifier_repos})
+      self._deliveries.put(AlarmsDelivery(repos, alarms))
+      if not self._worker:
+        self._worker = threading.Thread(target=self._run, name="notifier", daemon=True)
+        self._worker.start()
+
+  def wait(self, timeout: Optional[float] = None) -> bool:
+    """Wait for the queued deliveries, returns whether all were done before the timeout."""
+    with self._deliveries.all_tasks_done:
+      done = self._deliveries.all_tasks_done.wait_for(lambda: not self._deliveries.unfinished_tasks, timeout)
+    if not done:
+      log.warning(f"Alarms still being delivered after {timeout}s, they'll be sent again after the next scan")
+    return done
+
+  def _run(self) -> None:
+    while True:
+      delivery = self._deliveries.get()
+      try:
+        self._deliver(delivery)
+      except Exception as e:
+        log.exception(f"Failed to deliver alarms: {e}")
+      finally:
+        self._deliveries.task_done()
+
+  def _deliver(self, delivery: AlarmsDelivery) -> None:
+    notifiers = [notifier for notifier in self._notifiers if delivery.repos.get(str(notifier))]
+    delivered = {}
+    if notifiers:
+      with ThreadPoolExecutor(max_workers=len(notifiers), thread_name_prefix="notify") as pool:
+        results = pool.map(lambda notifier: self._send(notifier, delivery.repos[str(notifier)]), notifiers)
+        delivered = dict(zip(map(str, notifiers), results))
+      for notifier, notifier_delivered in delivered.items():
+        if not notifier_delivered:
+          log.error(
+            f"Failed to deliver {len(delivery.repos[notifier])} alarms with {notifier}, they'll be sent again after "
+            "the next scan"
+          )
+    with self._lock:
+      all_notified = self._notified or {}
+      for notifier, repos in delivery.repos.items():
+        notified = all_notified.setdefault(notifier, {})
+        for repo in repos:
+          sent = self._sending[notifier].pop(repo.name, None)
+          if delivered.get(notifier) and sent is not None:
+            notified[repo.name] = sent
+      # Only keep the alarms still raised, recovered repos alarm again on their next failure
+      self._notified = {
+        notifier: {
+          name: timestamp for name, timestamp in delivery.alarms.items()
+          if all_notified.get(notifier, {}).get(name) == timestamp
+        }
+        for notifier in map(str, self._notifiers)
+      }
+      saved = {notifier: dict(alarms) for notifier, alarms in self._notified.items()}
+    self._save_dedupes(saved)
+
+  def _send(self, notifier: BorgNotifier, repos: List[BorgRepo]) -> bool:
+    """Send the alarms messages to a notifier, retrying failed messages, returns whether all were sent."""
+    for message in notifier._build_messages(repos):
+      for attempt in range(self.RETRIES + 1):
+        try:
+          notifier._send_message(message)
+          break
+        except Exception as e:
+          if attempt == self.RETRIES:
+            log.error(f"Failed to send alarm with {notifier} after {attempt + 1} attempts: {e}")
+            return False
+          delay = self.RETRY_DELAY * 2 ** attempt
+          log.warning(f"Failed to send alarm with {notifier}, retrying in {delay}s: {e}")
+          time.sleep(delay)
+    return True
+
+
 NOTIFIERS_CLASSES = [
     DiscordNotifier,
+    WebhookNotifier,
 ]
 
-def get_notifier(config: Config) -> BorgNotifier:
-    for notifier_class in NOTIFIERS_CLASSES:
-        notifier = notifier_class(config)
-        if notifier._enabled:
-            return notifier
+def get_notifier(config: Config) -> AlarmDispatcher:
+    notifiers: List[BorgNotifier] = [notifier_class(config) for notifier_class in NOTIFIERS_CLASSES]
+    notifiers = [notifier for notifier in notifiers if notifier._enabled]
 
     # Defaults to a log notifier
-    return LogNotifier(config)
+    return AlarmDispatcher(config, notifiers or [LogNotifier(config)])
@@ -1,14 +1,46 @@
+import asyncio
+import hashlib
+import json
 import logging
 import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Self, Tuple
-from .borg import BorgClient
-from .logfs import logfs_from_path
+from typing import (
+  Any, Awaitable, Callable, Coroutine, Dict, Iterable, Iterator, List, MutableMapping, NamedTuple, Optional, Self,
+  Set, Tuple, TypeVar, Union
+)
+from .aggregates import compute_aggregates
+from .borg import AsyncBorgClient, BorgLoop
+from .exceptions import RepoError, ScanTimeoutError
+from .fileindex import BorgFileIndex
+from .lazy import LazyDict
+from .logfs import BaseFs, FileStat, LogEntry, host_from_path, logfs_from_path, reversed_lines
+from .logreader import LogReader
+from .ssh import SshMultiplexer
+from .timing import span, timings
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+class LogSummary(NamedTuple):
+  """Data parsed from a log file."""
+  status: str
+  date_time: Optional[datetime]
+  archive_name: Optional[str]
+  # Archive details from the borg create --stats output, in the borg info format
+  stats: Optional[Dict[str, Any]]
+
+
 class BorgLog():
+  # Slotted with the path kept as a string, reports can hold tens of thousands of logs
+  __slots__ = ("_filepath", "status", "date_time", "archive_name", "stats")
+
   SUCCESS = 'success'
   INFO = 'info'
   WARNING = 'warning'
@@ -17,40 +49,78 @@ class BorgLog():
   STATUS_START = "terminating with"
   STATUS_END = "rc "
   ARCHIVE_START = "Archive name:"
-  MAX_LINES_SCAN = 100
+  TAIL_BLOCK_SIZE = 4096
+  MAX_TAIL_SCAN = 1024 * 1024
+  # Lines of the borg create --stats output, after the archive name
+  STATS_FIELDS = (
+    "Archive fingerprint:", "Time (start):", "Time (end):", "Duration:", "Number of files:", "This archive:"
+  )
+  STATS_SIZE = re.compile(r"([\d.]+) ([kMGTPEZY]?B)\b")
+  STATS_DURATION = re.compile(r"([\d.]+) (day|hour|minute|second)s?\b")
+  SIZE_UNITS = {unit: 1000 ** power for power, unit in enumerate(["B", "kB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB"])}
+  DURATION_UNITS = {"day": 86400, "hour": 3600, "minute": 60, "second": 1}
 
   def __init__(
     self,
-    filepath: Path,
+    filepath: Union[Path, str],
     status: Optional[str] = None,
     datetime: Optional[datetime] = None,
-    archive: Optional[str] = None
+    archive: Optional[str] = None,
+    logfs: Optional[BaseFs] = None,
+    stats: Optional[Dict[str, Any]] = None,
   ):
-    self.filepath = filepath
-    self.status, self.date_time, self.archive_name = self._parse_log() if not status else (status, datetime, archive)
+    self._filepath = str(filepath)
+    self.status, self.date_time, self.archive_name, self.stats = (
+      self._parse_log(logfs) if not status else (status, datetime, archive, stats)
+    )
+
+  @property
+  def filepath(self) -> Path:
+    return Path(self._filepath)
+
+  @property
+  def name(self) -> str:
+    return os.path.basename(self._filepath)
 
   def __str__(self) -> str:
-    return f"{self.filepath.name}[{self.date_time}={self.status}][{self.archive_name}]"
+    return f"{self.name}[{self.date_time}={self.status}][{self.archive_name}]"
 
-  def _parse_log(self) -> Tuple[str, Optional[datetime], Optional[str]]:
-    with open(self.filepath, 'r') as f:
-      return self._status_from_last_lines(f)
+  def _parse_log(self, logfs: Optional[BaseFs] = None) -> LogSummary:
+    with span("log.parse") as parse_span, logfs.open_log(self.filepath) if logfs else open(self.filepath, 'rb') as f:
+      size = f.seek(0, os.SEEK_END)
+      result = self._status_from_last_lines(f)
+      # Blocks are read backwards, the position is at the end of the last block read
+      parse_span.bytes = min(size, size - f.tell() + self.TAIL_BLOCK_SIZE)
+      return result
 
-  def _status_from_last_lines(self, f) -> Tuple[str, Optional[datetime], Optional[str]]:
-    """Determine the log status of a log file, reading from the end, limiting ourselves to last few line."""
-    end = f.seek(0, os.SEEK_END)
-    f.seek(max(0, end - self.MAX_LINES_SCAN), os.SEEK_SET)  # len(last log line) < MAX_LINES_SCAN
-    f.seek(0, os.SEEK_SET)
-    lines = f.readlines()
-    return self._status_from_lines(lines)
+  def _status_from_last_lines(self, f) -> LogSummary:
+    """Determine the log status of a log file, reading from the end, limiting ourselves to the last blocks."""
+    return self._status_from_reversed_lines(reversed_lines(f, self.TAIL_BLOCK_SIZE, self.MAX_TAIL_SCAN))
 
-  def _status_from_lines(self, lines: List[str]) -> Tuple[str, Optional[datetime], Optional[str]]:
+  def _status_from_lines(self, lines: List[str]) -> LogSummary:
     """Determine the log status based on the status found in the specified log lines."""
+    return self._status_from_reversed_lines(reversed(lines))
+
+  def _status_from_reversed_lines(self, lines: Iterable[str]) -> LogSummary:
+    """Determine the log status based on the status found in the specified log lines, from the last one.
+
+    Also read the archive statistics of the borg create --stats output, in text or --log-json format.
+    """
     status = self.DANGER
     date_time = None
     archive_name = None
-    for line in reversed(lines):
-      line = line.rstrip('\n')
+    stats_lines: Dict[str, str] = {}
+    for line in lines:
+      line = line.rstrip('\r\n')
+      line, json_time = self._json_log_message(line) if line.startswith("{") else (line, None)
+      if json_time is not None and line.startswith(self.STATUS_START):
+        date_time = datetime.fromtimestamp(json_time).replace(microsecond=0)
+        status = self._status_from_rc(line, status)
+        continue
+      if line.startswith(self.STATS_FIELDS):
+        label, _, value = line.partition(":")
+        stats_lines.setdefault(label, value.strip())
+        continue
       # Parse expected format "date time level msg", to see if this might be log line
       tokens = line.split(" ", 3)
       if len(tokens) >=4:
@@ -59,10 +129,7 @@ class BorgLog():
         if line_msg.startswith(self.STATUS_START):
           try:
             date_time = datetime.fromisoformat(f"{tokens[0]}T{tokens[1]}.000000")
-            if line_msg.endswith(self.STATUS_END+'0'):
-              status = self.SUCCESS
-            elif line_msg.endswith(self.STATUS_END+'1'):
-              status = self.WARNING
+            status = self._status_from_rc(line_msg, status)
           except Exception as e:
             log.error(f"Unable to parse log line: {line}: {e}")
       else:
@@ -72,16 +139,80 @@ class BorgLog():
       # If we have all info we need, stop here
       if date_time and archive_name:
         break
-    return status, date_time, archive_name
+    stats = self._stats_info(archive_name, stats_lines) if archive_name and stats_lines else None
+    return LogSummary(status, date_time, archive_name, stats)
+
+  def _status_from_rc(self, line_msg: str, status: str) -> str:
+    if line_msg.endswith(self.STATUS_END+'0'):
+      return self.SUCCESS
+    if line_msg.endswith(self.STATUS_END+'1'):
+      return self.WARNING
+    return status
+
+  @staticmethod
+  def _json_log_message(line: str) -> Tuple[str, Optional[float]]:
+    """Message and time of a borg --log-json log message, other lines are returned unchanged."""
+    try:
+      message = json.loads(line)
+      if isinstance(message, dict) and message.get("type") == "log_message":
+        return str(message.get("message", "")), float(message.get("time", 0))
+    except (ValueError, TypeError):
+      pass
+    return line, None
+
+  @classmethod
+  def _stats_info(cls, archive_name: str, stats_lines: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Archive details from the --stats output lines, in the borg info format, None if incomplete.
+
+    Sizes are rounded by borg in the text output.
+    """
+    try:
+      sizes = [
+        int(float(value) * cls.SIZE_UNITS[unit]) for value, unit in cls.STATS_SIZE.findall(stats_lines["This archive"])
+      ]
+      # "Mon, 2024-01-01 10:00:00", in local time like borg info
+      start, end = (
+        datetime.fromisoformat(" ".join(stats_lines[label].split(", ", 1)[-1].split()[:2]))
+        for label in ["Time (start)", "Time (end)"]
+      )
+      nfiles = int(stats_lines["Number of files"])
+    except (KeyError, ValueError) as e:
+      log.debug(f"Incomplete stats for archive {archive_name}: {e}")
+      return None
+    if len(sizes) < 3:
+      return None
+    durations = cls.STATS_DURATION.findall(stats_lines.get("Duration", ""))
+    duration = sum(float(value) * cls.DURATION_UNITS[unit] for value, unit in durations) if durations else (
+      (end - start).total_seconds()
+    )
+    return {
+      "size": sizes[0],
+      "csize": sizes[1],
+      "dsize": sizes[2],
+      "archive": {
+        "nfiles": nfiles,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "duration": int(duration),
+        "comment": "",
+        "name": archive_name,
+        "id": stats_lines.get("Archive fingerprint"),
+      },
+    }
 
   def lines(self) -> List[str]:
+    """All the log lines, use reader() for large logs."""
     with open(self.filepath, 'r') as f:
       return f.readlines()
 
+  def reader(self, logfs: Optional[BaseFs] = None) -> LogReader:
+    """Paged reader of the log content, through the log file system if any."""
+    return LogReader(logfs.path() / self.name if logfs else self.filepath, logfs)
+
   def to_dict(self) -> Dict[str, Any]:
       return {
-        "name": self.filepath.name,
-        "fullpath": str(self.filepath.absolute()),
+        "name": self.name,
+        "fullpath": self._filepath if os.path.isabs(self._filepath) else os.path.join(os.getcwd(), self._filepath),
         "datetime": self.date_time.isoformat() if self.date_time else None,
         "status": self.status,
         "archive": self.archive_name,
@@ -90,10 +221,50 @@ class BorgLog():
   @classmethod
   def from_dict(cls, dict_data: Dict[str, Any]) -> Self:
     date_time = datetime.fromisoformat(dict_data["datetime"]) if dict_data.get("datetime") else None
-    return cls(Path(dict_data["fullpath"]), dict_data.get("status"), date_time, dict_data.get("archive"))
+    return cls(dict_data["fullpath"], dict_data.get("status"), date_time, dict_data.get("archive"))
+
+
+class BorgLogIndex:
+  """Summary of previously parsed log files by file name, with their stats to detect changes."""
+
+  def __init__(self, entries: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    self._entries = entries or {}
+
+  @staticmethod
+  def _stat_key(stat: FileStat, use_inode: bool) -> List[int]:
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino if use_inode else 0]
+
+  def get(self, filepath: Path, stat: FileStat, use_inode: bool = True) -> Optional[BorgLog]:
+    """Return the log summary if the file is indexed and unchanged."""
+    entry = self._entries.get(filepath.name)
+    if entry and entry.get("stat") == self._stat_key(stat, use_inode):
+      date_time = datetime.fromisoformat(entry["datetime"]) if entry.get("datetime") else None
+      return BorgLog(filepath, entry["status"], date_time, entry.get("archive"), stats=entry.get("stats"))
+    return None
+
+  def set(self, borglog: BorgLog, stat: FileStat, use_inode: bool = True) -> None:
+    self._entries[borglog.name] = {
+      "stat": self._stat_key(stat, use_inode),
+      "status": borglog.status,
+      "datetime": borglog.date_time.isoformat() if borglog.date_time else None,
+      "archive": borglog.archive_name,
+      "stats": borglog.stats,
+    }
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def to_dict(self) -> Dict[str, Any]:
+    return self._entries
+
+  @classmethod
+  def from_dict(cls, dict_data: Dict[str, Any]) -> Self:
+    return cls(dict(dict_data))
 
 
 class BorgSize:
+  __slots__ = ("original_size", "compressed_size", "deduplicated_size")
+
   def __init__(self, osize: int = 0, csize: int = 0, dsize:int = 0):
     self.set_sizes(osize, csize, dsize)
 
@@ -104,7 +275,8 @@ class BorgSize:
 
   @classmethod
   def from_dict(cls, sizes: Dict[str, Any]) -> Self:
-    return cls(sizes.get("size", 0), sizes.get("csize", 0), sizes.get("dsize", 0))
+    # Borg info results use "size", exported reports use "osize"
+    return cls(sizes.get("size", sizes.get("osize", 0)), sizes.get("csize", 0), sizes.get("dsize", 0))
 
   def to_dict(self) -> Dict[str, Any]:
     return {
@@ -115,6 +287,8 @@ class BorgSize:
 
 
 class BorgArchive:
+  __slots__ = ("name", "id", "date_time", "date_time_end", "comment", "duration", "nfiles", "sizes", "log")
+
   def __init__(
     self, name: str,
     date_time: Optional[datetime] = None,
@@ -124,8 +298,10 @@ class BorgArchive:
     duration: Optional[int] = None,
     comment: Optional[datetime] = None,
     nfiles: int = 0,
+    id: Optional[str] = None,
   ) -> None:
     self.name = name
+    self.id = id
     self.date_time = date_time
     self.date_time_end = date_time_end
     self.comment = comment
@@ -137,6 +313,7 @@ class BorgArchive:
   def to_dict(self) -> Dict[str, Any]:
     return {
       "name": self.name,
+      "id": self.id,
       "datetime": self.date_time.isoformat() if self.date_time else None,
       "datetime_end": self.date_time_end.isoformat() if self.date_time_end else None,
       "duration": self.duration,
@@ -157,10 +334,38 @@ class BorgArchive:
       int(dict_data["duration"]) if dict_data.get("duration") else None,
       dict_data.get("comment"),
       dict_data.get("nfiles", 0),
+      dict_data.get("id"),
     )
 
+  def set_info(self, archinfo: Dict[str, Any]) -> None:
+    """Set the archive details from a borg info result."""
+    self.date_time = datetime.fromisoformat(archinfo["archive"]["start"])
+    self.date_time_end = datetime.fromisoformat(archinfo["archive"]["end"])
+    self.duration = archinfo["archive"]["duration"]
+    self.comment = archinfo["archive"]["comment"]
+    self.nfiles = archinfo["archive"]["nfiles"]
+    self.sizes = BorgSize.from_dict(archinfo)
+
+  def is_scanned(self) -> bool:
+    """Archives are immutable, once details were fetched they don't need to be fetched again."""
+    return self.date_time is not None
+
+
+class LogsScan(NamedTuple):
+  """Log files read by a scan, applied to the repo once all the scan data is read."""
+  logs: Dict[str, BorgLog]
+  log_index: BorgLogIndex
+  last_run: Optional[BorgLog]
+  # Log of each archive, by archive name
+  links: Dict[str, BorgLog]
+  orphans: List[Path]
+
 
 class BorgRepo:
+  SCAN_SCANNED = "scanned"
+  SCAN_UNCHANGED = "unchanged"
+  SCAN_TIMEOUT = "timeout"
+
   def __init__(
     self,
     name: str,
@@ -168,115 +373,438 @@ class BorgRepo:
     path: str,
     logs: Optional[str] = None,
     pwd: Optional[str] = None,
-    cmd: Optional[str] = None
+    cmd: Optional[str] = None,
+    borg_timeout: Optional[float] = None,
+    ssh: Optional[SshMultiplexer] = None,
+    stats_from_logs: bool = True,
+    file_index_dir: Optional[str] = None,
+    file_index_last: Optional[int] = None,
+    borg_loop: Optional[BorgLoop] = None,
   ):
     # repo config
     self.name = name
     self.repopath = path
-    self.logspath = logfs_from_path(logs)
+    self.logspath = logfs_from_path(logs, ssh.options() if ssh else None)
     self.pwd = pwd
     self.cmd = cmd
-    self.borg = BorgClient(borg_path, self.repopath, self.pwd)
+    # Read new archives details from the --stats output of their log rather than with borg info
+    self.stats_from_logs = stats_from_logs
+    # Optional index of the files of the archives, of the last file_index_last archives only if specified
+    self.file_index_path = BorgFileIndex.repo_index_path(file_index_dir, name) if file_index_dir else None
+    self.file_index_last = file_index_last
+    # Borg calls run on the loop shared by the repos scans if any, limited by its semaphore
+    self._borg_loop = borg_loop
+    self.borg = AsyncBorgClient(
+      borg_path, self.repopath, self.pwd, borg_timeout, borg_loop.semaphore if borg_loop else None
+    )
+    if ssh and self.repopath.startswith("ssh://"):
+      self.borg.set_env("BORG_RSH", ssh.borg_rsh())
 
     # repo data
     self.sizes = BorgSize()
     self.chunks = 0
-    self.logs = {}
-    self.archives = {}
-    self.last_run = None
-    self.last_backup = None
-
-  def _scan_logs(self):
+    self.logs: MutableMapping[str, BorgLog] = {}
+    self.archives: MutableMapping[str, BorgArchive] = {}
+    self.last_run: Optional[BorgLog] = None
+    self.last_backup: Optional[BorgArchive] = None
+    self.log_index = BorgLogIndex()
+    # State of the repo and its logs when last scanned
+    self.fingerprint: Optional[str] = None
+    # Result and time of the last scan, a timed out repo keeps the data of its last successful scan
+    self.scan_status: Optional[str] = None
+    self.last_scan: Optional[datetime] = None
+    # Totals and time buckets of the archives and runs, updated with them
+    self.aggregates: Dict[str, Any] = {}
+    # Repo data is updated at the end of the scan while the report may be exported
+    self._lock = threading.RLock()
+
+  def hosts(self) -> Set[str]:
+    """Remote hosts accessed when scanning this repo: the repo host and the logs host, none for local paths."""
+    paths = [self.repopath, self.logspath.logpath if self.logspath else None]
+    return {host for host in map(host_from_path, paths) if host}
+
+  def _run_borg(self, coro: Coroutine[Any, Any, T]) -> T:
+    """Run borg calls on the shared borg loop, or on a loop of their own."""
+    return self._borg_loop.run(coro) if self._borg_loop else asyncio.run(coro)
+
+  @staticmethod
+  async def _timed(name: str, call: Awaitable[T]) -> T:
+    with span(name):
+      return await call
+
+  def _fingerprint(self) -> Tuple[Optional[str], Optional[List[LogEntry]]]:
+    """Hash of the repo and logs files stats, changing with new backups and prunes, and the log entries listed.
+
+    The repo state is read without borg if possible, or is the last archive otherwise. None if unavailable.
+    """
+    repo_state = self.borg.repo_state()
+    if repo_state is None:
+      last_archive = self._run_borg(self.borg.list(last=1))
+      repo_state = json.dumps(last_archive, sort_keys=True) if last_archive else None
+    if repo_state is None:
+      return None, None
+    entries = self.logspath.get_logs_entries() if self.logspath else []
+    logs_state = []
+    for entry in entries:
+      try:
+        logs_state.append(f"{entry.name} {entry.stat().st_size} {entry.stat().st_mtime_ns}")
+      except OSError:
+        return None, entries
+    state = "\n".join([self.repopath, str(self.logspath), repo_state] + sorted(logs_state))
+    return hashlib.sha1(state.encode()).hexdigest(), entries
+
+  def _read_logs(
+    self, archives: MutableMapping[str, BorgArchive], entries: Optional[List[LogEntry]] = None
+  ) -> LogsScan:
+    """Parse the log files, new and modified ones only, and match them to archives. Entries are listed if not given."""
     log.info(f"Scanning logs: {self.logspath}")
-    self.logs = {}
+    logs: Dict[str, BorgLog] = {}
+    links: Dict[str, BorgLog] = {}
+    orphan_logs: List[Path] = []
     last_log = None
-    if self.logspath and len(self.archives) > 0:
-      for logfile in self.logspath.get_logs_list():
-        borglog = BorgLog(logfile)
-        if borglog.archive_name:
-          archive = self.archives.get(borglog.archive_name)
-          if archive:
-            # Found the matching archive, link it to the log file
-            archive.log = borglog
-            self.logs[borglog.filepath.name] = borglog
-          else:
-            # Log file has an archive that is not saved, remove it
-            try:
-              log.warning(f"Archive {borglog.archive_name} for logfile {borglog.filepath} not found, deleting log")
-              self.logspath.delete(borglog.filepath)
-            except OSError as e:
-              log.warning(f"Couldn't delete file {borglog.filepath}: {e}")
+    if not self.logspath or len(archives) == 0:
+      return LogsScan(logs, self.log_index, last_log, links, orphan_logs)
+
+    # Only parse logs that are new or modified since the previous scan
+    log_index = BorgLogIndex()
+    log_entries = []
+    for entry in entries if entries is not None else self.logspath.get_logs_entries():
+      try:
+        log_entries.append((Path(entry.path), entry.stat()))
+      except OSError as e:
+        log.warning(f"Couldn't stat log file {entry.path}: {e}")
+    borglogs = {
+      logfile: self.log_index.get(logfile, stat, self.logspath.STABLE_INODES) for logfile, stat in log_entries
+    }
+    new_logs = [logfile for logfile, borglog in borglogs.items() if not borglog]
+    borglogs.update(self._parse_logs(new_logs))
+    # Remote logs are fetched with a short tail, enough for most logs. Larger logs without their status and archive in
+    # it are fetched again with the tail scanned for local logs.
+    tail_size = self.logspath.TAIL_SIZE
+    if tail_size:
+      sizes = {logfile: stat.st_size for logfile, stat in log_entries}
+      truncated = [
+        logfile for logfile in new_logs
+        if sizes[logfile] > tail_size and (borglog := borglogs[logfile])
+        and not (borglog.date_time and borglog.archive_name)
+      ]
+      if truncated:
+        log.info(f"Fetching {len(truncated)} logs again, their status is not in their last {tail_size} bytes")
+        borglogs.update(self._parse_logs(truncated, BorgLog.MAX_TAIL_SCAN))
+
+    for logfile, stat in log_entries:
+      borglog = borglogs[logfile]
+      if not borglog:
+        continue
+      if borglog.archive_name:
+        if borglog.archive_name in archives:
+          # Found the matching archive, link it to the log file
+          links[borglog.archive_name] = borglog
+          logs[borglog.name] = borglog
+          log_index.set(borglog, stat, self.logspath.STABLE_INODES)
         else:
-          # No archive name in the log file, most probably a failed backup, keep it for manual cleaning
-          self.logs[borglog.filepath.name] = borglog
-
-        # If we have a date time, save the most recent run
-        if borglog.date_time and (not last_log or borglog.date_time > last_log.date_time):  # type: ignore
-          last_log = borglog
-    self.last_run = last_log
-
-  def scan(self):
-    log.info(f"Scanning repo {self.name}, path: {self.repopath}")
+          # Log file has an archive that is not saved, remove it
+          log.warning(f"Archive {borglog.archive_name} for logfile {borglog.filepath} not found, deleting log")
+          orphan_logs.append(borglog.filepath)
+      else:
+        # No archive name in the log file, most probably a failed backup, keep it for manual cleaning
+        logs[borglog.name] = borglog
+        log_index.set(borglog, stat, self.logspath.STABLE_INODES)
+
+      # If we have a date time, save the most recent run
+      if borglog.date_time and (not last_log or borglog.date_time > last_log.date_time):  # type: ignore
+        last_log = borglog
+    log.info(f"Parsed {len(new_logs)} new or modified log files out of {len(log_entries)}")
+    return LogsScan(logs, log_index, last_log, links, orphan_logs)
+
+  def _parse_logs(self, logfiles: List[Path], tail_size: Optional[int] = None) -> Dict[Path, Optional[BorgLog]]:
+    """Fetch and parse the log files, None for the logs that can't be read."""
+    borglogs: Dict[Path, Optional[BorgLog]] = {}
+    with span("logs.fetch"):
+      self.logspath.fetch_logs(logfiles, tail_size)  # type: ignore[union-attr]
+    for logfile in logfiles:
+      try:
+        borglogs[logfile] = BorgLog(logfile, logfs=self.logspath)
+      except OSError as e:
+        log.warning(f"Couldn't read log file {logfile}: {e}")
+        borglogs[logfile] = None
+    return borglogs
+
+  def _apply_logs(self, archives: MutableMapping[str, BorgArchive], logs_scan: LogsScan) -> None:
+    # Archives may come from a previous report, links are rebuilt from the current log files
     if self.logspath:
-      self.logspath.mount()
-
-    # Get repo info from borg
-    info = self.borg.info()
-    self.sizes = BorgSize.from_dict(info)
-    self.chunks = info.get("repo", {}).get("chunks", 0)
-
-    # Get backup list
-    borg_list = self.borg.list()
-    self.archives = {archive: BorgArchive(archive) for archive in borg_list}
-
-    # Get and scan logs
-    self._scan_logs()
-
-    # Get details on each backup
-    last_backup = None
-    for backup in self.archives.values():
+      for archive in archives.values():
+        archive.log = logs_scan.links.get(archive.name)
+    self.logs = logs_scan.logs
+    self.log_index = logs_scan.log_index
+    self.last_run = logs_scan.last_run
+
+  def _delete_logs(self, orphan_logs: List[Path]) -> None:
+    if self.logspath and orphan_logs:
+      with span("logs.delete"):
+        self.logspath.delete_logs(orphan_logs)
+
+  def _scan_logs(self, entries: Optional[List[LogEntry]] = None):
+    """Parse the log files and link them to the repo archives."""
+    logs_scan = self._read_logs(self.archives, entries)
+    self._apply_logs(self.archives, logs_scan)
+    self._delete_logs(logs_scan.orphans)
+
+  @contextmanager
+  def log_reader(self, log_name: str) -> Iterator[LogReader]:
+    """Paged reader of a log of the repo, with its own log file system, mounted while the reader is used."""
+    borglog = self.logs.get(log_name)
+    if not borglog:
+      raise RepoError(f"Unknown log {log_name} in repo {self.name}")
+    logfs = logfs_from_path(self.logspath.logpath, self.logspath.ssh_options) if self.logspath else None
+    try:
+      if logfs:
+        logfs.mount()
+      yield borglog.reader(logfs)
+    finally:
+      if logfs:
+        logfs.umount()
+
+  def scan(self, force: bool = False, deadline: Optional[float] = None) -> bool:
+    """Scan the repo unless unchanged since the last scan and not forced. Returns whether the repo was scanned.
+
+    Remote calls are interrupted when the deadline (monotonic time) is passed, the repo then keeps its previous data.
+    """
+    log.info(f"Scanning repo {self.name}, path: {self.repopath}")
+    with timings.repo(self.name), span("repo.scan"):
+      self.borg.deadline = deadline
+      if self.logspath:
+        self.logspath.deadline = deadline
+      try:
+        if self.logspath:
+          self.logspath.mount()
+        # Fingerprint before scanning, so that changes during the scan are seen by the next one
+        with span("repo.fingerprint"):
+          fingerprint, entries = self._fingerprint()
+        if not force and fingerprint and fingerprint == self.fingerprint and self.archives:
+          log.info(f"Repo {self.name} unchanged since last scan, keeping previous data")
+          scanned = False
+        else:
+          self._scan(entries)
+          self.fingerprint = fingerprint
+          scanned = True
+        # Reports from previous versions don't have the aggregates
+        if not scanned and not self.aggregates:
+          with self._lock:
+            self.aggregates = self._compute_aggregates()
+        self.scan_status = self.SCAN_SCANNED if scanned else self.SCAN_UNCHANGED
+        self.last_scan = datetime.now()
+        # Also for unchanged repos, to resume an interrupted indexing
+        if self.file_index_path:
+          self._index_files()
+        return scanned
+      except ScanTimeoutError:
+        self.scan_status = self.SCAN_TIMEOUT
+        raise
+      finally:
+        self.borg.deadline = None
+        if self.logspath:
+          self.logspath.deadline = None
+          self.logspath.umount()
+
+  def _index_files(self) -> None:
+    """Add the archives not indexed yet to the file index, most recent first, and remove the pruned ones.
+
+    Archives not indexed before the deadline are indexed at the next scan.
+    """
+    with self._lock:
+      archives = list(self.archives.values())
+    if self.file_index_last:
+      archives = archives[-self.file_index_last:]
+    ids = {archive.name: archive.id for archive in archives}
+    try:
+      with span("repo.file_index"), BorgFileIndex(self.file_index_path) as index:  # type: ignore[arg-type]
+        indexed = index.archives()
+        # Archives recreated with the same name have another id
+        removed = [
+          name for name, archive_id in indexed.items()
+          if name not in ids or (archive_id and ids[name] and archive_id != ids[name])
+        ]
+        if removed:
+          index.remove_archives(removed)
+          log.info(f"Removed {len(removed)} archives from the file index of repo {self.name}")
+        new_archives = [archive for archive in archives if archive.name not in indexed or archive.name in removed]
+        for count, archive in enumerate(reversed(new_archives)):
+          start = archive.date_time.isoformat() if archive.date_time else None
+          try:
+            nfiles = index.add_archive(archive.name, archive.id, start, self.borg.list_files(archive.name))
+            log.info(f"Indexed {nfiles} files of archive {archive.name}")
+          except ScanTimeoutError:
+            log.warning(f"File indexing of repo {self.name} interrupted, {len(new_archives) - count} archives left")
+            return
+          except RepoError as e:
+            log.error(f"Cannot index the files of archive {archive.name}: {e}")
+    except sqlite3.Error as e:
+      log.error(f"Cannot update the file index {self.file_index_path}: {e}")
+
+  def _scan(self, log_entries: Optional[List[LogEntry]] = None):
+    # Get repo info and backup list from borg, concurrently
+    async def info_and_list() -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+      return await asyncio.gather(
+        self._timed("repo.info", self.borg.info()), self._timed("repo.list", self.borg.list())
+      )
+    info, borg_list = self._run_borg(info_and_list())
+
+    # Reuse archives already known from a previous report. Pruned archives are dropped.
+    archives: Dict[str, BorgArchive] = {}
+    for name, list_info in borg_list.items():
+      archive = self.archives.get(name)
+      if not archive or (archive.id and list_info.get("id") and archive.id != list_info["id"]):
+        archive = BorgArchive(name)
+      archive.id = archive.id or list_info.get("id")
+      archives[name] = archive
+    pruned = len([name for name in self.archives if name not in archives])
+    log.info(f"Found {len(archives)} archives, {pruned} pruned since last report")
+
+    # Get and scan logs, new archives details are read from their log if it has the --stats output
+    with span("repo.logs"):
+      logs_scan = self._read_logs(archives, log_entries)
+    if self.stats_from_logs:
+      from_logs = 0
+      for name, borglog in logs_scan.links.items():
+        backup = archives[name]
+        archive_id = borglog.stats["archive"].get("id") if borglog.stats else None
+        # Archives recreated with the same name have another id
+        if not backup.is_scanned() and borglog.stats and (not backup.id or not archive_id or archive_id == backup.id):
+          backup.set_info(borglog.stats)
+          from_logs += 1
+      if from_logs:
+        log.info(f"Read details of {from_logs} new archives from their log")
+
+    # Get details on new backups. Archives are listed by date and new ones are usually the most recent, so fetch the
+    # new archives at the end of the list in a single call. Older new archives are fetched one by one below, so that
+    # one of them doesn't extend the call to the whole repo.
+    new_tail = 0
+    for backup in reversed(archives.values()):
+      if backup.is_scanned():
+        break
+      new_tail += 1
+    if new_tail:
+      log.info(f"Scanning the last {new_tail} archives")
+      with span("repo.new_archives"):
+        archives_info = self._run_borg(self.borg.info_archives(last=new_tail))
+      for name, archinfo in archives_info.items():
+        new_backup = archives.get(name)
+        if new_backup and not new_backup.is_scanned() and archinfo.get("archive"):
+          new_backup.set_info(archinfo)
+
+    # Per archive details for the older new archives, and the archives the bulk call missed. One at a time, borg info
+    # calls on the same repo wait for each other on the lock of the borg cache
+    for backup in archives.values():
+      if backup.is_scanned():
+        continue
       log.info(f"Scanning archive: {backup.name}")
-      archinfo = self.borg.info(archive=backup.name)
+      with span("repo.archive_info"):
+        archinfo = self._run_borg(self.borg.info(archive=backup.name))
       if archinfo and archinfo.get("archive"):
-          backup.date_time = datetime.fromisoformat(archinfo["archive"]["start"])
-          backup.date_time_end = datetime.fromisoformat(archinfo["archive"]["end"])
-          backup.duration = archinfo["archive"]["duration"]
-          backup.comment = archinfo["archive"]["comment"]
-          backup.nfiles = archinfo["archive"]["nfiles"]
-          backup.sizes = BorgSize.from_dict(archinfo)
-          if backup.date_time and (not last_backup or backup.date_time > last_backup.date_time):  # type: ignore
-            last_backup = backup
-      self.last_backup = last_backup
+        backup.set_info(archinfo)
 
-    if self.logspath:
-      self.logspath.umount()
+    # Save the most recent backup
+    last_backup = None
+    for backup in archives.values():
+      if backup.date_time and (not last_backup or backup.date_time > last_backup.date_time):  # type: ignore
+        last_backup = backup
+
+    # All data is read, update the repo at once so that an interrupted scan leaves the previous data
+    with self._lock:
+      self.sizes = BorgSize.from_dict(info)
+      self.chunks = info.get("repo", {}).get("chunks", 0)
+      self.archives = archives
+      self._apply_logs(archives, logs_scan)
+      self.last_backup = last_backup
+      self.aggregates = self._compute_aggregates()
+    self._delete_logs(logs_scan.orphans)
+
+  def _compute_aggregates(self) -> Dict[str, Any]:
+    """Aggregates of the archives and runs, from a table of their times, sizes, durations and statuses."""
+    with span("repo.aggregates"):
+      archives = [
+        (
+          archive.date_time,
+          archive.sizes.original_size if archive.sizes else 0,
+          archive.sizes.compressed_size if archive.sizes else 0,
+          archive.sizes.deduplicated_size if archive.sizes else 0,
+          archive.duration,
+        )
+        for archive in self.iter_archives() if archive.date_time
+      ]
+      runs = [
+        (borglog.date_time, borglog.status in [BorgLog.SUCCESS, BorgLog.INFO])
+        for borglog in self.iter_logs() if borglog.date_time
+      ]
+      return compute_aggregates(archives, runs)
 
   def status(self) -> Optional[bool]:
     if self.last_run:
       return True if self.last_run.status and self.last_run.status in [BorgLog.SUCCESS, BorgLog.INFO] else False
 
-  def to_dict(self) -> Dict[str, Any]:
+  @staticmethod
+  def _items_dict(items: MutableMapping[str, Any], encode: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+    """Items to dict, lazily loaded items that were never accessed don't need to be decoded."""
+    if isinstance(items, LazyDict):
+      return items.encoded(encode)
+    return { name: encode(item) for name, item in items.items() }
+
+  def details_dict(self) -> Dict[str, Any]:
+    """Archives and logs of the repo, the bulk of the repo data."""
+    with self._lock:
+      return {
+        "archives": self._items_dict(self.archives, BorgArchive.to_dict),
+        "logfiles": self._items_dict(self.logs, BorgLog.to_dict),
+      }
+
+  def iter_archives(self) -> Iterator[BorgArchive]:
+    """Iterate over archives, for loaded repos without keeping decoded the archives not accessed before."""
+    if isinstance(self.archives, LazyDict):
+      return self.archives.stream()
+    return iter(self.archives.values())
+
+  def iter_logs(self) -> Iterator[BorgLog]:
+    """Iterate over logs, for loaded repos without keeping decoded the logs not accessed before."""
+    if isinstance(self.logs, LazyDict):
+      return self.logs.stream()
+    return iter(self.logs.values())
+
+  def to_dict(self, details: bool = True) -> Dict[str, Any]:
+    """Repo data, with or without the archives and logs details."""
+    with self._lock:
+      return self._to_dict(details)
+
+  def _to_dict(self, details: bool) -> Dict[str, Any]:
     return {
       "name": self.name,
       "repopath": self.repopath,
       "logspath": str(self.logspath) if self.logspath else None,
       "sizes": self.sizes.to_dict(),
       "chunks": str(self.chunks),
-      "archives": { arch.name: arch.to_dict() for arch in self.archives.values() },
-      "logfiles": { log.filepath.name: log.to_dict() for log in self.logs.values() },
+      **(self.details_dict() if details else {}),
       "script": self.cmd,
       "last_run": self.last_run.to_dict() if self.last_run else None,
       "last_backup": self.last_backup.to_dict() if self.last_backup else None,
       "status": self.status(),
+      "fingerprint": self.fingerprint,
+      "scan_status": self.scan_status,
+      "last_scan": self.last_scan.isoformat() if self.last_scan else None,
+      "aggregates": self.aggregates,
     }
 
   def from_dict(self, dict_data:Dict[str, Any]) -> None:
     try:
       self.sizes = BorgSize.from_dict(dict_data["sizes"])
       self.chunks = dict_data.get("chunks", 0)
-      self.archives = { name: BorgArchive.from_dict(arch) for name,arch in dict_data.get("archives", {}).items() }
-      self.logs = { name: BorgLog.from_dict(logf) for name,logf in dict_data.get("logfiles", {}).items() }
+      # Archives and logs are only decoded when used
+      self.archives = LazyDict(dict_data.get("archives", {}), BorgArchive.from_dict)
+      self.logs = LazyDict(dict_data.get("logfiles", {}), BorgLog.from_dict)
       self.last_backup = BorgArchive.from_dict(dict_data["last_backup"]) if dict_data.get("last_backup") else None
       self.last_run = BorgLog.from_dict(dict_data["last_run"]) if dict_data.get("last_run") else None
+      self.fingerprint = dict_data.get("fingerprint")
+      self.scan_status = dict_data.get("scan_status")
+      self.last_scan = datetime.fromisoformat(dict_data["last_scan"]) if dict_data.get("last_scan") else None
+      self.aggregates = dict_data.get("aggregates") or {}
     except KeyError as e:
       log.warning(f"Invalid config for repo {self.name} ({e}), ignoring.")
@@ -1,26 +1,62 @@
 import json
 import logging
 import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 from datetime import datetime
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import quote
+from .borg import BorgLoop
 from .config import Config
 from .notifier import get_notifier
-from .exceptions import RepoError
-from .repo import BorgRepo
+from .exceptions import ConfigError, RepoError, ScanTimeoutError
+from .fileindex import BorgFileIndex
+from .history import BorgHistory
+from .repo import BorgLogIndex, BorgRepo
+from .reportformat import decode_compact, decode_json_summaries, encode_compact, is_compact
+from .scanlock import ScanLock
+from .ssh import SshMultiplexer
 from .logfs import resolve_path
+from .timing import span, timings
 
 log = logging.getLogger(__name__)
 
 class BorgReporter:
-  def __init__(self, config: Config) -> None:
+  SHARDS_SUFFIX = ".repos"
+  # Minimum interval in seconds between exports of the report while repos are being scanned
+  FLUSH_INTERVAL = 5
+
+  def __init__(self, config: Config, warm: bool = False) -> None:
+    """Reporter of the configured repos. A warm reporter keeps its repos and ssh connections between scans."""
     self._cfg = config
+    self._warm = warm
     self._repos = []
     self._notifier = get_notifier(config)
+    self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+    self._host_semaphores_lock = threading.Lock()
+    self._ssh: Optional[SshMultiplexer] = None
+    # Event loop running the borg calls of the repos scans
+    self._borg_loop: Optional[BorgLoop] = None
+    # Whether repos are still being scanned, exported reports then contain the previous data of these repos
+    self._partial = False
+    # Scans of the report are coordinated with the other reporters, lock statistics of the last scan
+    self._scan_lock = ScanLock(config.report_path, attach=config.scan_attach)
+    self._scan_lock_stats: Optional[Dict[str, Any]] = None
+    # Log files index by repo, as saved, kept for the repos not scanned or failing
+    self._log_index: Dict[str, Any] = {}
 
-  def to_dict(self) -> Dict[str, Any]:
+  def to_dict(self, details: bool = True) -> Dict[str, Any]:
     return {
       "timestamp": datetime.now().isoformat(),
-      "repos": {repo.name: repo.to_dict() for repo in self._repos},
+      "repos": {repo.name: repo.to_dict(details) for repo in self._repos},
+      "timings": timings.to_dict(),
+      "partial": self._partial,
+      "scan_lock": self._scan_lock_stats,
     }
 
   def from_dict(self, dict_data:Dict[str, Any]) -> None:
@@ -36,56 +72,323 @@ class BorgReporter:
         else:
             log.warning(f"No config found for {repo_name}, ignoring.")
 
-  def export(self, export_file: Optional[str] = None):
-    """Writes the repo report to a json file"""
-    filename = export_file or self._cfg.report_path
+  def _write_json(self, filename: str, data: Dict[str, Any]) -> None:
+    """Writes data to a json file, replacing it atomically."""
     temp_filename = f"{filename}.temp"
     with open(temp_filename, "w") as f:
-      json.dump(self.to_dict(), f)
+      json.dump(data, f)
+    os.rename(temp_filename, filename)
+
+  def _write_report_file(self, filename: str, report: Dict[str, Any]) -> None:
+    """Writes a report file, in the compact format if the file extension is the compact one, or json."""
+    if not is_compact(filename):
+      return self._write_json(filename, report)
+    temp_filename = f"{filename}.temp"
+    with open(temp_filename, "wb") as f:
+      f.write(encode_compact(report))
     os.rename(temp_filename, filename)
+
+  def _read_report_file(self, filename: str, details: bool = True) -> Dict[str, Any]:
+    """Reads a report file, in the compact format if the file extension is the compact one, or json."""
+    if not is_compact(filename):
+      if details:
+        return self._read_json(filename)
+      # Archives and logs are skipped while decoding, rather than decoded then dropped
+      with open(filename, "r") as f:
+        return decode_json_summaries(f.read())
+    with open(filename, "rb") as f:
+      return decode_compact(f.read(), details)
+
+  def _shards_dir(self, filename: str) -> Path:
+    """Directory of the repos details files of a sharded report."""
+    return Path(filename).with_suffix(self.SHARDS_SUFFIX)
+
+  def _export_sharded(self, filename: str) -> None:
+    """Writes each repo details to its own file, then the report index with the repos summaries."""
+    shards_dir = self._shards_dir(filename)
+    shards_dir.mkdir(parents=True, exist_ok=True)
+    shards = {}
+    for repo in self._repos:
+      shard = shards_dir / f"{quote(repo.name, safe='')}.json"
+      self._write_json(str(shard), repo.details_dict())
+      shards[repo.name] = str(shard.relative_to(shards_dir.parent))
+
+    report = self.to_dict(details=False)
+    report["shards"] = shards
+    self._write_report_file(filename, report)
+
+    # Remove the details of repos no longer in the report
+    for shard in shards_dir.glob("*.json"):
+      if str(shard.relative_to(shards_dir.parent)) not in shards.values():
+        shard.unlink(missing_ok=True)
+
+  def export(self, export_file: Optional[str] = None):
+    """Writes the repo report to a json or compact file, or an index and a file per repo if sharded"""
+    filename = export_file or self._cfg.report_path
+    with span("reporter.export"):
+      if self._cfg.report_sharded:
+        self._export_sharded(filename)
+      else:
+        self._write_report_file(filename, self.to_dict())
     log.info(f"Borg backup report exported to {filename}")
 
+  def _read_report(
+    self, filename: str, details: bool = True, repo_names: Optional[Iterable[str]] = None
+  ) -> Dict[str, Any]:
+    """Read a report, for a sharded report only reading the details of the specified repos or all if None."""
+    report = self._read_report_file(filename, details)
+    shards = report.pop("shards", None)
+    if shards and details:
+      for repo_name in repo_names if repo_names is not None else list(shards):
+        if repo_name in shards and repo_name in report.get("repos", {}):
+          try:
+            report["repos"][repo_name].update(self._read_json(str(Path(filename).parent / shards[repo_name])))
+          except (OSError, ValueError) as e:
+            log.warning(f"Cannot load details of repo {repo_name}: {e}")
+    return report
+
+  def _load_log_index(self) -> Dict[str, Any]:
+    """Load the log files index of the previous scan, by repo."""
+    try:
+      return self._read_json(self._cfg.log_index_path)
+    except FileNotFoundError:
+      log.info(f"No log index in {self._cfg.log_index_path}, parsing all logs")
+    except (OSError, ValueError) as e:
+      log.warning(f"Cannot load log index {self._cfg.log_index_path}, parsing all logs: {e}")
+    return {}
+
+  def _save_log_index(self) -> None:
+    """Save the log files index of the current scan, by repo, keeping the saved index of configured repos that
+    failed to scan."""
+    self._log_index = {name: index for name, index in self._log_index.items() if name in self._cfg.repos_config}
+    self._log_index.update({repo.name: repo.log_index.to_dict() for repo in self._repos})
+    try:
+      self._write_json(self._cfg.log_index_path, self._log_index)
+    except OSError as e:
+      log.warning(f"Cannot save log index {self._cfg.log_index_path}: {e}")
+
   def repo_config_dict(self, repo_config: Dict[str, Any]) -> Dict[str, Any]:
     if repo_config:
       logpath = repo_config.get(self._cfg.CONFIG_KEY_LOG_PATH)
       return {
         "borg_path": self._cfg.borg_path,
+        "borg_timeout": self._cfg.borg_timeout,
         "path": resolve_path(self._cfg.repos_basedir, repo_config[self._cfg.CONFIG_KEY_REPO_PATH]),
         "logs": resolve_path(self._cfg.logs_basedir, logpath) if logpath else None,
         "pwd": repo_config.get(self._cfg.CONFIG_KEY_REPO_PWD),
         "cmd": repo_config.get(self._cfg.CONFIG_KEY_SCRIPT),
+        "ssh": self._ssh,
+        "borg_loop": self._borg_loop,
+        "stats_from_logs": self._cfg.archive_stats_from_logs,
+        "file_index_dir": self._cfg.file_index_dir,
+        "file_index_last": self._cfg.file_index_last_archives,
       }
     return {}
 
-  def load_repos(self, import_file: Optional[str] = None) -> None:
+  def _read_json(self, filename: str) -> Dict[str, Any]:
+    """Read a json file, such as a previously exported report."""
+    with open(filename, "r") as f:
+      return json.load(f)
+
+  def _load_previous_repos(self) -> Dict[str, Any]:
+    """Repo data from the last exported report if any, used to avoid rescanning known archives."""
+    try:
+      return self._read_report(self._cfg.report_path, repo_names=self._cfg.repos_config).get("repos") or {}
+    except FileNotFoundError:
+      log.info(f"No previous report in {self._cfg.report_path}, scanning all archives")
+    except (OSError, ValueError, AttributeError) as e:
+      log.warning(f"Cannot load previous report {self._cfg.report_path}, scanning all archives: {e}")
+    return {}
+
+  def load_repos(self, import_file: Optional[str] = None, details: bool = False) -> None:
+      """Load the repos from a report and notify failures, which only needs the repos summaries."""
       filename = import_file or self._cfg.report_path
       log.info(f"Load file from {filename}")
-      with open(filename, "r") as f:
-        self.from_dict(json.load(f))
+      self.from_dict(self._read_report(filename, details))
 
       for repo in self._repos:
         if repo.status() is False:
           self._notifier.addWarning(repo)
       self._notifier.notify()
+      if not self._warm:
+        self.wait_notifications()
 
 
-  def scan_repos(self) -> None:
-    """Build the borg repo report by scanning all configured repos."""
+  def _host_semaphore(self, host: str) -> threading.BoundedSemaphore:
+    """Semaphore limiting the concurrent scans on a host."""
+    with self._host_semaphores_lock:
+      if host not in self._host_semaphores:
+        self._host_semaphores[host] = threading.BoundedSemaphore(self._cfg.scan_workers_per_host)
+      return self._host_semaphores[host]
+
+  def _scan_repo(self, repo: BorgRepo, force: bool = False, deadline: Optional[float] = None) -> bool:
+    """Scan a repo once a slot is available on each of its hosts, returns whether it was scanned or unchanged.
+
+    The scan is interrupted after the repo scan timeout, or at the global scan deadline.
+    """
+    with ExitStack() as stack:
+      # Always acquire in the same order to avoid deadlocks between repos sharing hosts
+      for host in sorted(repo.hosts()):
+        stack.enter_context(self._host_semaphore(host))
+      if self._cfg.repo_scan_timeout:
+        repo_deadline = time.monotonic() + self._cfg.repo_scan_timeout
+        deadline = min(deadline, repo_deadline) if deadline else repo_deadline
+      return repo.scan(force, deadline)
+
+  def _flush(self) -> None:
+    """Export the report during the scan, with the repos already scanned."""
+    try:
+      self.export()
+    except OSError as e:
+      log.warning(f"Cannot export partial report: {e}")
+
+  def _save_history(self) -> None:
+    """Append the scan results to the history database if enabled."""
+    if self._cfg.history_path:
+      try:
+        with BorgHistory(self._cfg.history_path) as history:
+          history.record_scan(self._repos)
+      except sqlite3.Error as e:
+        log.warning(f"Cannot save scan history to {self._cfg.history_path}: {e}")
+
+  def _save_metrics(self) -> None:
+    """Write the scan timings to a prometheus textfile if enabled."""
+    if self._cfg.metrics_path:
+      try:
+        timings.write_prometheus(self._cfg.metrics_path)
+      except OSError as e:
+        log.warning(f"Cannot save scan metrics to {self._cfg.metrics_path}: {e}")
+
+  def search_files(
+    self, text: str, repo_names: Optional[Iterable[str]] = None, exact: bool = False, limit: int = 100
+  ) -> Dict[str, List[Dict[str, Any]]]:
+    """Search the file indexes of all repos, or of the given ones, for paths containing the text, or the archives
+    containing the exact path. Repos not indexed yet are skipped."""
+    if not self._cfg.file_index_dir:
+      raise ConfigError("File index disabled, file_index_dir isn't configured")
+    results = {}
+    for repo_name in repo_names if repo_names is not None else self._cfg.repos_config:
+      index_path = BorgFileIndex.repo_index_path(self._cfg.file_index_dir, repo_name)
+      if not os.path.exists(index_path):
+        continue
+      with span("reporter.search_files"), BorgFileIndex(index_path) as index:
+        results[repo_name] = index.find(text) if exact else index.search(text, limit)
+    return results
+
+  def get_repo(self, name: str) -> Optional[BorgRepo]:
+    return next((repo for repo in self._repos if repo.name == name), None)
+
+  def wait_notifications(self) -> None:
+    """Wait for the alarms being delivered, up to the notify timeout."""
+    self._notifier.wait(self._cfg.notify_timeout)
+
+  def close(self) -> None:
+    """Close the shared ssh connections and borg loop."""
+    if self._ssh:
+      self._ssh.close()
+      self._ssh = None
+    if self._borg_loop:
+      self._borg_loop.close()
+      self._borg_loop = None
+
+  def _build_repos(self, known_repos: Dict[str, BorgRepo]) -> List[BorgRepo]:
+    """Configured repos, reusing known repos, and initialized from the previous report and log index otherwise."""
+    repos: List[BorgRepo] = []
+    with span("reporter.load_previous"):
+      new_repos = [name for name in self._cfg.repos_config if name not in known_repos]
+      previous_repos = self._load_previous_repos() if new_repos else {}
+      if new_repos:
+        self._log_index = self._load_log_index()
+    for repo_name, repo_config in self._cfg.repos_config.items():
+      if repo_name in known_repos:
+        repos.append(known_repos[repo_name])
+        continue
+      try:
+        repo = BorgRepo(repo_name, **self.repo_config_dict(repo_config))
+        if repo.name in previous_repos:
+          repo.from_dict(previous_repos[repo.name])
+        repo.log_index = BorgLogIndex.from_dict(self._log_index.get(repo.name, {}))
+        repos.append(repo)
+      except RepoError as e:
+        log.error(f"Unable to scan repo {repo_name}: {e}")
+    return repos
+
+  def scan_repos(self, repo_names: Optional[Iterable[str]] = None, force: bool = False) -> None:
+    """Build the borg repo report by scanning all configured repos, or only the given ones keeping the others.
+
+    Repos unchanged since the previous scan keep their previous data, unless forced. If another reporter is
+    scanning the report, waits for it, and only scans if its scan doesn't cover the request.
+    """
+    with self._scan_lock.scan(repo_names, force) as lock_stats:
+      if lock_stats is None:
+        # A warm reporter reloads the report of the other scan
+        if self._warm:
+          self._repos = self._build_repos({})
+        return
+      self._scan_lock_stats = lock_stats
+      self._scan_repos(repo_names, force)
+
+  def _scan_repos(self, repo_names: Optional[Iterable[str]], force: bool) -> None:
     """
     for each repo in repo config
-      scan repo
+      scan repo, up to scan_workers in parallel and scan_workers_per_host on the same host
+    collect results in config order
     """
+    to_scan = set(repo_names) if repo_names is not None else None
+    known_repos = {repo.name: repo for repo in self._repos} if self._warm else {}
     self._repos = []
-    log.info("Starting repository report creation")
-    for repo, repo_config in self._cfg.repos_config.items():
-      try:
-        repo = BorgRepo(repo, **self.repo_config_dict(repo_config))
-        repo.scan()
-        self._repos.append(repo)
+    timings.reset()
+    deadline = time.monotonic() + self._cfg.scan_timeout if self._cfg.scan_timeout else None
+    log.info(f"Starting repository report creation, {self._cfg.scan_workers} workers")
+    # ssh connections and borg loop are shared by all the repos scans, and closed at the end of the scan unless warm
+    if not self._ssh and self._cfg.ssh_multiplexing:
+      self._ssh = SshMultiplexer()
+    if not self._borg_loop:
+      self._borg_loop = BorgLoop(self._cfg.borg_max_calls)
+    try:
+      repos = self._build_repos(known_repos)
+      # Until scanned, repos are exported with their previous data
+      self._repos = repos
+      self._partial = True
+      with ThreadPoolExecutor(max_workers=self._cfg.scan_workers, thread_name_prefix="scan") as pool:
+        scans: Dict[BorgRepo, Future] = {
+          repo: pool.submit(self._scan_repo, repo, force, deadline)
+          for repo in repos if to_scan is None or repo.name in to_scan
+        }
+        # Export the scanned repos progressively, so that slow repos don't delay the others
+        last_flush = time.monotonic() - self.FLUSH_INTERVAL
+        for done, _ in enumerate(as_completed(scans.values()), 1):
+          if done < len(scans) and time.monotonic() - last_flush >= self.FLUSH_INTERVAL:
+            self._flush()
+            last_flush = time.monotonic()
+
+      self._repos = []
+      for repo in repos:
+        try:
+          if repo in scans:
+            scans[repo].result()
+          self._repos.append(repo)
+        except ScanTimeoutError as e:
+          log.warning(f"Scan of repo {repo.name} timed out, keeping its previous data: {e}")
+          self._repos.append(repo)
+        except RepoError as e:
+          log.error(f"Unable to scan repo {repo.name}: {e}")
+          continue
         if repo.status() is False:
             self._notifier.addWarning(repo)
-      except RepoError as e:
-        log.error(f"Unable to scan repo {repo}: {e}")
+      log.info(f"Scanned repos: {dict(Counter(repo.scan_status for repo in scans))}")
+    finally:
+      self._partial = False
+      if not self._warm:
+        self.close()
 
-    self._notifier.notify()
+    with span("reporter.notify"):
+      self._notifier.notify()
     self.export()
+    with span("reporter.save_state"):
+      self._save_log_index()
+      self._save_history()
+    self._save_metrics()
+    # Alarms are delivered in the background, a warm reporter keeps running to deliver them
+    if not self._warm:
+      self.wait_notifications()
@@ -0,0 +1,176 @@
+"""
+Compact report encoding, and decoding of json reports summaries.
+
+Same content as the json report, but archives and log files of each repo are stored as columns (one list per
+field), with datetimes as epoch microseconds and log directories interned, in a zlib compressed container.
+"""
+
+import json
+import re
+import zlib
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+COMPACT_EXTENSION = ".bdr"
+COMPACT_MAGIC = b"BDR1"
+
+EPOCH = datetime(1970, 1, 1)
+ARCHIVE_FIELDS = ["name", "id", "duration", "comment", "nfiles"]
+ARCHIVE_DATETIME_FIELDS = ["datetime", "datetime_end"]
+SIZE_FIELDS = ["osize", "csize", "dsize"]
+LOG_FIELDS = ["name", "status", "archive"]
+# Repo fields of the archives and logs details
+DETAILS_FIELDS = ["archives", "logfiles"]
+
+# Json reports decoders, of the kept values, and of the skipped ones, discarding each object once decoded
+_DECODER = json.JSONDecoder()
+_SKIP_DECODER = json.JSONDecoder(object_pairs_hook=lambda pairs: None)
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+def is_compact(filename: str) -> bool:
+  """Whether a report file uses the compact encoding, based on its extension."""
+  return filename.endswith(COMPACT_EXTENSION)
+
+
+def _encode_datetime(value: Optional[str]) -> Union[int, str, None]:
+  """Naive iso datetime to epoch microseconds, other values are kept as is."""
+  if value:
+    date_time = datetime.fromisoformat(value)
+    if date_time.tzinfo is None:
+      return (date_time - EPOCH) // EPOCH.resolution
+  return value
+
+
+def _decode_datetime(value: Union[int, str, None]) -> Optional[str]:
+  if isinstance(value, int):
+    return (EPOCH + value * EPOCH.resolution).isoformat()
+  return value
+
+
+def _encode_logs(logs: List[Dict[str, Any]], paths: Dict[str, int]) -> Dict[str, List[Any]]:
+  columns: Dict[str, List[Any]] = {field: [log[field] for log in logs] for field in LOG_FIELDS}
+  columns["datetime"] = [_encode_datetime(log["datetime"]) for log in logs]
+  # Full path is the interned directory and the name
+  columns["dir"] = [paths.setdefault(log["fullpath"][:-len(log["name"])], len(paths)) for log in logs]
+  return columns
+
+
+def _decode_logs(columns: Dict[str, List[Any]], paths: List[str]) -> List[Dict[str, Any]]:
+  return [
+    {
+      "name": name,
+      "fullpath": f"{paths[columns['dir'][i]]}{name}",
+      "datetime": _decode_datetime(columns["datetime"][i]),
+      "status": columns["status"][i],
+      "archive": columns["archive"][i],
+    }
+    for i, name in enumerate(columns["name"])
+  ]
+
+
+def _encode_repo(repo: Dict[str, Any]) -> Dict[str, Any]:
+  encoded = {key: value for key, value in repo.items() if key not in ["archives", "logfiles"]}
+  paths: Dict[str, int] = {}
+  if "logfiles" in repo:
+    encoded["logfiles"] = _encode_logs(list(repo["logfiles"].values()), paths)
+  if "archives" in repo:
+    archives = list(repo["archives"].values())
+    columns: Dict[str, List[Any]] = {field: [arch.get(field) for arch in archives] for field in ARCHIVE_FIELDS}
+    for field in ARCHIVE_DATETIME_FIELDS:
+      columns[field] = [_encode_datetime(arch[field]) for arch in archives]
+    # Archives without sizes have null sizes
+    columns["sized"] = [1 if arch["sizes"] else 0 for arch in archives]
+    for field in SIZE_FIELDS:
+      columns[field] = [arch["sizes"][field] if arch["sizes"] else 0 for arch in archives]
+    # Archive logs are usually also in the repo logfiles, but encoded apart as they may not be
+    columns["log"] = [1 if arch["log"] else 0 for arch in archives]
+    columns["logs"] = _encode_logs([arch["log"] for arch in archives if arch["log"]], paths)  # type: ignore
+    encoded["archives"] = columns
+  encoded["paths"] = list(paths)
+  return encoded
+
+
+def _decode_repo(encoded: Dict[str, Any], details: bool = True) -> Dict[str, Any]:
+  repo = {key: value for key, value in encoded.items() if key not in DETAILS_FIELDS + ["paths"]}
+  paths = encoded.get("paths", [])
+  if not details:
+    return repo
+  if "archives" in encoded:
+    columns = encoded["archives"]
+    logs = iter(_decode_logs(columns["logs"], paths))
+    archives = {}
+    for i, name in enumerate(columns["name"]):
+      archive = {field: columns[field][i] for field in ARCHIVE_FIELDS}
+      archive.update({field: _decode_datetime(columns[field][i]) for field in ARCHIVE_DATETIME_FIELDS})
+      archive["sizes"] = {field: columns[field][i] for field in SIZE_FIELDS} if columns["sized"][i] else None
+      archive["log"] = next(logs) if columns["log"][i] else None
+      archives[name] = archive
+    repo["archives"] = archives
+  if "logfiles" in encoded:
+    repo["logfiles"] = {log["name"]: log for log in _decode_logs(encoded["logfiles"], paths)}
+  return repo
+
+
+def encode_compact(report: Dict[str, Any]) -> bytes:
+  """Encode a report dict in the compact format."""
+  encoded = dict(report)
+  encoded["repos"] = {name: _encode_repo(repo) for name, repo in report.get("repos", {}).items()}
+  return COMPACT_MAGIC + zlib.compress(json.dumps(encoded, separators=(",", ":")).encode(), 1)
+
+
+def decode_compact(data: bytes, details: bool = True) -> Dict[str, Any]:
+  """Decode a compact format report to the same dict as a json report, without archives and logs if not details."""
+  if not data.startswith(COMPACT_MAGIC):
+    raise ValueError("Not a compact borgdash report")
+  encoded = json.loads(zlib.decompress(data[len(COMPACT_MAGIC):]))
+  encoded["repos"] = {name: _decode_repo(repo, details) for name, repo in encoded.get("repos", {}).items()}
+  return encoded
+
+
+
+def _expect(text: str, pos: int, char: str) -> int:
+  """Position after a json structural character, and the whitespace following it."""
+  if text[pos:pos + 1] != char:
+    raise ValueError(f"Invalid json at {pos}, expecting {char}")
+  return _WHITESPACE.match(text, pos + 1).end()  # type: ignore[union-attr]
+
+
+def _decode_object(text: str, pos: int, decode_value: Callable[[str, int], Tuple[Any, int]]) -> Tuple[Any, int]:
+  """Decode the json object at a position, with a function decoding the value of each key at a position.
+
+  Returns the object and its end position.
+  """
+  decoded: Dict[str, Any] = {}
+  pos = _expect(text, _WHITESPACE.match(text, pos).end(), "{")  # type: ignore[union-attr]
+  if text[pos:pos + 1] == "}":
+    return decoded, pos + 1
+  while True:
+    if text[pos:pos + 1] != '"':
+      raise ValueError(f"Invalid json object key at {pos}")
+    key, pos = _DECODER.raw_decode(text, pos)
+    pos = _expect(text, _WHITESPACE.match(text, pos).end(), ":")  # type: ignore[union-attr]
+    decoded[key], pos = decode_value(key, pos)
+    pos = _WHITESPACE.match(text, pos).end()  # type: ignore[union-attr]
+    if text[pos:pos + 1] == "}":
+      return decoded, pos + 1
+    pos = _expect(text, pos, ",")
+
+
+def decode_json_summaries(text: str) -> Dict[str, Any]:
+  """Decode a json report without the archives and logs of its repos, which are skipped without being kept."""
+
+  def decode_repo_value(key: str, pos: int) -> Tuple[Any, int]:
+    return (_SKIP_DECODER if key in DETAILS_FIELDS else _DECODER).raw_decode(text, pos)
+
+  def decode_repo(name: str, pos: int) -> Tuple[Any, int]:
+    repo, end = _decode_object(text, pos, decode_repo_value)
+    for field in DETAILS_FIELDS:
+      repo.pop(field, None)
+    return repo, end
+
+  def decode_report_value(key: str, pos: int) -> Tuple[Any, int]:
+    if key == "repos" and text[pos:pos + 1] == "{":
+      return _decode_object(text, pos, decode_repo)
+    return _DECODER.raw_decode(text, pos)
+
+  return _decode_object(text, 0, decode_report_value)[0]
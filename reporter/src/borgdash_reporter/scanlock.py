@@ -0,0 +1,109 @@
+"""
+Coordination of the scans of a report between reporter processes
+"""
+
+import fcntl
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import contextmanager
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class ScanLock:
+  """Single scan of a report at a time, across processes, with a lease file locked next to the report.
+
+  A scan requested while another one runs waits for it, then only runs if no scan covering its repos started after
+  the request, so that the requests waiting for a scan are coalesced in a single follow-up scan. In attach mode,
+  requests are done by the scan running when they were made.
+
+  The lock is released by the system if the scanning process dies.
+  """
+
+  def __init__(self, report_path: str, attach: bool = False) -> None:
+    self.path = f"{report_path}.lock"
+    self.state_path = f"{report_path}.scans"
+    self.attach = attach
+
+  @contextmanager
+  def _state(self) -> Iterator[Dict[str, Any]]:
+    """Scans state, updated under an exclusive lock."""
+    with open(self.state_path, "a+") as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      f.seek(0)
+      try:
+        state = json.loads(f.read() or "{}")
+      except ValueError:
+        state = {}
+      yield state
+      f.truncate(0)
+      json.dump(state, f)
+
+  @staticmethod
+  def _owner(lock_file: IO[str]) -> str:
+    lock_file.seek(0)
+    return lock_file.read().strip() or "unknown owner"
+
+  @staticmethod
+  def _covers(scan: Dict[str, Any], repos: Optional[List[str]], force: bool) -> bool:
+    """Whether a scan covers the requested repos, all if None. Forced requests are only covered by forced scans."""
+    scanned = scan.get("repos")
+    return (scanned is None or (repos is not None and set(repos) <= set(scanned))) and (scan.get("force") or not force)
+
+  @contextmanager
+  def scan(self, repos: Optional[Iterable[str]] = None, force: bool = False) -> Iterator[Optional[Dict[str, Any]]]:
+    """Lock the report for a scan of the repos, all if None.
+
+    Yields the lock statistics if the scan must run, or None if another scan did it.
+    """
+    repo_list = sorted(repos) if repos is not None else None
+    requested = time.time()
+    with open(self.path, "a+") as lock_file:
+      waited = False
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        log.info(f"Another scan is running ({self._owner(lock_file)}), waiting for it")
+        with self._state() as state:
+          state["waiting"] = state.get("waiting", 0) + 1
+        try:
+          fcntl.flock(lock_file, fcntl.LOCK_EX)
+        finally:
+          with self._state() as state:
+            state["waiting"] = max(0, state.get("waiting", 0) - 1)
+        waited = True
+      wait = time.time() - requested
+
+      with self._state() as state:
+        last = state.get("last") or {}
+        # Attached requests are done by the scan that was running, others by a scan started after them
+        done_after = last.get("end" if self.attach else "start", 0)
+        done = waited and self._covers(last, repo_list, force) and done_after >= requested
+        if done:
+          state["coalesced"] = state.get("coalesced", 0) + 1
+        # Requests waiting now are done by this scan
+        stats = {
+          "wait_seconds": round(wait, 3),
+          "coalesced_requests": state.get("waiting", 0),
+          "follow_up": waited,
+          "total_coalesced": state.get("coalesced", 0),
+        }
+      if done:
+        log.info(f"Scan request done by a concurrent scan, after waiting {wait:.1f}s")
+        yield None
+        return
+
+      lock_file.truncate(0)
+      lock_file.write(f"pid {os.getpid()} on {socket.gethostname()} since {time.strftime('%Y-%m-%dT%H:%M:%S')}")
+      lock_file.flush()
+      start = time.time()
+      try:
+        yield stats
+      finally:
+        lock_file.truncate(0)
+      with self._state() as state:
+        state["last"] = {"start": start, "end": time.time(), "repos": repo_list, "force": force}
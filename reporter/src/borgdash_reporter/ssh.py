@@ -0,0 +1,56 @@
+import logging
+import os
+import shlex
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class SshMultiplexer:
+  """Share one ssh connection per host between borg and sshfs calls, using ssh ControlMaster.
+
+  The first connection to a host becomes the master and stays up in the background, following ones reuse it
+  without a new handshake. All masters are closed when the multiplexer is closed.
+  """
+  SSH_COMMAND = "ssh"
+
+  def __init__(self) -> None:
+    # Keep the path short, unix socket paths are limited to ~100 chars
+    self._tempdir: Optional[TemporaryDirectory] = TemporaryDirectory(prefix="borgdash-ssh-", dir="/tmp")
+    self._controldir = Path(self._tempdir.name)
+
+  def options(self) -> List[str]:
+    """ssh options to use or create the shared connection of the host."""
+    return [
+      "-o", "ControlMaster=auto",
+      "-o", f"ControlPath={self._controldir}/%C",
+      "-o", "ControlPersist=yes",
+    ]
+
+  def borg_rsh(self) -> str:
+    """BORG_RSH value for borg to use the shared connections, extending the one possibly already set."""
+    return " ".join([os.environ.get("BORG_RSH", self.SSH_COMMAND)] + [shlex.quote(opt) for opt in self.options()])
+
+  def close(self) -> None:
+    """Close all the shared connections."""
+    if not self._tempdir:
+      return
+    for control_path in self._controldir.iterdir():
+      # With an explicit control path, the host is only required by the command line syntax
+      args = [self.SSH_COMMAND, "-o", f"ControlPath={control_path}", "-O", "exit", "borgdash"]
+      try:
+        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+        log.debug(f"Closed ssh connection {control_path}")
+      except (OSError, subprocess.TimeoutExpired) as e:
+        log.warning(f"Couldn't close ssh connection {control_path}: {e}")
+    self._tempdir.cleanup()
+    self._tempdir = None
+
+  def __enter__(self) -> "SshMultiplexer":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
@@ -0,0 +1,131 @@
+"""
+Timing spans of the scan phases
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .exceptions import ScanTimeoutError
+
+log = logging.getLogger(__name__)
+
+# Repo being scanned in the current thread or task, spans are also accounted to it
+_current_repo: ContextVar[Optional[str]] = ContextVar("timing_repo", default=None)
+
+
+class Span:
+  """Running span, the code measured can add the number of bytes it read."""
+  __slots__ = ("bytes",)
+
+  def __init__(self) -> None:
+    self.bytes = 0
+
+
+class Timings:
+  """Spans aggregated by name: number of calls, wall time and bytes read, in total and for each repo.
+
+  Spans can be nested, a span time includes the time of the spans it contains.
+  """
+  PROMETHEUS_PREFIX = "borgdash_span"
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    # (repo or None, span name) -> [count, seconds, bytes]
+    self._spans: Dict[Tuple[Optional[str], str], List[Any]] = {}
+
+  def reset(self) -> None:
+    with self._lock:
+      self._spans = {}
+
+  def add(self, name: str, seconds: float, nbytes: int = 0) -> None:
+    """Account a call of the named span, to the total and the current repo if any."""
+    repo = _current_repo.get()
+    with self._lock:
+      for key in [(None, name), (repo, name)] if repo else [(None, name)]:
+        stats = self._spans.setdefault(key, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += nbytes
+
+  @contextmanager
+  def span(self, name: str) -> Iterator[Span]:
+    """Measure the wall time of the enclosed code."""
+    span = Span()
+    start = time.perf_counter()
+    try:
+      yield span
+    finally:
+      self.add(name, time.perf_counter() - start, span.bytes)
+
+  @contextmanager
+  def repo(self, name: str) -> Iterator[None]:
+    """Account the spans of the enclosed code to the repo."""
+    token = _current_repo.set(name)
+    try:
+      yield
+    finally:
+      _current_repo.reset(token)
+
+  def to_dict(self) -> Dict[str, Any]:
+    """Spans totals, and spans of each repo."""
+    result: Dict[str, Any] = {"spans": {}, "repos": {}}
+    with self._lock:
+      for (repo, name), (count, seconds, nbytes) in sorted(self._spans.items(), key=lambda item: item[0][1]):
+        spans = result["repos"].setdefault(repo, {}) if repo else result["spans"]
+        spans[name] = {"count": count, "seconds": round(seconds, 6), "bytes": nbytes}
+    return result
+
+  def to_prometheus(self) -> str:
+    """Spans in the prometheus text format, as gauges since timings are reset at each scan."""
+    metrics = {
+      "calls": ("Number of calls", 0),
+      "seconds": ("Wall time in seconds", 1),
+      "bytes": ("Bytes read", 2),
+    }
+    with self._lock:
+      spans = sorted(self._spans.items(), key=lambda item: (item[0][1], item[0][0] or ""))
+    lines = []
+    for metric, (help, index) in metrics.items():
+      name = f"{self.PROMETHEUS_PREFIX}_{metric}"
+      lines += [f"# HELP {name} {help} of the last scan phases.", f"# TYPE {name} gauge"]
+      for (repo, span), stats in spans:
+        labels = f'span="{span}"' + (f',repo="{_escape_label(repo)}"' if repo else "")
+        lines.append(f"{name}{{{labels}}} {stats[index]}")
+    return "\n".join(lines) + "\n"
+
+  def write_prometheus(self, path: str) -> None:
+    """Write the spans to a prometheus textfile collector file, replacing it atomically."""
+    temp_path = f"{path}.temp"
+    with open(temp_path, "w") as f:
+      f.write(self.to_prometheus())
+    os.rename(temp_path, path)
+
+
+def time_left(deadline: Optional[float], timeout: Optional[float] = None) -> Optional[float]:
+  """Timeout of a call, limited to the time left before the deadline (monotonic time) if any.
+
+  Raises ScanTimeoutError if the deadline is already passed.
+  """
+  if deadline is None:
+    return timeout
+  left = deadline - time.monotonic()
+  if left <= 0:
+    raise ScanTimeoutError("Scan deadline exceeded")
+  return min(left, timeout) if timeout else left
+
+
+def deadline_passed(deadline: Optional[float]) -> bool:
+  return deadline is not None and time.monotonic() >= deadline
+
+
+def _escape_label(value: str) -> str:
+  return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Timings of the current process
+timings = Timings()
+span = timings.span
@@ -0,0 +1,121 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from borgdash_reporter.aggregates import DAILY_BUCKETS, compute_aggregates
+
+START = datetime(2024, 1, 1)
+
+
+def percentile(values, percent):
+  """Smallest value with at least percent % of the values lower or equal, None if no values."""
+  values = sorted(value for value in values if value is not None)
+  return next((value for value in values if sum(v <= value for v in values) * 100 >= percent * len(values)), None)
+
+
+def success_rate(runs):
+  return round(sum(ok for _, ok in runs) / len(runs), 4) if runs else None
+
+
+def expected_buckets(archives, runs, bucket, since=None):
+  """Buckets computed archive by archive, for archives and runs sorted by time."""
+  columns = {
+    name: []
+    for name in ["start", "archives", "osize", "osize_delta", "csize", "dsize", "runs", "success_rate"]
+    + ["duration_p50", "duration_p90"]
+  }
+  keys = sorted({bucket(row[0]) for row in archives + runs})
+  previous = [row for row in archives if since is not None and bucket(row[0]) < since][-1:]
+  for key in keys:
+    if since is not None and key < since:
+      continue
+    bucket_archives = [row for row in archives if bucket(row[0]) == key]
+    bucket_runs = [row for row in runs if bucket(row[0]) == key]
+    last = bucket_archives[-1:] or previous
+    columns["start"].append(key.isoformat())
+    columns["archives"].append(len(bucket_archives))
+    columns["osize"].append(last[0][1] if last else None)
+    columns["osize_delta"].append(last[0][1] - previous[0][1] if last and previous else None)
+    columns["csize"].append(last[0][2] if last else None)
+    columns["dsize"].append(sum(row[3] for row in bucket_archives))
+    columns["runs"].append(len(bucket_runs))
+    columns["success_rate"].append(success_rate(bucket_runs))
+    for percent in [50, 90]:
+      columns[f"duration_p{percent}"].append(percentile([row[4] for row in bucket_archives], percent))
+    previous = last
+  return columns
+
+
+def expected_aggregates(archives, runs):
+  archives = sorted(archives)
+  runs = sorted(runs)
+  durations = [row[4] for row in archives if row[4] is not None]
+  osize, csize, dsize = (sum(row[column] for row in archives) for column in [1, 2, 3])
+  last_day = max(row[0].date() for row in archives + runs) if archives or runs else None
+  return {
+    "totals": {
+      "archives": len(archives),
+      "first": archives[0][0].isoformat() if archives else None,
+      "last": archives[-1][0].isoformat() if archives else None,
+      "osize": osize,
+      "csize": csize,
+      "dsize": dsize,
+      "dedup_ratio": round(osize / dsize, 2) if dsize else None,
+      "duration_mean": round(sum(durations) / len(durations), 1) if durations else None,
+      **{f"duration_p{percent}": percentile(durations, percent) for percent in [50, 90, 99]},
+      "runs": len(runs),
+      "success_rate": success_rate(runs),
+    },
+    "daily": expected_buckets(
+      archives, runs, datetime.date, last_day - timedelta(days=DAILY_BUCKETS - 1) if last_day else None
+    ),
+    "weekly": expected_buckets(archives, runs, lambda time: time.date() - timedelta(days=time.weekday())),
+  }
+
+
+def random_backups(seed, days):
+  """Archives and runs in random order, with days without backups and several backups some days."""
+  rand = random.Random(seed)
+  minutes = sorted(rand.sample(range(days * 24 * 60), days))
+  archives = []
+  runs = []
+  osize = 0
+  for minute in minutes:
+    time = START + timedelta(minutes=minute)
+    osize += rand.randint(-1000, 5000)
+    duration = rand.choice([None, rand.randint(10, 3600)])
+    archives.append((time, osize, osize // 2, rand.randint(0, 1000), duration))
+    runs.append((time + timedelta(seconds=duration or 0), rand.random() < 0.8))
+  # Failed runs without archive
+  runs += [(START + timedelta(minutes=minute), False) for minute in rand.sample(range(days * 24 * 60), days // 10)]
+  rand.shuffle(archives)
+  rand.shuffle(runs)
+  return archives, runs
+
+
+@pytest.mark.parametrize("seed,days", [(1, 300), (2, 50), (3, 3)])
+def test_aggregates(seed, days):
+  archives, runs = random_backups(seed, days)
+  assert compute_aggregates(archives, runs) == expected_aggregates(archives, runs)
+
+
+@pytest.mark.parametrize("archives,runs", [
+  ([], []),
+  ([], [(START, True), (START + timedelta(days=200), False)]),
+  ([(START, 10, 5, 5, None)], []),
+  # Daily backups, for more days than the daily buckets
+  ([(START + timedelta(days=day), day, day, 1, day) for day in range(100)], [(START + timedelta(days=99), True)]),
+  # Zero sized archives
+  ([(START, 0, 0, 0, 60), (START + timedelta(days=1), 0, 0, 0, 60)], [(START + timedelta(days=1), True)]),
+])
+def test_aggregates_edge_cases(archives, runs):
+  assert compute_aggregates(archives, runs) == expected_aggregates(archives, runs)
+
+
+def test_aggregates_timezones():
+  archives, runs = random_backups(4, 30)
+  # Some times with a timezone, aggregated by local time like the others
+  utc = [(row[0].astimezone(timezone.utc), *row[1:]) if i % 2 else row for i, row in enumerate(archives)]
+  utc_runs = [(row[0].astimezone(timezone.utc), row[1]) if i % 3 else row for i, row in enumerate(runs)]
+  assert compute_aggregates(utc, utc_runs) == expected_aggregates(archives, runs)
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+from borgdash_reporter.borg import AsyncBorgClient, BorgLoop
+from borgdash_reporter.exceptions import ScanTimeoutError
+
+FAKE_BORG = """#!/bin/sh
+if [ "$1" = "info" ]; then
+  # Long running child, like the ssh of remote repos
+  sleep 30 &
+  echo $! > "{pid_file}"
+  wait
+fi
+echo '{list_output}'
+"""
+
+
+@pytest.fixture
+def borg(tmp_path):
+  path = tmp_path / "borg"
+  list_output = json.dumps({"archives": [{"archive": "arch-1", "id": "id1"}]})
+  path.write_text(FAKE_BORG.format(pid_file=tmp_path / "child.pid", list_output=list_output))
+  path.chmod(0o755)
+  return str(path)
+
+
+def test_async_client_list(borg):
+  client = AsyncBorgClient(borg, "/repo")
+  assert asyncio.run(client.list()) == {"arch-1": {"name": "arch-1", "id": "id1"}}
+
+
+def test_async_client_timeout_kills_children(borg, tmp_path):
+  client = AsyncBorgClient(borg, "/repo", timeout=0.5)
+  assert asyncio.run(client.info()) == {}
+  child = int((tmp_path / "child.pid").read_text())
+  for _ in range(50):
+    try:
+      os.kill(child, 0)
+    except ProcessLookupError:
+      break
+    time.sleep(0.1)
+  else:
+    pytest.fail("borg child process still running")
+
+
+def test_borg_loop_deadline(borg):
+  loop = BorgLoop(2)
+  try:
+    client = AsyncBorgClient(borg, "/repo", semaphore=loop.semaphore)
+    assert loop.run(client.list()) == {"arch-1": {"name": "arch-1", "id": "id1"}}
+    client.deadline = time.monotonic() + 0.5
+    with pytest.raises(ScanTimeoutError):
+      loop.run(client.info())
+  finally:
+    loop.close()
@@ -0,0 +1,24 @@
+import os
+import stat
+
+from borgdash_reporter.config import Config
+
+DEFAULT_CONFIG = """
+reporter:
+  report_path: /tmp/report.json
+repos: {}
+"""
+
+
+def test_cache_private(tmp_path):
+  (tmp_path / "config_default.yaml").write_text(DEFAULT_CONFIG)
+  config_file = tmp_path / "config.yaml"
+  config_file.write_text("repos:\n  repo1:\n    repo_path: /repo1\n    repo_pwd: secret\n")
+  cache_path = tmp_path / "config.cache"
+  # Left over by an interrupted save, readable by all
+  (tmp_path / "config.cache.temp").write_text("{}")
+  os.chmod(tmp_path / "config.cache.temp", 0o644)
+  config = Config(str(config_file), cache_path=str(cache_path))
+  assert stat.S_IMODE(os.stat(cache_path).st_mode) == 0o600
+  assert not (tmp_path / "config.cache.temp").exists()
+  assert Config(str(config_file), cache_path=str(cache_path))._config == config._config
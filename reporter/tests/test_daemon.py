@@ -0,0 +1,157 @@
+import json
+import socket
+import threading
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+from borgdash_reporter.daemon import ControlServer, CronSchedule, ReporterDaemon
+from borgdash_reporter.exceptions import ReporterError
+
+
+@pytest.mark.parametrize("expression,after,expected", [
+  ("* * * * *", datetime(2024, 1, 1, 10, 0, 30), datetime(2024, 1, 1, 10, 1)),
+  ("30 2 * * *", datetime(2024, 1, 1, 2, 30), datetime(2024, 1, 2, 2, 30)),
+  ("30 2 * * *", datetime(2024, 12, 31, 3, 0), datetime(2025, 1, 1, 2, 30)),
+  # Steps, from * or from a start value
+  ("*/15 * * * *", datetime(2024, 1, 1, 10, 16), datetime(2024, 1, 1, 10, 30)),
+  ("5/20 * * * *", datetime(2024, 1, 1, 10, 26), datetime(2024, 1, 1, 10, 45)),
+  # Lists of ranges with steps
+  ("0 9-17/4,20 * * *", datetime(2024, 1, 1, 13, 0), datetime(2024, 1, 1, 17, 0)),
+  ("0 9-17/4,20 * * *", datetime(2024, 1, 1, 17, 0), datetime(2024, 1, 1, 20, 0)),
+  ("0 9-17/4,20 * * *", datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 9, 0)),
+  # Days of month only, or days of week only
+  ("0 0 1 * *", datetime(2024, 9, 26), datetime(2024, 10, 1)),
+  ("0 0 * * 1", datetime(2024, 9, 26), datetime(2024, 9, 30)),
+  # Sunday is 0 or 7
+  ("0 0 * * 0", datetime(2024, 9, 26), datetime(2024, 9, 29)),
+  ("0 0 * * 7", datetime(2024, 9, 26), datetime(2024, 9, 29)),
+  # Both restricted: days matching either the day of month or of week
+  ("0 0 1 * 1", datetime(2024, 9, 26), datetime(2024, 9, 30)),
+  ("0 0 1 * 1", datetime(2024, 9, 30), datetime(2024, 10, 1)),
+  # A day of week field starting with * doesn't restrict the days
+  ("0 0 1 * */2", datetime(2024, 9, 26), datetime(2024, 10, 1)),
+  ("0 0 1 1-3 *", datetime(2024, 9, 26), datetime(2025, 1, 1)),
+  ("0 0 29 2 *", datetime(2025, 1, 1), datetime(2028, 2, 29)),
+])
+def test_cron_next_run(expression, after, expected):
+  assert CronSchedule(expression).next_run(after) == expected
+
+
+def test_cron_never_scheduled():
+  assert CronSchedule("0 0 31 2 *").next_run(datetime(2024, 1, 1)) is None
+
+
+@pytest.mark.parametrize("expression", [
+  "* * * *", "* * * * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8",
+  "5-1 * * * *", "*/0 * * * *", "a * * * *", "1-a * * * *",
+])
+def test_cron_invalid(expression):
+  with pytest.raises(ValueError):
+    CronSchedule(expression)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+  config = mock.Mock(
+    repos_config={"r1": {}, "r2": {}}, schedule=None, crontab_path=None, control_socket=str(tmp_path / "ctl.sock")
+  )
+  with mock.patch("borgdash_reporter.daemon.BorgReporter"):
+    yield ReporterDaemon(config)
+
+
+def test_requests_merged(daemon):
+  requests = [daemon.request_scan(["r1"]), daemon.request_scan(["r2", "r1"], force=True)]
+  merged = daemon._next_requests()
+  assert merged == requests
+  daemon._scan(merged)
+  daemon._reporter.scan_repos.assert_called_once_with(["r1", "r2"], True)
+  assert all(request.done.is_set() and request.error is None for request in requests)
+  assert daemon.status()["last_scan"]["repos"] == ["r1", "r2"]
+
+
+def test_requests_merged_all_repos(daemon):
+  daemon.request_scan(["r1"])
+  daemon.request_scan()
+  daemon._scan(daemon._next_requests())
+  daemon._reporter.scan_repos.assert_called_once_with(None, False)
+
+
+def test_scan_error_returned_to_requests(daemon):
+  daemon._reporter.scan_repos.side_effect = ReporterError("scan failed")
+  requests = [daemon.request_scan(["r1"]), daemon.request_scan(["r2"])]
+  daemon._scan(daemon._next_requests())
+  assert [request.error for request in requests] == ["scan failed", "scan failed"]
+  assert daemon.status()["last_scan"]["error"] == "scan failed"
+
+
+def test_stop_keeps_pending_requests(daemon):
+  request = daemon.request_scan(["r1"])
+  daemon.stop()
+  assert daemon._next_requests() == [request]
+  assert daemon._stopped.is_set()
+
+
+def test_no_requests_when_scheduled_scan_due(daemon):
+  daemon._next_run = datetime(2024, 1, 1)
+  assert daemon._next_requests() == []
+
+
+@pytest.mark.parametrize("request_data,error", [
+  ({"command": "rescan", "repos": "r1"}, "Invalid repos, expecting a list of repo names"),
+  ({"command": "rescan", "repos": ["r1", "r3"]}, "Unknown repos: ['r3']"),
+  ({"command": "unknown"}, "Unknown command: unknown"),
+])
+def test_invalid_requests(daemon, request_data, error):
+  assert daemon.handle_request(request_data) == {"status": "error", "error": error}
+  assert daemon._requests.empty()
+
+
+def test_rescan_request(daemon):
+  assert daemon.handle_request({"command": "rescan", "repos": ["r1"]}) == {"status": "queued"}
+  responses = []
+  waiting = threading.Thread(
+    target=lambda: responses.append(daemon.handle_request({"command": "rescan", "wait": True, "force": True}))
+  )
+  waiting.start()
+  requests = []
+  while len(requests) < 2:
+    requests += daemon._next_requests()
+  daemon._scan(requests)
+  waiting.join(5)
+  assert responses == [{"status": "success"}]
+  daemon._reporter.scan_repos.assert_called_once_with(None, True)
+
+
+def test_control_socket(daemon):
+  server = daemon._bind()
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+      client.connect(daemon._cfg.control_socket)
+      client.sendall(b'{"command": "status"}\nnot json\n[1]\n')
+      with client.makefile("rb") as responses:
+        status, not_json, not_object = (json.loads(responses.readline()) for _ in range(3))
+  finally:
+    server.shutdown()
+    server.server_close()
+  assert status["status"] == "idle" and status["pending"] == 0
+  assert not_json["status"] == "error" and not_json["error"].startswith("Invalid request")
+  assert not_object == {"status": "error", "error": "Invalid request: expecting a json object"}
+
+
+def test_control_socket_replaces_stale_socket(daemon):
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+    stale.bind(daemon._cfg.control_socket)
+  server = daemon._bind()
+  server.server_close()
+
+
+def test_control_socket_in_use(daemon):
+  server = ControlServer(daemon._cfg.control_socket, daemon)
+  try:
+    with pytest.raises(ReporterError, match="Another reporter daemon"):
+      daemon._bind()
+  finally:
+    server.server_close()
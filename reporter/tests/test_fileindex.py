@@ -0,0 +1,39 @@
+import pytest
+
+from borgdash_reporter.fileindex import BorgFileIndex
+
+
+def files(*paths):
+  return [{"path": path, "type": "-", "size": len(path), "mtime": "2024-01-01T10:00:00"} for path in paths]
+
+
+@pytest.fixture
+def index(tmp_path):
+  with BorgFileIndex(str(tmp_path / "index.sqlite")) as index:
+    yield index
+
+
+def test_add_archive_again(index):
+  index.add_archive("arch-1", "id1", "2024-01-01T10:00:00", files("etc/hosts", "etc/old.conf"))
+  index.add_archive("arch-2", "id2", "2024-01-02T10:00:00", files("etc/hosts"))
+  # Archive recreated with the same name, its previous files and the paths only in it are removed
+  assert index.add_archive("arch-1", "id3", "2024-01-03T10:00:00", files("etc/new.conf")) == 1
+  assert index.archives() == {"arch-1": "id3", "arch-2": "id2"}
+  assert index.stats() == {"archives": 2, "paths": 2, "files": 2}
+  assert index.search("old.conf") == []
+  found = index.search("etc")
+  assert [(path["path"], path["archives"]) for path in found] == [("etc/hosts", 1), ("etc/new.conf", 1)]
+  assert [found["archive"] for found in index.find("/etc/hosts")] == ["arch-2"]
+
+
+def test_add_archive_failed(index):
+  def failing_files():
+    yield from files("etc/other.conf")
+    raise OSError("borg list failed")
+
+  index.add_archive("arch-1", "id1", "2024-01-01T10:00:00", files("etc/hosts"))
+  with pytest.raises(OSError):
+    index.add_archive("arch-1", "id2", "2024-01-02T10:00:00", failing_files())
+  # Previous indexing kept
+  assert index.archives() == {"arch-1": "id1"}
+  assert [found["path"] for found in index.search("etc")] == ["etc/hosts"]
@@ -0,0 +1,77 @@
+import sys
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from borgdash_reporter.history import BorgHistory
+from borgdash_reporter.repo import BorgArchive, BorgLog, BorgRepo, BorgSize
+
+START = datetime(2024, 1, 1, 10, 0)
+
+
+def add_backup(repo, index, status=BorgLog.SUCCESS):
+  name = f"arch-{index}"
+  date_time = START + timedelta(days=index)
+  repo.archives[name] = BorgArchive(name, date_time, BorgSize(1000 * index, 500 * index, 10 * index), duration=60)
+  repo.logs[f"{name}.log"] = BorgLog(f"/logs/{name}.log", status, date_time, name)
+
+
+@pytest.fixture
+def repo():
+  repo = BorgRepo("repo", sys.executable, "/repo")
+  for index in range(3):
+    add_backup(repo, index)
+  repo.fingerprint = "state1"
+  return repo
+
+
+def rows(history, table):
+  return history._db.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+
+
+def test_record_scan(repo, tmp_path):
+  with BorgHistory(str(tmp_path / "history.sqlite")) as history:
+    history.record_scan([repo], START)
+    assert [row[1] for row in rows(history, "archives")] == ["arch-0", "arch-1", "arch-2"]
+    assert [(row[1], row[3]) for row in rows(history, "runs")] == [(f"arch-{i}.log", "success") for i in range(3)]
+
+    # New backup, and a running backup without status yet
+    add_backup(repo, 3)
+    repo.logs["running.log"] = BorgLog("/logs/running.log", BorgLog.DANGER)
+    repo.fingerprint = "state2"
+    history.record_scan([repo], START + timedelta(hours=1))
+    assert [row[1] for row in rows(history, "archives")] == ["arch-0", "arch-1", "arch-2", "arch-3"]
+    assert ("repo", "running.log", None, BorgLog.DANGER, None) in rows(history, "runs")
+
+    # Running backup done
+    repo.logs["running.log"] = BorgLog("/logs/running.log", BorgLog.WARNING, START + timedelta(days=4), "arch-4")
+    repo.fingerprint = "state3"
+    history.record_scan([repo], START + timedelta(hours=2))
+    run_time = int((START + timedelta(days=4)).timestamp())
+    assert rows(history, "runs")[-1][1:] == ("running.log", run_time, "warning", "arch-4")
+    assert history.failure_rate("repo") == 0.2
+    assert len(rows(history, "repo_stats")) == 3
+
+
+def test_record_scan_unchanged_repo(repo, tmp_path):
+  with BorgHistory(str(tmp_path / "history.sqlite")) as history:
+    history.record_scan([repo], START)
+    # Archives and runs of unchanged repos are not read again, their metrics are recorded at each scan
+    with mock.patch.object(repo, "iter_archives") as iter_archives, mock.patch.object(repo, "iter_logs") as iter_logs:
+      history.record_scan([repo], START + timedelta(hours=1))
+    iter_archives.assert_not_called()
+    iter_logs.assert_not_called()
+    assert len(rows(history, "repo_stats")) == 2
+
+
+def test_record_scan_new_archives_only(repo, tmp_path):
+  with BorgHistory(str(tmp_path / "history.sqlite")) as history:
+    history.record_scan([repo], START)
+    add_backup(repo, 3)
+    repo.fingerprint = "state2"
+    with mock.patch.object(history, "_db", wraps=history._db) as db:
+      history.record_scan([repo], START + timedelta(hours=1))
+    archives = [call.args[1] for call in db.executemany.call_args_list if "INTO archives" in call.args[0]]
+    # The last recorded archive, started at the same time as the new ones may be, and the new one
+    assert [[row[1] for row in rows] for rows in archives] == [["arch-2", "arch-3"]]
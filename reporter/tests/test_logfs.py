@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+from borgdash_reporter.logfs import host_from_path, reversed_lines
+
+LOG_CONTENTS = [
+  b"",
+  b"first\nsecond\nthird\n",
+  # No trailing newline
+  b"first\nsecond\nthird",
+  # Windows line endings, kept in the lines
+  b"first\r\nsecond\r\n",
+  # Lines longer than the blocks
+  b"short\n" + b"x" * 50 + b"\nend\n" + b"y" * 20,
+  b"\n\n\n",
+  # Multibyte characters split between blocks
+  "\u00e9t\u00e9\n\u00e0 \u00e9crire\n".encode(),
+]
+
+
+@pytest.mark.parametrize("path,host", [
+  (None, None),
+  ("/data/borg/repo", None),
+  ("relative/repo", None),
+  ("/data/repo:with:colons", None),
+  ("ssh://user@nas:2222/./repo", "nas"),
+  ("ssh://user@[fe80::1]/repo", "fe80::1"),
+  ("sshfs://user@nas:/logs", "nas"),
+  ("user@nas:repo", "nas"),
+  ("nas:/srv/repo", "nas"),
+  ("user@[fe80::1]:repo", "fe80::1"),
+])
+def test_host_from_path(path, host):
+  assert host_from_path(path) == host
+
+
+@pytest.mark.parametrize("content", LOG_CONTENTS)
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 16, 4096])
+def test_reversed_lines(content, block_size):
+  expected = list(reversed(content.decode().split("\n")))
+  assert list(reversed_lines(io.BytesIO(content), block_size)) == expected
+
+
+@pytest.mark.parametrize("content", LOG_CONTENTS)
+@pytest.mark.parametrize("block_size,max_bytes", [(1, 5), (3, 7), (4, 8), (16, 16)])
+def test_reversed_lines_max_bytes(content, block_size, max_bytes):
+  lines = list(reversed_lines(io.BytesIO(content), block_size, max_bytes))
+  expected = list(reversed(content.decode().split("\n")))
+  # Only complete lines, the last ones, read within max_bytes rounded up to a block
+  assert lines == expected[:len(lines)]
+  assert sum(len(line.encode()) + 1 for line in lines) - 1 <= max_bytes + block_size - 1
+  if len(content) <= max_bytes:
+    assert lines == expected
+
+
+def test_reversed_lines_reads_lazily():
+  content = b"".join(b"line %d\n" % i for i in range(1000))
+  f = io.BytesIO(content)
+  lines = reversed_lines(f, 64)
+  assert [next(lines) for _ in range(3)] == ["", "line 999", "line 998"]
+  assert f.tell() >= len(content) - 64
@@ -0,0 +1,129 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from borgdash_reporter.notifier import AlarmDispatcher, BorgNotifier
+
+
+class Notifier(BorgNotifier):
+  """Notifier recording the messages sent, failing the given number of times first, or always if None."""
+
+  def __init__(self, config, failures=0):
+    super().__init__(config)
+    self.failures = failures
+    self.messages = []
+    self.attempts = 0
+
+  def _send_message(self, message):
+    self.attempts += 1
+    if self.failures is None or self.attempts <= self.failures:
+      raise ConnectionError("Service unavailable")
+    self.messages.append(message)
+
+
+class Discord(Notifier):
+  pass
+
+
+class Webhook(Notifier):
+  pass
+
+
+def failed_repo(name, day=1):
+  return SimpleNamespace(name=name, last_run=SimpleNamespace(status="danger", date_time=datetime(2024, 1, day)))
+
+
+def alarm_time(day=1):
+  return int(datetime(2024, 1, day).timestamp())
+
+
+@pytest.fixture
+def config(tmp_path):
+  return mock.Mock(dedupe_path=str(tmp_path / "dedupe.json"))
+
+
+def notify(dispatcher, repos):
+  for repo in repos:
+    dispatcher.addWarning(repo)
+  dispatcher.notify()
+  assert dispatcher.wait(5)
+
+
+def read_dedupes(config):
+  with open(config.dedupe_path) as f:
+    return json.load(f)
+
+
+def test_dedupe_per_notifier(config):
+  discord, webhook = Discord(config), Webhook(config, failures=None)
+  dispatcher = AlarmDispatcher(config, [discord, webhook])
+  dispatcher.RETRIES = 0
+  notify(dispatcher, [failed_repo("r1"), failed_repo("r2")])
+  assert len(discord.messages) == 1 and webhook.messages == []
+  # Only the delivered alarms are recorded
+  assert read_dedupes(config) == {"Discord": {"r1": alarm_time(), "r2": alarm_time()}, "Webhook": {}}
+
+  # Next scan, the alarms are only sent again to the notifier that failed
+  webhook.failures = 0
+  notify(dispatcher, [failed_repo("r1"), failed_repo("r2")])
+  assert len(discord.messages) == 1 and len(webhook.messages) == 1
+  alarms = {"r1": alarm_time(), "r2": alarm_time()}
+  assert read_dedupes(config) == {"Discord": alarms, "Webhook": alarms}
+
+  # New failure of r2, r1 recovered and forgotten so that it alarms again on its next failure
+  notify(dispatcher, [failed_repo("r2", day=2)])
+  assert "r2" in discord.messages[-1] and "r1" not in discord.messages[-1] and len(webhook.messages) == 2
+  assert read_dedupes(config) == {notifier: {"r2": alarm_time(2)} for notifier in ["Discord", "Webhook"]}
+  notify(dispatcher, [failed_repo("r1"), failed_repo("r2", day=2)])
+  assert "r1" in discord.messages[-1] and "r2" not in discord.messages[-1]
+
+
+def test_dedupes_loaded(config):
+  with open(config.dedupe_path, "w") as f:
+    json.dump({"Discord": {"r1": alarm_time()}, "Webhook": {"r2": alarm_time()}}, f)
+  discord, webhook = Discord(config), Webhook(config)
+  notify(AlarmDispatcher(config, [discord, webhook]), [failed_repo("r1"), failed_repo("r2")])
+  assert ["r2" in message and "r1" not in message for message in discord.messages] == [True]
+  assert ["r1" in message and "r2" not in message for message in webhook.messages] == [True]
+
+
+def test_dedupes_of_all_notifiers_loaded(config):
+  # Files from previous versions have the alarms of all the notifiers
+  with open(config.dedupe_path, "w") as f:
+    json.dump({"r1": alarm_time()}, f)
+  discord, webhook = Discord(config), Webhook(config)
+  notify(AlarmDispatcher(config, [discord, webhook]), [failed_repo("r1")])
+  assert discord.messages == [] and webhook.messages == []
+  assert read_dedupes(config) == {"Discord": {"r1": alarm_time()}, "Webhook": {"r1": alarm_time()}}
+
+
+@pytest.mark.parametrize("failures,sent,delays", [
+  (0, True, []),
+  (2, True, [2.0, 4.0]),
+  (3, True, [2.0, 4.0, 8.0]),
+  (None, False, [2.0, 4.0, 8.0]),
+])
+def test_send_retries(config, failures, sent, delays):
+  notifier = Discord(config, failures)
+  dispatcher = AlarmDispatcher(config, [notifier])
+  with mock.patch("borgdash_reporter.notifier.time.sleep") as sleep:
+    assert dispatcher._send(notifier, [failed_repo("r1")]) is sent
+  assert [call.args[0] for call in sleep.call_args_list] == delays
+  assert notifier.attempts == len(delays) + 1
+  assert len(notifier.messages) == int(sent)
+
+
+def test_send_stops_at_failed_message(config):
+  notifier = Discord(config, failures=None)
+  notifier.MAX_MESSAGE_SIZE = 100
+  dispatcher = AlarmDispatcher(config, [notifier])
+  dispatcher.RETRIES = 1
+  repos = [failed_repo(f"repo-{index}") for index in range(5)]
+  assert len(notifier._build_messages(repos)) > 1
+  with mock.patch("borgdash_reporter.notifier.time.sleep"):
+    assert dispatcher._send(notifier, repos) is False
+  # The next messages are not attempted once one failed
+  assert notifier.attempts == 2
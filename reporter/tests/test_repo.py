@@ -0,0 +1,186 @@
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from borgdash_reporter.logfs import SshLogFs
+from borgdash_reporter.repo import BorgArchive, BorgLog, BorgRepo
+
+# Runs the remote command locally, ignoring the ssh options and destination
+FAKE_SSH = """#!/bin/sh
+for last; do :; done
+exec sh -c "$last"
+"""
+
+
+# borg create --stats --show-rc output
+STATS_LOG = """\
+2024-01-01 10:00:00 INFO Starting backup
+------------------------------------------------------------------------------
+Repository: /backups/repo
+Archive name: host-2024-01-01
+Archive fingerprint: 3f9a6c2b8d1e4f5a6b7c8d9e0f1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a
+Time (start): Mon, 2024-01-01 10:00:00
+Time (end):   Mon, 2024-01-01 11:02:03
+Duration: 1 hours 2 minutes 3.45 seconds
+Number of files: 123456
+Utilization of max. archive size: 0%
+------------------------------------------------------------------------------
+                       Original size      Compressed size    Deduplicated size
+This archive:               12.34 GB              8.76 GB            654.32 kB
+All archives:              123.45 GB             87.65 GB             12.34 GB
+
+                       Unique chunks         Total chunks
+Chunk index:                   12345               123456
+------------------------------------------------------------------------------
+2024-01-01 11:02:04 INFO terminating with success status, rc 0
+"""
+
+STATS = {
+  "size": 12340000000,
+  "csize": 8760000000,
+  "dsize": 654320,
+  "archive": {
+    "nfiles": 123456,
+    "start": "2024-01-01T10:00:00",
+    "end": "2024-01-01T11:02:03",
+    "duration": 3723,
+    "comment": "",
+    "name": "host-2024-01-01",
+    "id": "3f9a6c2b8d1e4f5a6b7c8d9e0f1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a",
+  },
+}
+
+
+def json_log(text: str, time: float) -> str:
+  """Text log lines as borg --log-json messages."""
+  message = {"type": "log_message", "time": time, "levelname": "INFO", "name": "borg.archiver"}
+  return "".join(json.dumps({**message, "message": line}) + "\n" for line in text.splitlines())
+
+
+def backup_log(archive: str, rc: int = 0, before: str = "", after: str = "") -> str:
+  return (
+    f"2024-01-01 10:00:00 INFO Creating archive\n{before}"
+    f"Archive name: {archive}\n"
+    f"2024-01-01 10:05:00 INFO terminating with {'success' if rc == 0 else 'warning'} status, rc {rc}\n{after}"
+  )
+
+
+@pytest.fixture
+def logs_dir(tmp_path):
+  logs = tmp_path / "logs"
+  logs.mkdir()
+  (logs / "short.log").write_text(backup_log("arch-1"))
+  # Status before the last 32 KiB, for example followed by the output of a prune
+  (logs / "long.log").write_text(backup_log("arch-2", rc=1, after="prune: keeping archive\n" * 2000))
+  # Status before the last 1 MiB, not found
+  (logs / "huge.log").write_text(backup_log("arch-3", after=("x" * 100 + "\n") * 12000))
+  (logs / "big_listing.log").write_text(backup_log("arch-4", before="A /etc/file\n" * 10000))
+  return logs
+
+
+def read_statuses(repo):
+  archives = {name: BorgArchive(name) for name in ["arch-1", "arch-2", "arch-3", "arch-4"]}
+  logs_scan = repo._read_logs(archives)
+  return {name: (borglog.status, borglog.archive_name) for name, borglog in logs_scan.logs.items()}
+
+
+def test_remote_logs_status_window(logs_dir, tmp_path, monkeypatch):
+  ssh = tmp_path / "ssh"
+  ssh.write_text(FAKE_SSH)
+  ssh.chmod(0o755)
+  monkeypatch.setattr(SshLogFs, "SSH_COMMAND", [str(ssh)])
+  local = BorgRepo("repo", sys.executable, "/repo", str(logs_dir))
+  remote = BorgRepo("repo", sys.executable, "/repo", f"ssh://host{logs_dir}")
+  with mock.patch.object(SshLogFs, "fetch_logs", autospec=True, side_effect=SshLogFs.fetch_logs) as fetch_logs:
+    statuses = read_statuses(remote)
+  assert statuses == read_statuses(local)
+  assert statuses == {
+    "short.log": (BorgLog.SUCCESS, "arch-1"),
+    "long.log": (BorgLog.WARNING, "arch-2"),
+    "huge.log": (BorgLog.DANGER, None),
+    "big_listing.log": (BorgLog.SUCCESS, "arch-4"),
+  }
+  # Only the large logs without status in their tail are fetched again
+  assert fetch_logs.call_count == 2
+  _, refetched, tail_size = fetch_logs.call_args.args
+  assert sorted(Path(logfile).name for logfile in refetched) == ["huge.log", "long.log"]
+  assert tail_size == BorgLog.MAX_TAIL_SCAN
+
+
+def parse_log(tmp_path, content, name="backup.log"):
+  (tmp_path / name).write_text(content)
+  borglog = BorgLog(tmp_path / name)
+  return borglog.status, borglog.date_time, borglog.archive_name, borglog.stats
+
+
+def test_log_stats(tmp_path):
+  assert parse_log(tmp_path, STATS_LOG) == (BorgLog.SUCCESS, datetime(2024, 1, 1, 11, 2, 4), "host-2024-01-01", STATS)
+
+
+def test_log_stats_json(tmp_path):
+  lines = [line for line in STATS_LOG.splitlines() if not line.startswith("2024-")]
+  content = json_log("\n".join(lines), 1704103000) + json_log("terminating with warning status, rc 1", 1704103324.5)
+  assert parse_log(tmp_path, content) == (
+    BorgLog.WARNING, datetime.fromtimestamp(1704103324), "host-2024-01-01", STATS
+  )
+
+
+def test_log_stats_crlf(tmp_path):
+  assert parse_log(tmp_path, STATS_LOG.replace("\n", "\r\n"))[3] == STATS
+
+
+def test_log_without_stats(tmp_path):
+  # Backup without --stats, or failed before the stats
+  assert parse_log(tmp_path, backup_log("arch-1")) == (BorgLog.SUCCESS, datetime(2024, 1, 1, 10, 5), "arch-1", None)
+  failed = "2024-01-01 10:00:00 INFO Starting backup\n2024-01-01 10:00:01 ERROR terminating with error status, rc 2\n"
+  assert parse_log(tmp_path, failed) == (BorgLog.DANGER, datetime(2024, 1, 1, 10, 0, 1), None, None)
+
+
+# Stats lines values by label, as parsed from the log
+STATS_LINES = {
+  "This archive": "1.00 GB 500.00 MB 1.50 kB",
+  "Time (start)": "Mon, 2024-01-01 10:00:00",
+  "Time (end)": "Mon, 2024-01-01 11:02:03",
+  "Number of files": "10",
+}
+
+
+@pytest.mark.parametrize("duration,expected", [
+  ("1 hours 2 minutes 3.45 seconds", 3723),
+  ("2 days 1 hour", 176400),
+  ("1 minute 0.00 seconds", 60),
+  ("0.52 seconds", 0),
+  # Duration missing or in another format, from the start and end times
+  (None, 3723),
+  ("unknown", 3723),
+])
+def test_stats_duration(duration, expected):
+  lines = dict(STATS_LINES)
+  if duration:
+    lines["Duration"] = duration
+  stats = BorgLog._stats_info("arch", lines)
+  assert stats["archive"]["duration"] == expected
+  assert (stats["size"], stats["csize"], stats["dsize"]) == (1000000000, 500000000, 1500)
+  # No fingerprint in the stats of old borg versions
+  assert stats["archive"]["id"] is None
+
+
+@pytest.mark.parametrize("missing", ["This archive", "Time (start)", "Time (end)", "Number of files"])
+def test_stats_incomplete(missing):
+  lines = dict(STATS_LINES)
+  del lines[missing]
+  assert BorgLog._stats_info("arch", lines) is None
+
+
+@pytest.mark.parametrize("field,value", [
+  ("This archive", "1.00 GB 500.00 MB"),
+  ("This archive", "1.00 XB 500.00 MB 1.50 kB"),
+  ("Time (start)", "Mon, yesterday"),
+  ("Number of files", "many"),
+])
+def test_stats_invalid(field, value):
+  assert BorgLog._stats_info("arch", {**STATS_LINES, field: value}) is None
@@ -0,0 +1,110 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from borgdash_reporter.reportformat import decode_compact, decode_json_summaries, encode_compact
+
+
+def make_log(name, directory="/logs/repo/", date_time="2024-01-01T10:05:00", status="success", archive=None):
+  return {"name": name, "fullpath": f"{directory}{name}", "datetime": date_time, "status": status, "archive": archive}
+
+
+def make_archive(index, sizes=True, log=True):
+  name = f"arch-{index:04d}"
+  return {
+    "name": name,
+    "id": f"{index:064x}",
+    # Written with isoformat() like in the reports, without microseconds when 0
+    "datetime": datetime(2024, 1, index % 28 + 1, 10, 0, 0, index).isoformat(),
+    "datetime_end": f"2024-01-{index % 28 + 1:02d}T10:05:00",
+    "duration": 300 + index,
+    "comment": "",
+    "nfiles": index * 10,
+    "sizes": {"osize": index * 1000, "csize": index * 500, "dsize": index * 10} if sizes else None,
+    "log": make_log(f"log{index}.log", archive=name) if log else None,
+  }
+
+
+def make_repo(name, archives):
+  logfiles = {archive["log"]["name"]: archive["log"] for archive in archives.values() if archive["log"]}
+  failed = make_log("failed é.log", "/other logs/", "2024-02-01T08:00:00+02:00", "danger")
+  logfiles[failed["name"]] = failed
+  return {
+    "name": name,
+    "repopath": f"ssh://user@nas/repos/{name}",
+    "logspath": "/logs/repo",
+    "sizes": {"osize": 10, "csize": 5, "dsize": 2},
+    "chunks": 7,
+    "archives": archives,
+    "logfiles": logfiles,
+    "script": None,
+    "last_run": failed,
+    "last_backup": archives[max(archives)] if archives else None,
+    "status": False,
+    "fingerprint": "2d8515089ddac32990456d5d7bc36a78da500e42",
+    "scan_status": "scanned",
+    "last_scan": "2024-02-01T09:00:00.123456",
+    "aggregates": {"totals": {"archives": len(archives), "success_rate": 0.75}, "daily": {"archives": [1, None]}},
+  }
+
+
+def without_details(report):
+  summaries = json.loads(json.dumps(report))
+  for repo in summaries["repos"].values():
+    repo.pop("archives", None)
+    repo.pop("logfiles", None)
+  return summaries
+
+
+@pytest.fixture
+def report():
+  archives = {archive["name"]: archive for archive in map(make_archive, range(30))}
+  # Archives without sizes, without log, and without times
+  archives["arch-0003"]["sizes"] = None
+  archives["arch-0004"]["log"] = None
+  archives["arch-0005"].update({"datetime": None, "datetime_end": None})
+  # Log of an archive missing from the logs, with a time zone
+  archives["arch-0006"]["log"] = make_log("moved.log", "/moved/", "2024-01-07T10:05:00+01:00", "warning", "arch-0006")
+  repos = {"repo1": make_repo("repo1", archives), "empty": make_repo("empty", {})}
+  repos["noscan"] = {"name": "noscan", "repopath": "/repos/noscan", "status": None, "scan_status": None}
+  return {"timestamp": "2024-02-01T09:00:00.123456", "partial": False, "repos": repos}
+
+
+def test_compact_round_trip(report):
+  data = encode_compact(report)
+  # Same report as the json report, once encoded
+  assert decode_compact(data) == json.loads(json.dumps(report))
+  assert len(data) < len(json.dumps(report).encode())
+
+
+def test_compact_summaries(report):
+  assert decode_compact(encode_compact(report), details=False) == without_details(report)
+
+
+def test_compact_invalid():
+  with pytest.raises(ValueError):
+    decode_compact(json.dumps({"repos": {}}).encode())
+
+
+@pytest.mark.parametrize("dump_args", [{}, {"indent": 2}, {"separators": (",", ":")}, {"ensure_ascii": False}])
+def test_json_summaries(report, dump_args):
+  # Keys escaped or named like the details outside of the repos are kept
+  report["archives"] = {"key \\\"quoted\\\"": [1, {"logfiles": None}]}
+  assert decode_json_summaries(json.dumps(report, **dump_args)) == without_details(report)
+
+
+@pytest.mark.parametrize("text,expected", [
+  ('{}', {}),
+  (' { "repos" : { } } ', {"repos": {}}),
+  ('{"repos": null, "version": 1}', {"repos": None, "version": 1}),
+  ('{"repos": {"r": {}}}', {"repos": {"r": {}}}),
+])
+def test_json_summaries_minimal(text, expected):
+  assert decode_json_summaries(text) == expected
+
+
+@pytest.mark.parametrize("text", ['', '[]', '{"repos": {"r": {"archives": [}}}', '{"repos" {}}', '{"a": 1,}', "{'a': 1}"])
+def test_json_summaries_invalid(text):
+  with pytest.raises(ValueError):
+    decode_json_summaries(text)
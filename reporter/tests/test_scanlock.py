@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import borgdash_reporter
+from borgdash_reporter.scanlock import ScanLock
+
+# Reporter process scanning the report, holding the scan lock until the release file exists
+SCANNER = """
+import json, os, sys, time
+from borgdash_reporter.scanlock import ScanLock
+report, repos, release = sys.argv[1:]
+with ScanLock(report).scan(repos.split(",") if repos else None) as stats:
+  print(json.dumps({"start": time.time(), "stats": stats}), flush=True)
+  while stats is not None and not os.path.exists(release):
+    time.sleep(0.01)
+  end = time.time()
+print(json.dumps({"end": end}), flush=True)
+"""
+
+
+class Scanner:
+  def __init__(self, report, repos, release):
+    env = {**os.environ, "PYTHONPATH": str(Path(borgdash_reporter.__file__).parent.parent)}
+    self.proc = subprocess.Popen(
+      [sys.executable, "-c", SCANNER, report, repos, release], stdout=subprocess.PIPE, text=True, env=env
+    )
+
+  def started(self):
+    return json.loads(self.proc.stdout.readline())
+
+  def ended(self):
+    end = json.loads(self.proc.stdout.readline())["end"]
+    assert self.proc.wait(5) == 0
+    return end
+
+
+@pytest.fixture
+def report(tmp_path):
+  return str(tmp_path / "report.json")
+
+
+def wait_for_waiting(report, count):
+  for _ in range(500):
+    try:
+      with open(f"{report}.scans") as f:
+        if json.load(f).get("waiting") == count:
+          return
+    except (OSError, ValueError):
+      pass
+    time.sleep(0.01)
+  pytest.fail(f"{count} scans not waiting")
+
+
+def test_scan_blocked_by_other_process(report, tmp_path):
+  release = tmp_path / "release"
+  first = Scanner(report, "r1,r2", str(release))
+  assert first.started()["stats"] == {
+    "wait_seconds": pytest.approx(0, abs=1), "coalesced_requests": 0, "follow_up": False, "total_coalesced": 0
+  }
+  second = Scanner(report, "r1", str(release))
+  wait_for_waiting(report, 1)
+  release.touch()
+  first_end = first.ended()
+  # Requested during the first scan, which may have missed changes, scanned again once it's done
+  started = second.started()
+  assert started["start"] >= first_end
+  assert started["stats"]["follow_up"] is True
+  second.ended()
+
+
+def test_waiting_scans_coalesced(report, tmp_path):
+  release = tmp_path / "release"
+  first = Scanner(report, "", str(release))
+  first.started()
+  waiting = [Scanner(report, "", str(release)), Scanner(report, "", str(release))]
+  wait_for_waiting(report, 2)
+  release.touch()
+  first.ended()
+  # A single follow-up scan for both waiting requests
+  results = []
+  for scanner in waiting:
+    results.append(scanner.started()["stats"])
+    scanner.ended()
+  assert results.count(None) == 1
+  scanned = next(stats for stats in results if stats)
+  assert scanned["follow_up"] is True and scanned["coalesced_requests"] == 1
+  with open(f"{report}.scans") as f:
+    state = json.load(f)
+  assert state["coalesced"] == 1 and state["waiting"] == 0 and state["last"]["repos"] is None
+
+
+@pytest.mark.parametrize("scan,repos,force,covered", [
+  ({"repos": None}, None, False, True),
+  ({"repos": None}, ["r1"], False, True),
+  ({"repos": ["r1", "r2"]}, ["r1"], False, True),
+  ({"repos": ["r1"]}, ["r1", "r2"], False, False),
+  ({"repos": ["r1"]}, None, False, False),
+  # Forced requests are only covered by forced scans
+  ({"repos": None}, ["r1"], True, False),
+  ({"repos": None, "force": True}, ["r1"], True, True),
+  ({"repos": ["r1"], "force": True}, ["r1"], False, True),
+  ({}, None, False, True),
+])
+def test_scan_covers_request(scan, repos, force, covered):
+  assert ScanLock._covers(scan, repos, force) is covered